@@ -0,0 +1,76 @@
+# encoding: utf-8
+"""
+Compares SOAP serialization and response parsing of the zeep and the fast
+engine, without network.
+
+    python benchmarks/bench_engine.py [number]
+"""
+import sys
+import timeit
+
+from lxml import etree
+from requests import Response
+
+from paytpv.builder import RequestBuilder
+from paytpv.engine import compile_operations
+from paytpv.wsdl import WsdlCache
+from paytpv.wsdl import create_client
+
+
+SETTINGS = {
+    "MERCHANTCODE": "code",
+    "MERCHANTPASSWORD": "password",
+    "MERCHANTTERMINAL": "1",
+    "PAYTPVURL": "https://secure.paytpv.com/gateway/xml-bankstore",
+    "PAYTPVWSDL": "https://secure.paytpv.com/gateway/xml-bankstore?wsdl",
+}
+
+RESPONSE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:ns1="https://secure.paytpv.com/gateway/xml-bankstore">
+<SOAP-ENV:Body><ns1:execute_purchaseResponse>
+<DS_MERCHANT_AMOUNT>3300</DS_MERCHANT_AMOUNT>
+<DS_MERCHANT_ORDER>order</DS_MERCHANT_ORDER>
+<DS_MERCHANT_CURRENCY>EUR</DS_MERCHANT_CURRENCY>
+<DS_MERCHANT_AUTHCODE>authcode</DS_MERCHANT_AUTHCODE>
+<DS_MERCHANT_CARDCOUNTRY>724</DS_MERCHANT_CARDCOUNTRY>
+<DS_RESPONSE>1</DS_RESPONSE>
+<DS_ERROR_ID>0</DS_ERROR_ID>
+</ns1:execute_purchaseResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>"""
+
+
+def main(number=2000):
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    data = builder.execute_purchase("1", "token", 33, "order")
+    client = create_client(SETTINGS, cache=WsdlCache(ttl=None))
+    binding = client.service._binding
+    operation = binding.get("execute_purchase")
+    fast = compile_operations(binding)["execute_purchase"]
+
+    response = Response()
+    response._content = RESPONSE
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/xml"
+
+    def zeep_serialize():
+        etree.tostring(client.create_message(client.service, "execute_purchase", **data))
+
+    def zeep_parse():
+        binding.process_reply(client, operation, response)
+
+    cases = [
+        ("serialize", zeep_serialize, lambda: fast.serialize(data)),
+        ("parse", zeep_parse, lambda: fast.parse(RESPONSE)),
+    ]
+    print("%-10s %12s %12s %8s" % ("", "zeep (us)", "fast (us)", "speedup"))
+    for name, zeep_case, fast_case in cases:
+        zeep_time = min(timeit.repeat(zeep_case, number=number, repeat=3)) / number
+        fast_time = min(timeit.repeat(fast_case, number=number, repeat=3)) / number
+        print(
+            "%-10s %12.1f %12.1f %7.1fx"
+            % (name, zeep_time * 1e6, fast_time * 1e6, zeep_time / fast_time)
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,319 @@
+# encoding: utf-8
+"""
+Microbenchmarks of the parts of a call.
+
+    python benchmarks/suite.py                 # run and print
+    python benchmarks/suite.py -k sign --save  # save to results/<commit>.json
+    python benchmarks/suite.py --compare results/abc1234.json
+
+Times are microseconds per call, best of 'repeat' runs.
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from lxml import etree
+from requests import Response
+
+from bench_engine import RESPONSE
+from bench_engine import SETTINGS
+from paytpv.builder import RequestBuilder
+from paytpv.cassette import Cassette
+from paytpv.cassette import CassetteTransport
+from paytpv.client import PaytpvClient
+from paytpv.engine import compile_operations
+from paytpv.hooks import Hook
+from paytpv.links import generate_links
+from paytpv.notifications import NotificationVerifier
+from paytpv.testing import FakeBankstore
+from paytpv.testing import FakeBankstoreServer
+from paytpv.wsdl import WsdlCache
+from paytpv.wsdl import create_client
+
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    Registers a setup function returning the callable to time, or a
+    generator yielding it and cleaning up after the benchmark
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@benchmark("builder.add_user")
+def bench_add_user():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    return lambda: builder.add_user("4539232076648253", "0530", "123", "name")
+
+
+@benchmark("builder.info_user")
+def bench_info_user():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    return lambda: builder.info_user("1", "token")
+
+
+@benchmark("builder.execute_purchase")
+def bench_execute_purchase():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    return lambda: builder.execute_purchase("1", "token", 33, "order")
+
+
+@benchmark("builder.execute_refund")
+def bench_execute_refund():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    return lambda: builder.execute_refund("1", "token", 33, "order", "authcode")
+
+
+@benchmark("builder.signature")
+def bench_signature():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    data = builder.info_user("1", "token")
+    fields = ["DS_MERCHANT_MERCHANTCODE", "DS_IDUSER", "DS_TOKEN_USER", "DS_MERCHANT_TERMINAL"]
+    return lambda: builder.signature(data, fields)
+
+
+@benchmark("builder.iframe_signature")
+def bench_iframe_signature():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    data = {"MERCHANT_MERCHANTCODE": "code", "IDUSER": "1", "TOKEN_USER": "token"}
+    return lambda: builder.iframe_signature(data, list(data))
+
+
+@benchmark("builder.get_iframe_url")
+def bench_get_iframe_url():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    return lambda: builder.get_iframe_url(
+        "1", "token", 33, "order", "ES", "https://ok", "https://ko"
+    )
+
+
+@benchmark("links.generate_links")
+def bench_generate_links():
+    records = [
+        {"idpayuser": str(i), "tokenpayuser": "token", "amount": 33, "order": "o%d" % i}
+        for i in range(100)
+    ]
+
+    def run():
+        for _ in generate_links(
+            SETTINGS, records, language="ES", urlok="https://ok", urlko="https://ko"
+        ):
+            pass
+
+    return run
+
+
+@benchmark("notifications.check")
+def bench_notification_check():
+    verifier = NotificationVerifier(SETTINGS)
+    data = {
+        "TransactionType": "1",
+        "Order": "order",
+        "Response": "OK",
+        "Currency": "EUR",
+        "Amount": "3300",
+        "AccountCode": SETTINGS["MERCHANTCODE"],
+        "TpvID": SETTINGS["MERCHANTTERMINAL"],
+        "BankDateTime": "20261018120000",
+    }
+    data["Signature"] = verifier.sign(data)
+    payload = urlencode(data).encode()
+    return lambda: verifier.check(payload)
+
+
+@benchmark("client.dispatch")
+def bench_dispatch():
+    client = PaytpvClient(SETTINGS, "1.2.3.4")
+    res = SimpleNamespace(DS_ERROR_ID=0)
+    client.send = lambda method_name, data, timer=None: res
+    return lambda: client.info_user("1", "token")
+
+
+@benchmark("client.dispatch.hooks")
+def bench_dispatch_hooks():
+    client = PaytpvClient(SETTINGS, "1.2.3.4", hooks=[Hook()])
+    res = SimpleNamespace(DS_ERROR_ID=0)
+    client.send = lambda method_name, data, timer=None: res
+    return lambda: client.info_user("1", "token")
+
+
+@benchmark("zeep.serialize")
+def bench_zeep_serialize():
+    client = create_client(SETTINGS, cache=WsdlCache(ttl=None))
+    data = RequestBuilder(SETTINGS, "1.2.3.4").execute_purchase("1", "token", 33, "order")
+    return lambda: etree.tostring(
+        client.create_message(client.service, "execute_purchase", **data)
+    )
+
+
+@benchmark("zeep.parse")
+def bench_zeep_parse():
+    client = create_client(SETTINGS, cache=WsdlCache(ttl=None))
+    binding = client.service._binding
+    operation = binding.get("execute_purchase")
+    response = Response()
+    response._content = RESPONSE
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/xml"
+    return lambda: binding.process_reply(client, operation, response)
+
+
+@benchmark("fast.serialize")
+def bench_fast_serialize():
+    data = RequestBuilder(SETTINGS, "1.2.3.4").execute_purchase("1", "token", 33, "order")
+    client = create_client(SETTINGS, cache=WsdlCache(ttl=None))
+    operation = compile_operations(client.service._binding)["execute_purchase"]
+    return lambda: operation.serialize(data)
+
+
+@benchmark("fast.parse")
+def bench_fast_parse():
+    client = create_client(SETTINGS, cache=WsdlCache(ttl=None))
+    operation = compile_operations(client.service._binding)["execute_purchase"]
+    return lambda: operation.parse(RESPONSE)
+
+
+def _stub_info_user(engine):
+    server = FakeBankstoreServer(FakeBankstore("MERCHANT", "PASSWORD", ["1"])).start()
+    try:
+        client = PaytpvClient(server.settings(), "1.2.3.4", engine=engine)
+        try:
+            user = client.add_user("4539232076648253", "0530", "123", "name")
+            yield lambda: client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+        finally:
+            client.close()
+    finally:
+        server.stop()
+
+
+@benchmark("stub.zeep.info_user")
+def bench_stub_zeep():
+    return _stub_info_user("zeep")
+
+
+@benchmark("stub.fast.info_user")
+def bench_stub_fast():
+    return _stub_info_user("fast")
+
+
+@benchmark("replay.zeep.info_user")
+def bench_replay():
+    fd, path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    try:
+        server = FakeBankstoreServer(FakeBankstore("MERCHANT", "PASSWORD", ["1"])).start()
+        try:
+            with Cassette(path) as cassette:
+                client = PaytpvClient(
+                    server.settings(),
+                    "1.2.3.4",
+                    transport=CassetteTransport(cassette, "record"),
+                )
+                user = client.add_user("4539232076648253", "0530", "123", "name")
+                client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+        finally:
+            server.stop()
+        client = PaytpvClient(
+            server.settings(), "1.2.3.4", transport=CassetteTransport(Cassette(path))
+        )
+    finally:
+        os.remove(path)
+    return lambda: client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+
+
+def run(pattern=None, number=None, repeat=3):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        func = generator = setup()
+        if inspect.isgenerator(generator):
+            func = next(generator)
+        try:
+            n = number
+            if n is None:
+                # About 0.2s per run
+                n, _ = timeit.Timer(func).autorange()
+            best = min(timeit.repeat(func, number=n, repeat=repeat)) / n
+        finally:
+            if inspect.isgenerator(generator):
+                generator.close()
+        results[name] = best * 1e6
+        print("%-28s %12.2f" % (name, results[name]))
+    return results
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(results, path=None):
+    data = {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    path = path or os.path.join(RESULTS, data["commit"] + ".json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare(results, path):
+    with open(path) as f:
+        old = json.load(f)
+    print("\n%-28s %12s %12s %8s" % ("vs " + old["commit"], "before", "after", "change"))
+    for name, value in results.items():
+        before = old["results"].get(name)
+        if before is None:
+            continue
+        print(
+            "%-28s %12.2f %12.2f %+7.1f%%"
+            % (name, before, value, (value - before) / before * 100)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-k", dest="pattern", help="regex of benchmarks to run")
+    parser.add_argument("-n", dest="number", type=int, help="calls per run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", nargs="?", const="", help="save results to file")
+    parser.add_argument("--compare", help="results file to compare with")
+    args = parser.parse_args(argv)
+
+    print("%-28s %12s" % ("benchmark", "us/call"))
+    results = run(args.pattern, args.number, args.repeat)
+    if args.save is not None:
+        print("\nSaved to %s" % save(results, args.save or None))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
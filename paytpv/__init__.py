@@ -1 +1,21 @@
-from .client import PaytpvClient, PaytpvAsyncClient, PaytpvException
+# Names are imported on first use, so "import paytpv.builder" doesn't load
+# the SOAP clients and zeep
+_exports = {
+    "PaytpvClient": "paytpv.client",
+    "PaytpvAsyncClient": "paytpv.client",
+    "PaytpvException": "paytpv.exc",
+    "RequestBuilder": "paytpv.builder",
+    "get_client": "paytpv.registry",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module 'paytpv' has no attribute %r" % name)
+    import importlib
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
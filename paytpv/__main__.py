@@ -0,0 +1,7 @@
+# encoding: utf-8
+import sys
+
+from paytpv.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,77 @@
+# encoding: utf-8
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from itertools import islice
+
+
+def run_many(func, requests, concurrency=10, key="order"):
+    """
+    Calls func(**request) for every request on a thread pool, with at most
+    'concurrency' calls in flight. Requests are read from the iterable only
+    when there is room for them.
+
+    Yields (request[key], result) as calls complete, result being the
+    exception raised by the call when it failed.
+    """
+    requests = iter(requests)
+    pending = {}
+    executor = ThreadPoolExecutor(concurrency)
+
+    def submit():
+        for request in islice(requests, concurrency - len(pending)):
+            pending[executor.submit(func, **request)] = request[key]
+
+    try:
+        submit()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                yield pending.pop(future), error if error else future.result()
+            submit()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+async def _aiter(requests):
+    for request in requests:
+        yield request
+
+
+async def arun_many(func, requests, concurrency=10, key="order"):
+    """
+    Async version of run_many, 'func' is a coroutine function and
+    'requests' an iterable or async iterable.
+    """
+    import asyncio
+
+    if not hasattr(requests, "__aiter__"):
+        requests = _aiter(requests)
+    requests = requests.__aiter__()
+    pending = {}
+    exhausted = False
+
+    async def submit():
+        nonlocal exhausted
+        while not exhausted and len(pending) < concurrency:
+            try:
+                request = await requests.__anext__()
+            except StopAsyncIteration:
+                exhausted = True
+            else:
+                pending[asyncio.ensure_future(func(**request))] = request[key]
+
+    try:
+        await submit()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                yield pending.pop(task), error if error else task.result()
+            await submit()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+Request data, signatures and iframe urls of the bankstore operations.
+
+Only uses the standard library, import it to sign requests or build
+payment links without loading zeep.
+"""
+import re
+from functools import lru_cache
+from hashlib import md5, sha1
+from html import escape
+from urllib.parse import quote
+
+from paytpv.operations import SPECS
+
+
+# Characters quote() leaves unencoded
+_UNRESERVED = re.compile(r"[A-Za-z0-9_.~-]*")
+
+
+def quote_param(value):
+    """
+    Url-encodes a query parameter value
+    """
+    if _UNRESERVED.fullmatch(value):
+        return value
+    return quote(value, safe="")
+
+
+# language, urlok and urlko repeat between calls
+_quote_cached = lru_cache(maxsize=256)(quote_param)
+
+
+class RequestBuilder:
+    def __init__(self, settings, ip=None):
+        """
+        """
+        self.ip = ip
+        self.MERCHANTCODE = settings["MERCHANTCODE"]
+        self.MERCHANTPASSWORD = settings["MERCHANTPASSWORD"]
+        self.MERCHANTTERMINAL = settings["MERCHANTTERMINAL"]
+        self.PAYTPVURL = settings["PAYTPVURL"]
+        self.PAYTPVWSDL = settings["PAYTPVWSDL"]
+        self.MERCHANTPASSWORD_MD5 = md5(self.MERCHANTPASSWORD.encode()).hexdigest()
+        self._iframe_prefix = md5(self.MERCHANTCODE.encode())
+        self._iframe_url = (
+            "https://secure.paytpv.com/gateway/bnkgateway.php?MERCHANT_MERCHANTCODE=%s"
+            "&MERCHANT_TERMINAL=%s&OPERATION=109"
+            % (quote_param(self.MERCHANTCODE), quote_param(self.MERCHANTTERMINAL))
+        )
+
+        # add_user, info_user, remove_user, execute_purchase, execute_refund
+        for name, spec in SPECS.items():
+            setattr(self, name, spec.compile(self, settings))
+
+    def original_ip(self, ip):
+        """
+        IP del cliente para la llamada, por defecto la del builder
+        """
+        return self.ip if ip is None else ip
+
+    def signature(self, data, suma_ds):
+        """
+        """
+        suma = "".join(map(data.get, suma_ds))
+        suma = suma + self.MERCHANTPASSWORD
+        return sha1(suma.encode()).hexdigest()
+
+    def iframe_signature(self, data, signature):
+        """
+        """
+        suma = "".join(map(data.get, signature))
+        suma = suma + self.MERCHANTPASSWORD_MD5
+        return md5(suma.encode()).hexdigest()
+
+    def get_iframe_url(
+        self, idpayuser, tokenpayuser, amount, order, language, urlok, urlko, ip=None
+    ):
+        """
+        * Retorna el codi html del iframe per fer un cobrament securitzat.
+        * Operació 109, execute_purchase_token: cobrament a un usuari ja existent.
+
+        Cálculo firma:
+        md5(MERCHANT_MERCHANTCODE + IDUSER + TOKEN_USER + MERCHANT_TERMINAL
+        + OPERATION + MERCHANT_ORDER + MERCHANT_AMOUNT + MERCHANT_CURRENCY + md5(PASSWORD))
+
+        Los parámetros se codifican para la url.
+        """
+        if amount <= 0:
+            raise ValueError(
+                u"paytpv.getSecureIframe(): el importe debe ser positivo: %s" % (amount)
+            )
+        s_amount = str(int(round(amount * 100, 0)))
+        if len(order) > 20:
+            raise ValueError(
+                u"paytpv.getSecureIframe(): la longitud máxima de order es 20: %s"
+                % (order)
+            )
+
+        # Same as iframe_signature(), from the precomputed merchant code state
+        signature = self._iframe_prefix.copy()
+        signature.update(
+            (
+                idpayuser
+                + tokenpayuser
+                + self.MERCHANTTERMINAL
+                + "109"
+                + order
+                + s_amount
+                + "EUR"
+                + self.MERCHANTPASSWORD_MD5
+            ).encode()
+        )
+        return "".join(
+            [
+                self._iframe_url,
+                "&LANGUAGE=",
+                _quote_cached(language),
+                "&MERCHANT_MERCHANTSIGNATURE=",
+                signature.hexdigest(),
+                "&MERCHANT_ORDER=",
+                quote_param(order),
+                "&MERCHANT_AMOUNT=",
+                s_amount,
+                "&MERCHANT_CURRENCY=EUR&IDUSER=",
+                quote_param(idpayuser),
+                "&TOKEN_USER=",
+                quote_param(tokenpayuser),
+                "&3DSECURE=1&URLOK=",
+                _quote_cached(urlok),
+                "&URLKO=",
+                _quote_cached(urlko),
+            ]
+        )
+
+    def get_secure_iframe(
+        self, idpayuser, tokenpayuser, amount, order, language, urlok, urlko, ip=None
+    ):
+        url = self.get_iframe_url(
+            idpayuser, tokenpayuser, amount, order, language, urlok, urlko, ip
+        )
+        return (
+            """<iframe id="secure_iframe"
+                title="Secure payment"
+                allowtransparency="true"
+                frameborder="0"
+                style="background: #FFFFFF; width:100%%; height:600px"
+                src="%s"></iframe>"""
+            % escape(url)
+        )
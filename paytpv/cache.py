@@ -0,0 +1,123 @@
+# encoding: utf-8
+import threading
+import time
+from collections import OrderedDict
+
+from paytpv import forks
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with ttl, thread safe.
+
+    Backends of UserCache implement get(key), set(key, value), delete(key)
+    and clear(), get returning None for missing or expired keys.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    """
+    Caches info_user responses by merchant, terminal, user and token.
+    remove_user and add_user calls drop the entry of their user.
+
+    Drops are versioned: an info_user sent before a drop of its user, and
+    answered after it, is not cached. Versions are kept in the process for
+    the last 'max_invalidations' drops.
+    """
+
+    def __init__(self, backend=None, max_invalidations=10000):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.max_invalidations = max_invalidations
+        self._version = 0
+        # key: version of its last drop, oldest first
+        self._invalidated = OrderedDict()
+        # Newest version forgotten from _invalidated
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def key(self, data, idpayuser, tokenpayuser):
+        return (
+            data["DS_MERCHANT_MERCHANTCODE"],
+            data["DS_MERCHANT_TERMINAL"],
+            idpayuser,
+            tokenpayuser,
+        )
+
+    def version(self):
+        """
+        Current version, taken before sending a call to pass to update()
+        """
+        return self._version
+
+    def get(self, method_name, data):
+        if method_name == "info_user":
+            return self.backend.get(
+                self.key(data, data["DS_IDUSER"], data["DS_TOKEN_USER"])
+            )
+
+    def invalidate(self, key):
+        with self._lock:
+            self.backend.delete(key)
+            self._version += 1
+            self._invalidated[key] = self._version
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_invalidations:
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def update(self, method_name, data, res, version=None):
+        """
+        Updates the cache with the response of a call sent at 'version'
+        """
+        if method_name == "info_user":
+            key = self.key(data, data["DS_IDUSER"], data["DS_TOKEN_USER"])
+            with self._lock:
+                if version is None or self._invalidated.get(key, self._forgotten) <= version:
+                    self.backend.set(key, res)
+        elif method_name == "remove_user":
+            self.invalidate(self.key(data, data["DS_IDUSER"], data["DS_TOKEN_USER"]))
+        elif method_name == "add_user":
+            self.invalidate(self.key(data, res.DS_IDUSER, res.DS_TOKEN_USER))
@@ -0,0 +1,253 @@
+# encoding: utf-8
+"""
+Record and replay of SOAP exchanges with the bankstore.
+
+In record mode a CassetteTransport sends the calls with another transport
+and appends each exchange to a cassette, a json lines file with the
+operation, the request fields and the response envelope. Card numbers
+are masked, CVVs and signatures left out. In replay mode responses are
+served from the cassette, loaded once in memory: no network nor disk per
+call, zeep parses the recorded envelopes as real ones.
+
+    cassette = Cassette("bankstore.jsonl")
+    client = PaytpvClient(settings, transport=CassetteTransport(cassette, "record"))
+    ...
+    client = PaytpvClient(settings, transport=CassetteTransport(cassette))
+
+Only zeep calls go through the transport, not the fast engine.
+"""
+import itertools
+import json
+import os
+import re
+import threading
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from zeep.transports import AsyncTransport
+from zeep.transports import Transport
+
+from paytpv.exc import PaytpvReplayMiss
+
+
+SOAP_BODY = "{http://schemas.xmlsoap.org/soap/envelope/}Body"
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+def mask_pan(pan):
+    return pan[:6] + "*" * max(len(pan) - 10, 0) + pan[-4:]
+
+
+REDACT = {
+    "DS_MERCHANT_PAN": mask_pan,
+    "DS_MERCHANT_CVV2": None,
+    "DS_MERCHANT_MERCHANTSIGNATURE": None,
+}
+
+_SENSITIVE = re.compile(r"<(DS_MERCHANT_PAN|DS_MERCHANT_CVV2)>([^<]*)</\1>")
+
+
+def redact(fields):
+    """
+    Copy of request 'fields' with the card number masked, without the CVV
+    and signature
+    """
+    fields = dict(fields)
+    for name, mask in REDACT.items():
+        if name in fields:
+            if mask is None:
+                del fields[name]
+            else:
+                fields[name] = mask(fields[name])
+    return fields
+
+
+def redact_response(content):
+    def mask(match):
+        name, value = match.groups()
+        if name == "DS_MERCHANT_CVV2":
+            value = "***"
+        elif value.isdigit():
+            # Card numbers in responses usually come masked already
+            value = mask_pan(value)
+        return "<%s>%s</%s>" % (name, value, name)
+
+    return _SENSITIVE.sub(mask, content)
+
+
+def request_fields(envelope):
+    """
+    (operation, fields) of a zeep request envelope
+    """
+    operation = envelope.find(SOAP_BODY)[0]
+    fields = {
+        child.tag.rpartition("}")[2]: child.text or "" for child in operation
+    }
+    return operation.tag.rpartition("}")[2], fields
+
+
+class Cassette:
+    """
+    Exchanges of a cassette file, indexed by request.
+
+    :param path: json lines file, loaded if it exists, appended to when
+        recording
+    :param match: {operation: request fields} to match calls of the
+        operation by these fields only, ie ``{"execute_purchase": ()}``
+        replays any recorded purchase. Other operations match all the
+        (redacted) fields. Exchanges with the same key are replayed in turn.
+    """
+
+    def __init__(self, path, match=None):
+        self.path = path
+        self.match = match or {}
+        self._index = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return sum(len(responses) for responses, _ in self._index.values())
+
+    def key(self, operation, fields):
+        names = self.match.get(operation)
+        if names is None:
+            return (operation,) + tuple(sorted(fields.items()))
+        return (operation,) + tuple((name, fields.get(name)) for name in names)
+
+    def _add(self, exchange):
+        key = self.key(exchange["operation"], exchange["request"])
+        response = (exchange["status"], exchange["response"].encode())
+        entry = self._index.get(key)
+        if entry is None:
+            self._index[key] = ([response], itertools.count())
+        else:
+            entry[0].append(response)
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    self._add(json.loads(line))
+
+    def record(self, operation, fields, status, content):
+        """
+        Adds an exchange, 'fields' as sent and 'content' the response body
+        """
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        exchange = {
+            "operation": operation,
+            "request": redact(fields),
+            "status": status,
+            "response": redact_response(content),
+        }
+        line = json.dumps(exchange, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._add(exchange)
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def play(self, operation, fields):
+        """
+        (status, content) recorded for a request, raises PaytpvReplayMiss
+        """
+        entry = self._index.get(self.key(operation, redact(fields)))
+        if entry is None:
+            raise PaytpvReplayMiss(operation)
+        responses, turn = entry
+        return responses[next(turn) % len(responses)]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.close()
+
+
+def response(status, content):
+    res = Response()
+    res.status_code = status
+    res._content = content
+    res.headers = CaseInsensitiveDict({"Content-Type": "text/xml; charset=utf-8"})
+    res.encoding = "utf-8"
+    return res
+
+
+class CassetteTransport(Transport):
+    """
+    zeep transport recording to or replaying from a Cassette.
+
+    :param mode: "replay" or "record"
+    :param transport: transport of the recorded calls, by default a
+        PooledTransport
+    """
+
+    def __init__(self, cassette, mode=REPLAY, transport=None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Unknown mode %s" % mode)
+        if mode == RECORD and transport is None:
+            from paytpv.transport import PooledTransport
+
+            transport = PooledTransport()
+        super().__init__(session=transport.session if transport is not None else None)
+        self.cassette = cassette
+        self.mode = mode
+        self.transport = transport
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        else:
+            self.session.close()
+
+    def post_xml(self, address, envelope, headers):
+        operation, fields = request_fields(envelope)
+        if self.mode == REPLAY:
+            return response(*self.cassette.play(operation, fields))
+        res = self.transport.post_xml(address, envelope, headers)
+        self.cassette.record(operation, fields, res.status_code, res.content)
+        return res
+
+
+class AsyncCassetteTransport(AsyncTransport):
+    """
+    Async version of CassetteTransport, records with a
+    PooledAsyncTransport by default
+    """
+
+    def __init__(self, cassette, mode=REPLAY, transport=None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Unknown mode %s" % mode)
+        if mode == RECORD and transport is None:
+            from paytpv.transport import PooledAsyncTransport
+
+            transport = PooledAsyncTransport()
+        self._close_session = False
+        self.cache = None
+        self.cassette = cassette
+        self.mode = mode
+        self.transport = transport
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+
+    async def post_xml(self, address, envelope, headers):
+        operation, fields = request_fields(envelope)
+        if self.mode == REPLAY:
+            return response(*self.cassette.play(operation, fields))
+        res = await self.transport.post_xml(address, envelope, headers)
+        self.cassette.record(operation, fields, res.status_code, res.content)
+        return res
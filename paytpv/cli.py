@@ -0,0 +1,288 @@
+# encoding: utf-8
+"""
+Command line tools, ``python -m paytpv``: refund, and load (see
+paytpv.load).
+
+    python -m paytpv refund refunds.csv --checkpoint refunds.done \\
+        --output results.jsonl --concurrency 10
+
+Refunds are read from a csv with a header or a jsonl file, with the
+execute_refund arguments: idpayuser, tokenpayuser, amount (in euros),
+order, authcode and optionally merchant_description. One result per
+refund is written as a json line.
+
+Refunds are identified by order, authcode and amount (and occurrence, for
+repeated rows), so partial refunds of one order are told apart. Refunds
+answered by the gateway (ok or DS_ERROR_ID) are appended to the checkpoint
+file and skipped when the command runs again, as are refunds that failed
+without an answer after they were sent (timeouts, 5xx, unreadable answers):
+they may have been made, and are reported as in doubt until checked with
+the gateway and run again with --retry-in-doubt. Refunds that failed
+before being sent (invalid arguments or requests, client limits, refused
+connections) are tried again.
+
+Settings are read from a json file (--settings) or from the MERCHANTCODE,
+MERCHANTPASSWORD, MERCHANTTERMINAL, PAYTPVURL and PAYTPVWSDL environment
+variables.
+"""
+import argparse
+import csv
+import decimal
+import json
+import os
+import sys
+from xml.etree import ElementTree
+
+from paytpv.batch import run_many
+from paytpv.exc import PaytpvException
+
+
+GATEWAY = "https://secure.paytpv.com/gateway/xml-bankstore"
+
+REFUND_ARGS = (
+    "idpayuser",
+    "tokenpayuser",
+    "amount",
+    "order",
+    "authcode",
+    "merchant_description",
+)
+
+OK = "ok"
+ERROR = "error"
+FAILED = "failed"
+IN_DOUBT = "in_doubt"
+
+# Checkpoint statuses
+DONE = "done"
+
+CENT = decimal.Decimal("0.01")
+
+
+def load_settings(path=None):
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    try:
+        settings = {
+            "MERCHANTCODE": os.environ["MERCHANTCODE"],
+            "MERCHANTPASSWORD": os.environ["MERCHANTPASSWORD"],
+            "MERCHANTTERMINAL": os.environ["MERCHANTTERMINAL"],
+        }
+    except KeyError as e:
+        raise SystemExit("Missing setting %s, use --settings or the environment" % e)
+    settings["PAYTPVURL"] = os.environ.get("PAYTPVURL", GATEWAY)
+    settings["PAYTPVWSDL"] = os.environ.get("PAYTPVWSDL", settings["PAYTPVURL"] + "?wsdl")
+    return settings
+
+
+def read_records(path, format=None):
+    """
+    Yields the records of a csv or jsonl file, by extension if no 'format'
+    """
+    format = format or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def refund_args(record):
+    args = {name: record[name] for name in REFUND_ARGS if record.get(name) not in (None, "")}
+    for name in REFUND_ARGS[:-1]:
+        if name not in args:
+            raise ValueError("Missing %s" % name)
+    # Decimal, so amounts like 2.675 are not rounded as binary floats
+    try:
+        args["amount"] = decimal.Decimal(str(args["amount"]))
+    except decimal.InvalidOperation:
+        raise ValueError("Invalid amount %s" % args["amount"])
+    if not args["amount"].is_finite():
+        raise ValueError("Invalid amount %s" % args["amount"])
+    for name in ("idpayuser", "tokenpayuser", "order", "authcode"):
+        args[name] = str(args[name])
+    return args
+
+
+def refund_key(kwargs, seen):
+    """
+    Key of a refund: order, authcode, amount and occurrence of the three in
+    the input, counted in 'seen'
+    """
+    key = "%s\t%s\t%s" % (kwargs["order"], kwargs["authcode"], kwargs["amount"].quantize(CENT))
+    seen[key] = seen.get(key, 0) + 1
+    return "%s\t%d" % (key, seen[key])
+
+
+class Checkpoint:
+    """
+    Append-only file of the refunds done or in doubt, one tab separated
+    status and key per line, the last line of a key wins. Lines of a single
+    order, written by older versions, mark all the refunds of the order done.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.status = {}
+        self.orders = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue
+                    status, _, key = line.rstrip("\n").partition("\t")
+                    if key:
+                        self.status[key] = status
+                    else:
+                        self.orders.add(status)
+        self._file = open(path, "a") if path else None
+
+    def get(self, key):
+        """
+        Status of the refund 'key', None if not done nor in doubt
+        """
+        if key.partition("\t")[0] in self.orders:
+            return DONE
+        return self.status.get(key)
+
+    def add(self, key, status=DONE):
+        self.status[key] = status
+        if self._file is not None:
+            self._file.write("%s\t%s\n" % (status, key))
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def sent(error):
+    """
+    True if 'error' was raised after the request was sent, so the refund
+    may have been made: no answer, a 5xx or an answer that can't be read.
+    Errors building the request (arguments, serialization) and client
+    limits are raised before sending.
+    """
+    from zeep.exceptions import XMLParseError
+
+    from paytpv.journal import not_sent
+    from paytpv.retry import transport_error
+
+    if not_sent(error):
+        return False
+    return transport_error(error) or isinstance(error, (XMLParseError, ElementTree.ParseError))
+
+
+def result(order, res):
+    if isinstance(res, PaytpvException):
+        return {"order": order, "status": ERROR, "error_id": res.code}
+    if isinstance(res, Exception):
+        line = {"order": order, "status": FAILED, "error": repr(res)}
+        if sent(res):
+            line["in_doubt"] = True
+        return line
+    return {
+        "order": order,
+        "status": OK,
+        "authcode": getattr(res, "DS_MERCHANT_AUTHCODE", None),
+        "response": getattr(res, "DS_RESPONSE", None),
+    }
+
+
+def refund(args, client=None, out=None, err=None):
+    """
+    Runs the refunds of args.input, returns the count by status
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+    if client is None:
+        from paytpv.client import PaytpvClient
+        from paytpv.retry import RetryPolicy
+
+        retry = RetryPolicy(max_attempts=args.retries) if args.retries > 1 else None
+        client = PaytpvClient(load_settings(args.settings), args.ip, retry=retry)
+
+    checkpoint = Checkpoint(args.checkpoint)
+    counts = {OK: 0, ERROR: 0, FAILED: 0, IN_DOUBT: 0, "skipped": 0}
+    seen = {}
+
+    def pending():
+        for record in read_records(args.input, args.format):
+            try:
+                kwargs = refund_args(record)
+            except (KeyError, ValueError) as e:
+                counts[FAILED] += 1
+                line = {"order": record.get("order"), "status": FAILED, "error": str(e)}
+                out.write(json.dumps(line) + "\n")
+                continue
+            key = refund_key(kwargs, seen)
+            status = checkpoint.get(key)
+            if status == IN_DOUBT and not args.retry_in_doubt:
+                counts[IN_DOUBT] += 1
+                out.write(json.dumps({"order": kwargs["order"], "status": IN_DOUBT}) + "\n")
+                continue
+            if status == DONE:
+                counts["skipped"] += 1
+                continue
+            kwargs["key"] = key
+            yield kwargs
+
+    def execute_refund(key, **kwargs):
+        return client.execute_refund(**kwargs)
+
+    try:
+        for key, res in run_many(execute_refund, pending(), args.concurrency, key="key"):
+            line = result(key.partition("\t")[0], res)
+            out.write(json.dumps(line) + "\n")
+            out.flush()
+            counts[line["status"]] += 1
+            # Refunds failed before reaching the gateway are retried next run
+            if line.get("in_doubt"):
+                checkpoint.add(key, IN_DOUBT)
+            elif line["status"] != FAILED:
+                checkpoint.add(key)
+    finally:
+        checkpoint.close()
+    err.write(
+        "ok: %(ok)d, error: %(error)d, failed: %(failed)d, in doubt: %(in_doubt)d, "
+        "skipped: %(skipped)d\n" % counts
+    )
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m paytpv", description="PAYTPV tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_refund = commands.add_parser("refund", help="run refunds from a csv or jsonl file")
+    parser_refund.add_argument("input", help="csv or jsonl file of refunds")
+    parser_refund.add_argument("--format", choices=["csv", "jsonl"])
+    parser_refund.add_argument("--checkpoint", help="file of the refunds done, skipped on rerun")
+    parser_refund.add_argument(
+        "--retry-in-doubt",
+        action="store_true",
+        help="send again the refunds in doubt, once checked that they were not made",
+    )
+    parser_refund.add_argument("--output", help="jsonl results, stdout by default")
+    parser_refund.add_argument("--concurrency", type=int, default=10)
+    parser_refund.add_argument("--retries", type=int, default=1, help="attempts per refund")
+    parser_refund.add_argument("--settings", help="json file of settings")
+    parser_refund.add_argument("--ip", default="127.0.0.1", help="DS_ORIGINAL_IP of the calls")
+    from paytpv import load
+
+    load.add_parser(commands)
+    args = parser.parse_args(argv)
+
+    if args.command == "load":
+        load.command(args)
+        return 0
+    if args.output:
+        with open(args.output, "a") as out:
+            counts = refund(args, out=out)
+    else:
+        counts = refund(args)
+    return 1 if counts[FAILED] or counts[ERROR] or counts[IN_DOUBT] else 0
@@ -1,312 +1,27 @@
-import asyncio
-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from hashlib import md5, sha1
 
+from paytpv import forks
+from paytpv.batch import arun_many
+from paytpv.batch import run_many
+from paytpv.builder import RequestBuilder  # noqa: F401
 from paytpv.exc import PaytpvException
-from zeep import Client
-
-
-class RequestBuilder:
-    def __init__(self, settings, ip=None):
-        """
-        """
-        self.ip = ip
-        self.MERCHANTCODE = settings["MERCHANTCODE"]
-        self.MERCHANTPASSWORD = settings["MERCHANTPASSWORD"]
-        self.MERCHANTTERMINAL = settings["MERCHANTTERMINAL"]
-        self.PAYTPVURL = settings["PAYTPVURL"]
-        self.PAYTPVWSDL = settings["PAYTPVWSDL"]
-
-    def signature(self, data, suma_ds):
-        """
-        """
-        suma = "".join(map(data.get, suma_ds))
-        suma = suma + self.MERCHANTPASSWORD
-        return sha1(suma.encode()).hexdigest()
-
-    def iframe_signature(self, data, signature):
-        """
-        """
-        suma = "".join(map(data.get, signature))
-        suma = suma + md5(self.MERCHANTPASSWORD.encode()).hexdigest()
-        return md5(suma.encode()).hexdigest()
-
-    def add_user(self, pan, expdate, cvv, name):
-        """
-        * Añade una tarjeta a PAYTPV. ¡¡¡ IMPORTANTE !!!
-          Esta entrada directa debe ser activada por PAYTPV.
-        * En su defecto el método de entrada de tarjeta para el cumplimiento del
-          PCI-DSS debe ser AddUserUrl o AddUserToken (método utilizado por BankStore JET)
-        * @param int $pan Número de tarjeta, sin espacios ni guiones
-        * @param string $expdate Fecha de caducidad de la tarjeta,
-          expresada como “mmyy” (mes en dos cifras y año en dos cifras)
-        * @param string $cvv Código CVC2 de la tarjeta
-        * @return object Objeto de respuesta de la operación
-
-        :return:
-         {
-          'DS_IDUSER': '0',
-          'DS_TOKEN_USER': '0',
-          'DS_ERROR_ID': '0'  # 0 no error, else error code
-          }
-        """
-        data = {
-            "DS_MERCHANT_PAN": pan,  # Número de tarjeta, sin espacios ni guiones {16,19}
-            "DS_MERCHANT_EXPIRYDATE": expdate,  # Fecha de caducidad mmyy
-            "DS_MERCHANT_CVV2": cvv,  # Código CVC2 {3,4}
-            "DS_MERCHANT_CARDHOLDERNAME": name,
-            "DS_MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "DS_MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "DS_ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "DS_MERCHANT_MERCHANTCODE",
-            "DS_MERCHANT_PAN",
-            "DS_MERCHANT_CVV2",
-            "DS_MERCHANT_TERMINAL",
-        ]
-        data["DS_MERCHANT_MERCHANTSIGNATURE"] = self.signature(data, signature)
-        return data
-
-    def info_user(self, idpayuser, tokenpayuser):
-        """
-        * Devuelve la información de un usuario almacenada en PAYTPV mediante llamada soap
-        * @param int $idpayuser Id del usuario en PAYTPV
-        * @param string $tokenpayuser Token del usuario en PAYTPV
-        * @return object Objeto de respuesta de la operación
-        """
-        data = {
-            "DS_IDUSER": idpayuser,
-            "DS_TOKEN_USER": tokenpayuser,
-            "DS_MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "DS_MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "DS_ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "DS_MERCHANT_MERCHANTCODE",
-            "DS_IDUSER",
-            "DS_TOKEN_USER",
-            "DS_MERCHANT_TERMINAL",
-        ]
-        data["DS_MERCHANT_MERCHANTSIGNATURE"] = self.signature(data, signature)
-        return data
-
-    def remove_user(self, idpayuser, tokenpayuser):
-        """
-        * Elimina un usuario de PAYTPV mediante llamada soap
-        * @param int $idpayuser Id de usuario en PAYTPV
-        * @param string $tokenpayuser Token de usuario en PAYTPV
-        * @return object Objeto de respuesta de la operación
-
-        :return: DS_RESPONSE: 0 error, 1 completat
-
-        """
-        data = {
-            "DS_IDUSER": idpayuser,
-            "DS_TOKEN_USER": tokenpayuser,
-            "DS_MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "DS_MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "DS_ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "DS_MERCHANT_MERCHANTCODE",
-            "DS_IDUSER",
-            "DS_TOKEN_USER",
-            "DS_MERCHANT_TERMINAL",
-        ]
-        data["DS_MERCHANT_MERCHANTSIGNATURE"] = self.signature(data, signature)
-        return data
-
-    def execute_purchase(
-        self,
-        idpayuser,
-        tokenpayuser,
-        amount,
-        order,
-        description="",
-        scoring=0,
-        merchant_data="",
-        merchant_description="",
-    ):
-        """
-        * Realiza un cobro mediante llamada soap.
-        * @param int $idpayuser Id de usuario en PAYTPV
-        * @param string $tokenpayuser Token de usuario en PAYTPV
-        * @param int $amount Importe del pago 1€ = 100
-        * @param string $order Identificador único del pago
-        * @return object Objeto de respuesta de la operación
-        """
-        if amount <= 0:
-            raise ValueError(
-                u"paytpv.executeCharge(): el importe debe ser positivo: %s" % (amount)
-            )
-        s_amount = str(int(round(amount * 100, 0)))
-        if len(order) > 20:
-            raise ValueError(
-                u"paytpv.executeCharge(): la longitud máxima de order es 20: %s"
-                % (order)
-            )
-        if len(description) > 40:
-            raise ValueError(
-                u"paytpv.executeCharge(): la longitud máxima de description es 40: %s"
-                % (description)
-            )
-
-        data = {
-            "DS_IDUSER": idpayuser,
-            "DS_TOKEN_USER": tokenpayuser,
-            "DS_MERCHANT_AMOUNT": s_amount,
-            "DS_MERCHANT_ORDER": order,
-            "DS_MERCHANT_CURRENCY": "EUR",
-            "DS_MERCHANT_PRODUCTDESCRIPTION": description,
-            "DS_MERCHANT_OWNER": "Vinissimus",
-            "DS_MERCHANT_SCORING": scoring,
-            "DS_MERCHANT_DATA": merchant_data,
-            "DS_MERCHANT_MERCHANTDESCRIPTOR": merchant_description,
-            "DS_MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "DS_MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "DS_ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "DS_MERCHANT_MERCHANTCODE",
-            "DS_IDUSER",
-            "DS_TOKEN_USER",
-            "DS_MERCHANT_TERMINAL",
-            "DS_MERCHANT_AMOUNT",
-            "DS_MERCHANT_ORDER",
-        ]
-        data["DS_MERCHANT_MERCHANTSIGNATURE"] = self.signature(data, signature)
-        return data
-
-    def execute_refund(
-        self, idpayuser, tokenpayuser, amount, order, authcode, merchant_description=""
-    ):
-        """
-        * Realiza devolución mediante llamada soap
-        * @param int $idpayuser Id de usuario en PAYTPV
-        * @param string $tokenpayuser Token de usuario en PAYTPV
-        * @param int $amount Importe del pago 1€ = 100
-        * @param string $order Identificador único del pago (debe ser el mismo del cobro)
-        * @param string authcode Identificador devuelto en el momento del cobro
-        * @return object Objeto de respuesta de la operación
-        """
-        if amount <= 0:
-            raise ValueError(
-                u"paytpv.executeCharge(): el importe debe ser positivo: %s" % (amount)
-            )
-        s_amount = str(int(round(amount * 100, 0)))
-        if len(order) > 20:
-            raise ValueError(
-                u"paytpv.executeCharge(): la longitud máxima de order es 20: %s"
-                % (order)
-            )
-
-        data = {
-            "DS_IDUSER": idpayuser,
-            "DS_TOKEN_USER": tokenpayuser,
-            "DS_MERCHANT_AMOUNT": s_amount,
-            "DS_MERCHANT_ORDER": order,
-            "DS_MERCHANT_CURRENCY": "EUR",
-            "DS_MERCHANT_AUTHCODE": authcode,
-            "DS_MERCHANT_MERCHANTDESCRIPTOR": merchant_description,
-            "DS_MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "DS_MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "DS_ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "DS_MERCHANT_MERCHANTCODE",
-            "DS_IDUSER",
-            "DS_TOKEN_USER",
-            "DS_MERCHANT_TERMINAL",
-            "DS_MERCHANT_AUTHCODE",
-            "DS_MERCHANT_ORDER",
-        ]
-        data["DS_MERCHANT_MERCHANTSIGNATURE"] = self.signature(data, signature)
-        return data
-
-    def get_iframe_url(
-        self, idpayuser, tokenpayuser, amount, order, language, urlok, urlko
-    ):
-        """
-        * Retorna el codi html del iframe per fer un cobrament securitzat.
-        * Operació 109, execute_purchase_token: cobrament a un usuari ja existent.
-
-        Cálculo firma:
-        md5(MERCHANT_MERCHANTCODE + IDUSER + TOKEN_USER + MERCHANT_TERMINAL
-        + OPERATION + MERCHANT_ORDER + MERCHANT_AMOUNT + MERCHANT_CURRENCY + md5(PASSWORD))
-        """
-        if amount <= 0:
-            raise ValueError(
-                u"paytpv.getSecureIframe(): el importe debe ser positivo: %s" % (amount)
-            )
-        s_amount = str(int(round(amount * 100, 0)))
-        if len(order) > 20:
-            raise ValueError(
-                u"paytpv.getSecureIframe(): la longitud máxima de order es 20: %s"
-                % (order)
-            )
-
-        data = {
-            "IDUSER": idpayuser,
-            "TOKEN_USER": tokenpayuser,
-            "OPERATION": "109",
-            "MERCHANT_ORDER": order,
-            "MERCHANT_AMOUNT": s_amount,
-            "MERCHANT_CURRENCY": "EUR",
-            "MERCHANT_MERCHANTCODE": self.MERCHANTCODE,
-            "MERCHANT_TERMINAL": self.MERCHANTTERMINAL,
-            "ORIGINAL_IP": self.ip,
-        }
-        signature = [
-            "MERCHANT_MERCHANTCODE",
-            "IDUSER",
-            "TOKEN_USER",
-            "MERCHANT_TERMINAL",
-            "OPERATION",
-            "MERCHANT_ORDER",
-            "MERCHANT_AMOUNT",
-            "MERCHANT_CURRENCY",
-        ]
-        signature = self.iframe_signature(data, signature)
-        params = [
-            "MERCHANT_MERCHANTCODE=" + self.MERCHANTCODE,
-            "MERCHANT_TERMINAL=" + self.MERCHANTTERMINAL,
-            "OPERATION=109",
-            "LANGUAGE=" + language,
-            "MERCHANT_MERCHANTSIGNATURE=" + signature,
-            "MERCHANT_ORDER=" + order,
-            "MERCHANT_AMOUNT=" + s_amount,
-            "MERCHANT_CURRENCY=EUR",
-            "IDUSER=" + idpayuser,
-            "TOKEN_USER=" + tokenpayuser,
-            "3DSECURE=1",
-            "URLOK=" + urlok,
-            "URLKO=" + urlko,
-        ]
-        IFRAMEURL = "https://secure.paytpv.com/gateway/bnkgateway.php?%s" % (
-            "&".join(params)
-        )
-        return IFRAMEURL
-
-    def get_secure_iframe(
-        self, idpayuser, tokenpayuser, amount, order, language, urlok, urlko
-    ):
-        url = self.get_iframe_url(
-            idpayuser, tokenpayuser, amount, order, language, urlok, urlko
-        )
-        return (
-            """<iframe id="secure_iframe"
-                title="Secure payment"
-                allowtransparency="true"
-                frameborder="0"
-                style="background: #FFFFFF; width:100%%; height:600px"
-                src="%s"></iframe>"""
-            % url
-        )
+from paytpv.hooks import CallTimer
+from paytpv.hooks import emit
+from paytpv.warmup import IDLE_TIMEOUT
+from paytpv.warmup import Warmth
 
 
 class PaytpvClient:
+    """
+    Thread-safe client, one instance can be shared by all the threads of a
+    process. See PooledTransport for pool size and timeouts.
+    """
+
+    _executor = None
+    _keep_alive = None
 
     methods = [
         "add_user",
@@ -316,46 +31,557 @@ class PaytpvClient:
         "execute_refund",
     ]
 
-    def __init__(self, settings, ip, client=None):
-        self.client = client or Client(settings["PAYTPVWSDL"])
+    def __init__(
+        self,
+        settings,
+        ip=None,
+        client=None,
+        wsdl_cache=None,
+        engine="zeep",
+        retry=None,
+        user_cache=None,
+        hooks=(),
+        transport=None,
+        max_workers=10,
+        limiter=None,
+        journal=None,
+        coalesce=None,
+        idle_timeout=IDLE_TIMEOUT,
+    ):
+        """
+        engine: "zeep", "fast" (see paytpv.engine) or an object with
+        a call(method_name, data, timer=None) method.
+        retry: a paytpv.retry.RetryPolicy, by default calls are not retried.
+        user_cache: a paytpv.cache.UserCache for info_user responses.
+        hooks: receive timing events of each call, see paytpv.hooks.
+        transport: a zeep transport, by default a PooledTransport.
+        max_workers: threads of the executor used by submit().
+        limiter: a paytpv.limits.Limiter for the calls sent to the gateway.
+        journal: a paytpv.journal.Journal of charges and refunds.
+        coalesce: a paytpv.coalesce.SingleFlight to share the request of
+        identical calls in flight.
+        idle_timeout: seconds idle after which a request counts as cold, see
+        paytpv.warmup.
+        """
+        if client is None:
+            from paytpv import wsdl
+            from paytpv.transport import PooledTransport
+
+            client = wsdl.create_client(
+                settings, transport=transport or PooledTransport(), cache=wsdl_cache
+            )
+        self.client = client
         self.builder = RequestBuilder(settings, ip)
+        self.retry = retry
+        self.user_cache = user_cache
+        self.hooks = list(hooks)
+        self.max_workers = max_workers
+        self.limiter = limiter
+        self.journal = journal
+        self.coalesce = coalesce
+        self.warmth = Warmth(idle_timeout)
+        self._executor_lock = threading.Lock()
+        forks.register(self)
+        if engine == "zeep":
+            self.engine = None
+        elif engine == "fast":
+            from paytpv.engine import FastEngine
+            from paytpv.engine import compile_operations
+            from paytpv.transport import PooledTransport
+
+            # From the WSDL zeep loaded, so both engines send the same parts
+            operations = compile_operations(self.client.service._binding)
+            transport = self.client.transport
+            if isinstance(transport, PooledTransport):
+                # Same connection pool and timeouts as zeep calls
+                self.engine = FastEngine(
+                    settings,
+                    operations,
+                    session=transport.session,
+                    timeout=transport.timeouts(None),
+                    operation_timeouts={
+                        name: transport.timeouts(name)
+                        for name in transport.operation_timeouts
+                    },
+                )
+            else:
+                self.engine = FastEngine(settings, operations)
+        else:
+            self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.close()
+
+    def close(self):
+        """
+        Waits for submitted calls and closes the connection pool
+        """
+        if self._keep_alive is not None:
+            self._keep_alive.stop()
+            self._keep_alive = None
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        # Transports close themselves, if they have something to close
+        close = getattr(self.client.transport, "close", None)
+        if close is not None:
+            close()
+
+    def after_fork(self):
+        """
+        Resets the client in a forked child, the transport resets itself
+        and the parsed WSDL is kept (see paytpv.forks)
+        """
+        # Threads and tasks of the parent don't run in the child
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._keep_alive = None
+        self.warmth = Warmth(self.warmth.idle_timeout)
+
+    def _session(self):
+        if self.engine is not None:
+            return getattr(self.engine, "session", None)
+        return getattr(self.client.transport, "session", None)
+
+    def ping(self, connections=1):
+        """
+        Pings the gateway with 'connections' requests at the same time,
+        returns how many distinct connections answered
+        """
+        from paytpv.warmup import ping
+
+        session = self._session()
+        if session is None:
+            return 0
+        timeout = getattr(self.client.transport, "connect_timeout", 5)
+        answered = ping(session, self.builder.PAYTPVURL, connections, timeout)
+        self.warmth.touch()
+        return answered
+
+    def warm_up(self, connections=None):
+        """
+        Resolves the operations of the service and opens 'connections'
+        pooled connections, by default as many as the pool keeps. Returns
+        how many distinct connections are open.
+        """
+        if self.engine is None:
+            service = self.client.service
+            for method_name in self.methods:
+                service._binding.get(method_name)
+        if connections is None:
+            connections = getattr(self.client.transport, "max_connections", 1)
+        return self.ping(connections)
+
+    def keep_alive(self, interval=20, connections=None):
+        """
+        Starts a thread pinging the gateway every 'interval' seconds while
+        the client is idle, stopped by close()
+        """
+        from paytpv.warmup import KeepAlive
+
+        if connections is None:
+            connections = getattr(self.client.transport, "max_connections", 1)
+        if self._keep_alive is not None:
+            self._keep_alive.stop()
+        self._keep_alive = KeepAlive(self, interval, connections)
+        self._keep_alive.start()
+        return self._keep_alive
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="paytpv"
+                    )
+        return self._executor
+
+    def submit(self, method_name, *args, **kwargs):
+        """
+        Runs 'method_name' in the client executor, returns a Future:
+
+            info = client.submit("info_user", idpayuser, tokenpayuser, ip=ip)
+            charge = client.submit("execute_purchase", idpayuser, tokenpayuser, 33, order)
+            info.result(), charge.result()
+        """
+        if method_name not in PaytpvClient.methods:
+            raise AttributeError(method_name)
+        return self.executor.submit(self.proxy, method_name, *args, **kwargs)
 
     def __getattr__(self, name):
         if name in PaytpvClient.methods:
             return partial(self.proxy, name)
         return getattr(self.builder, name)
 
+    def execute_purchase_many(self, charges, concurrency=10):
+        """
+        Runs execute_purchase for every charge (a dict of execute_purchase
+        arguments) with bounded concurrency. Yields (order, result) as
+        charges complete, result being the exception raised if it failed.
+        """
+        return run_many(self.execute_purchase, charges, concurrency)
+
+    def execute_refund_many(self, refunds, concurrency=10):
+        """
+        execute_purchase_many for refunds, dicts of execute_refund arguments
+        """
+        return run_many(self.execute_refund, refunds, concurrency)
+
     def proxy(self, method_name, *args, **kwargs):
+        if not self.hooks:
+            return self.call(method_name, None, *args, **kwargs)
+        timer = CallTimer(method_name)
+        try:
+            res = self.call(method_name, timer, *args, **kwargs)
+        except Exception as e:
+            emit(self.hooks, timer, error=e)
+            raise
+        emit(self.hooks, timer, res)
+        return res
+
+    def call(self, method_name, timer, *args, **kwargs):
         # Get request data for 'method_name' from RequestBuilder
         method = getattr(self.builder, method_name)
         data = method(*args, **kwargs)
+        if timer is not None:
+            timer.mark("build")
+
+        if self.user_cache is not None:
+            res = self.user_cache.get(method_name, data)
+            if res is not None:
+                if timer is not None:
+                    timer.cached = True
+                return res
+            version = self.user_cache.version()
+
+        key = None
+        if self.coalesce is not None:
+            key = self.coalesce.key(method_name, data)
+        if key is None:
+            res = self.execute(method_name, data, timer)
+        else:
+            res = self.coalesce.do(key, self.execute, method_name, data, timer)
+
+        if self.user_cache is not None:
+            self.user_cache.update(method_name, data, res, version)
+        return res
+
+    def execute(self, method_name, data, timer=None):
+        """
+        Sends 'data', with the journal, retries and limiter of the client
+        """
+        journaled = self.journal is not None and method_name in self.journal.operations
+        if journaled:
+            intent = self.journal.intent(method_name, data)
+        send = self.send if self.limiter is None else self.limited_send
+        try:
+            if self.retry is not None:
+                res = self.retry.call(method_name, send, method_name, data, timer)
+            else:
+                res = send(method_name, data, timer)
+        except BaseException as e:
+            if journaled:
+                self.journal.outcome(method_name, data, error=e, intent=intent)
+            raise
+        if journaled:
+            self.journal.outcome(method_name, data, res, intent=intent)
+        return res
 
-        # Get SOAP method 'method_name'
-        soap_method = self.client.service.__getattr__(method_name)
-        res = soap_method(**data)
-        if int(res.DS_ERROR_ID) != 0:
+    def limited_send(self, method_name, data, timer=None):
+        if timer is not None and timer.attempts:
+            # Time since the previous attempt, not waiting for the limiter
+            timer.mark("retry")
+        self.limiter.acquire()
+        if timer is not None:
+            timer.mark("queue")
+        start = time.perf_counter()
+        error = None
+        try:
+            return self.send(method_name, data, timer)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(time.perf_counter() - start, error)
+
+    def send(self, method_name, data, timer=None):
+        if timer is not None:
+            timer.attempt()
+        if self.engine is not None:
+            started = self.warmth.start()
+            if timer is not None and started[1]:
+                timer.cold = True
+            try:
+                res = self.engine.call(method_name, data, timer)
+            finally:
+                self.warmth.done(started)
+        else:
+            # SOAP call for 'method_name', as zeep's binding.send, by phases
+            service = self.client.service
+            binding = service._binding
+            envelope, headers = binding._create(
+                method_name, (), data, client=self.client, options=service._binding_options
+            )
+            if timer is not None:
+                timer.mark("serialize")
+            started = self.warmth.start()
+            if timer is not None and started[1]:
+                timer.cold = True
+            try:
+                response = self.client.transport.post_xml(
+                    service._binding_options["address"], envelope, headers
+                )
+            finally:
+                self.warmth.done(started)
+            if timer is not None:
+                timer.mark("send")
+            res = binding.process_reply(self.client, binding.get(method_name), response)
+            if timer is not None:
+                timer.mark("parse")
+        error = int(res.DS_ERROR_ID) != 0
+        if timer is not None:
+            timer.mark("check")
+        if error:
             raise PaytpvException(res.DS_ERROR_ID)
         return res
 
 
 class PaytpvAsyncClient(PaytpvClient):
-    def __init__(self, settings, ip=None, client=None):
-        from zeep.asyncio import AsyncTransport
+    """
+    Async client, the transport can be shared by all tasks of a worker.
+    See PooledAsyncTransport for pool size, timeouts and concurrency.
+    """
 
-        self.client = client or Client(
-            settings["PAYTPVWSDL"],
-            transport=AsyncTransport(loop=asyncio.get_event_loop()),
-        )
+    def __init__(
+        self,
+        settings,
+        ip=None,
+        client=None,
+        wsdl_cache=None,
+        transport=None,
+        retry=None,
+        user_cache=None,
+        hooks=(),
+        limiter=None,
+        journal=None,
+        coalesce=None,
+        idle_timeout=IDLE_TIMEOUT,
+    ):
+        if client is None:
+            from paytpv import wsdl
+            from paytpv.transport import PooledAsyncTransport
+
+            client = wsdl.create_client(
+                settings,
+                transport=transport or PooledAsyncTransport(),
+                cache=wsdl_cache,
+            )
+        self.client = client
         self.builder = RequestBuilder(settings, ip)
+        self.retry = retry
+        self.user_cache = user_cache
+        self.hooks = list(hooks)
+        self.limiter = limiter
+        self.journal = journal
+        self.coalesce = coalesce
+        self.warmth = Warmth(idle_timeout)
+        forks.register(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        await self.aclose()
+
+    def close(self):
+        """
+        Cancels the keep-alive task, connections are closed by aclose()
+        """
+        if self._keep_alive is not None:
+            self._keep_alive.cancel()
+            self._keep_alive = None
+
+    async def aclose(self):
+        if self._keep_alive is not None:
+            import asyncio
+
+            task, self._keep_alive = self._keep_alive, None
+            task.cancel()
+            # Done before its connections are closed
+            await asyncio.wait([task])
+        await self.client.transport.aclose()
+
+    async def ping(self, connections=1):
+        """
+        Async version of PaytpvClient.ping, with the connections of the
+        running loop
+        """
+        from paytpv.warmup import aping
+
+        client = getattr(self.client.transport, "client", None)
+        if client is None:
+            return 0
+        answered = await aping(client, self.builder.PAYTPVURL, connections)
+        self.warmth.touch()
+        return answered
+
+    async def warm_up(self, connections=None):
+        """
+        Async version of PaytpvClient.warm_up, by default opens as many
+        connections as the pool keeps alive
+        """
+        service = self.client.service
+        for method_name in self.methods:
+            service._binding.get(method_name)
+        if connections is None:
+            connections = getattr(self.client.transport, "max_keepalive_connections", 1)
+        return await self.ping(connections)
+
+    def keep_alive(self, interval=20, connections=None):
+        """
+        Starts a task of the running loop pinging the gateway every
+        'interval' seconds while the client is idle, cancelled by aclose()
+        """
+        import asyncio
+
+        from paytpv.warmup import keep_alive
+
+        if connections is None:
+            connections = getattr(self.client.transport, "max_keepalive_connections", 1)
+        if self._keep_alive is not None:
+            self._keep_alive.cancel()
+        self._keep_alive = asyncio.ensure_future(keep_alive(self, interval, connections))
+        return self._keep_alive
+
+    def submit(self, method_name, *args, **kwargs):
+        """
+        Schedules 'method_name' as a task of the running loop, returns it
+        """
+        if method_name not in PaytpvClient.methods:
+            raise AttributeError(method_name)
+        import asyncio
+
+        return asyncio.ensure_future(self.proxy(method_name, *args, **kwargs))
+
+    def execute_purchase_many(self, charges, concurrency=10):
+        """
+        Async generator version of PaytpvClient.execute_purchase_many,
+        'charges' can be an iterable or an async iterable.
+        """
+        return arun_many(self.execute_purchase, charges, concurrency)
+
+    def execute_refund_many(self, refunds, concurrency=10):
+        return arun_many(self.execute_refund, refunds, concurrency)
 
     async def proxy(self, method_name, *args, **kwargs):
+        if not self.hooks:
+            return await self.call(method_name, None, *args, **kwargs)
+        timer = CallTimer(method_name)
+        try:
+            res = await self.call(method_name, timer, *args, **kwargs)
+        except Exception as e:
+            emit(self.hooks, timer, error=e)
+            raise
+        emit(self.hooks, timer, res)
+        return res
+
+    async def call(self, method_name, timer, *args, **kwargs):
         method = getattr(self.builder, method_name)
         data = method(*args, **kwargs)
+        if timer is not None:
+            timer.mark("build")
+
+        if self.user_cache is not None:
+            res = self.user_cache.get(method_name, data)
+            if res is not None:
+                if timer is not None:
+                    timer.cached = True
+                return res
+            version = self.user_cache.version()
+
+        key = None
+        if self.coalesce is not None:
+            key = self.coalesce.key(method_name, data)
+        if key is None:
+            res = await self.execute(method_name, data, timer)
+        else:
+            res = await self.coalesce.ado(key, self.execute, method_name, data, timer)
+
+        if self.user_cache is not None:
+            self.user_cache.update(method_name, data, res, version)
+        return res
 
-        # Get SOAP method 'method_name'
-        soap_method = self.client.service.__getattr__(method_name)
+    async def execute(self, method_name, data, timer=None):
+        journaled = self.journal is not None and method_name in self.journal.operations
+        if journaled:
+            intent = await self.journal.aintent(method_name, data)
+        send = self.send if self.limiter is None else self.limited_send
+        try:
+            if self.retry is not None:
+                res = await self.retry.acall(method_name, send, method_name, data, timer)
+            else:
+                res = await send(method_name, data, timer)
+        except Exception as e:
+            if journaled:
+                await self.journal.aoutcome(method_name, data, error=e, intent=intent)
+            raise
+        except BaseException as e:
+            if journaled:
+                # Cancelled: written at once, the task may not await anymore
+                self.journal.outcome(method_name, data, error=e, intent=intent)
+            raise
+        if journaled:
+            await self.journal.aoutcome(method_name, data, res, intent=intent)
+        return res
 
-        res = await soap_method(**data)
-        if int(res.DS_ERROR_ID) != 0:
+    async def limited_send(self, method_name, data, timer=None):
+        if timer is not None and timer.attempts:
+            # Time since the previous attempt, not waiting for the limiter
+            timer.mark("retry")
+        await self.limiter.aacquire()
+        if timer is not None:
+            timer.mark("queue")
+        start = time.perf_counter()
+        error = None
+        try:
+            return await self.send(method_name, data, timer)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(time.perf_counter() - start, error)
+
+    async def send(self, method_name, data, timer=None):
+        if timer is not None:
+            timer.attempt()
+        service = self.client.service
+        binding = service._binding
+        envelope, headers = binding._create(
+            method_name, (), data, client=self.client, options=service._binding_options
+        )
+        if timer is not None:
+            timer.mark("serialize")
+        started = self.warmth.start()
+        if timer is not None and started[1]:
+            timer.cold = True
+        try:
+            response = await self.client.transport.post_xml(
+                service._binding_options["address"], envelope, headers
+            )
+        finally:
+            self.warmth.done(started)
+        if timer is not None:
+            timer.mark("send")
+        res = binding.process_reply(self.client, binding.get(method_name), response)
+        if timer is not None:
+            timer.mark("parse")
+        error = int(res.DS_ERROR_ID) != 0
+        if timer is not None:
+            timer.mark("check")
+        if error:
             raise PaytpvException(res.DS_ERROR_ID)
         return res
@@ -0,0 +1,131 @@
+# encoding: utf-8
+"""
+Single-flight coalescing of identical calls.
+
+While a call is in flight, calls of the same operation with the same key
+wait for it and get its result or exception, instead of sending another
+request. Keys are the merchant code and terminal, and request fields by
+operation:
+
+* info_user: DS_IDUSER and DS_TOKEN_USER
+* execute_purchase: order, user, token, amount and currency, a duplicated
+  charge gets the result of the first one
+
+    client = PaytpvAsyncClient(settings, coalesce=SingleFlight())
+"""
+import threading
+from functools import partial
+
+from paytpv import forks
+
+
+# Fields of every key
+MERCHANT = ("DS_MERCHANT_MERCHANTCODE", "DS_MERCHANT_TERMINAL")
+
+KEYS = {
+    "info_user": ("DS_IDUSER", "DS_TOKEN_USER"),
+    "execute_purchase": (
+        "DS_MERCHANT_ORDER",
+        "DS_IDUSER",
+        "DS_TOKEN_USER",
+        "DS_MERCHANT_AMOUNT",
+        "DS_MERCHANT_CURRENCY",
+    ),
+}
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    :param keys: {operation: request fields of the key}, operations not
+        in it are never coalesced. By default KEYS. The merchant code and
+        terminal are always part of the key.
+
+    'coalesced' counts the calls that shared another call's request.
+    """
+
+    def __init__(self, keys=None):
+        self.keys = KEYS if keys is None else keys
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        # Async calls of each event loop
+        self._tasks = {}
+        forks.register(self)
+
+    def after_fork(self):
+        # Calls in flight are the parent's, nobody would finish them
+        self._calls = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def key(self, method_name, data):
+        """
+        Key of the call, None if 'method_name' is not coalesced
+        """
+        fields = self.keys.get(method_name)
+        if fields is None:
+            return None
+        return (method_name,) + tuple(data.get(field) for field in MERCHANT + fields)
+
+    def do(self, key, func, *args):
+        """
+        Returns func(*args), or the result of the call in flight for 'key'
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    async def ado(self, key, func, *args):
+        """
+        Async version of do(), 'func' a coroutine function. Calls are only
+        coalesced with calls of the same event loop.
+        """
+        import asyncio
+
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(key)
+        if task is None:
+            # The call runs in its own task, so it is not cancelled with the
+            # caller that started it
+            task = self._tasks[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(partial(self._done, key))
+        else:
+            self.coalesced += 1
+        # A cancelled waiter doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Retrieved, no warning if every waiter was cancelled
+            task.exception()
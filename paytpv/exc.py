@@ -6,3 +6,40 @@ class PaytpvException(Exception):
     def __init__(self, code):
         super().__init__("Error: {}".format(code))
         self.code = int(code)
+
+
+class PaytpvFault(Exception):
+
+    def __init__(self, code, message):
+        super().__init__("Fault {}: {}".format(code, message))
+        self.code = code
+        self.message = message
+
+
+class PaytpvCircuitOpen(Exception):
+
+    def __init__(self, retry_at):
+        super().__init__("Circuit open: gateway unavailable")
+        self.retry_at = retry_at
+
+
+class PaytpvInvalidNotification(Exception):
+
+    def __init__(self, reason, notification=None):
+        super().__init__("Invalid notification: {}".format(reason))
+        self.reason = reason
+        self.notification = notification
+
+
+class PaytpvLimitExceeded(Exception):
+
+    def __init__(self, reason):
+        super().__init__("Client limit exceeded: {}".format(reason))
+        self.reason = reason
+
+
+class PaytpvReplayMiss(Exception):
+
+    def __init__(self, operation):
+        super().__init__("No recorded response for {}".format(operation))
+        self.operation = operation
@@ -0,0 +1,52 @@
+# encoding: utf-8
+"""
+Fork safety of clients built before fork(), ie in a gunicorn master with
+``preload_app``.
+
+Objects holding connections, locks or threads register here, and their
+``after_fork()`` runs in the child process right after a fork: pools of
+connections shared with the parent are replaced by new ones, so parent
+and child never use the same socket, locks are created again and
+threads, gone in the child, are forgotten. Parsed WSDL documents are
+kept, so the workers share them copy-on-write with the master.
+"""
+import logging
+import os
+import weakref
+
+
+logger = logging.getLogger(__name__)
+
+_objects = weakref.WeakSet()
+
+
+def register(obj):
+    """
+    Calls obj.after_fork() in the children of forks of this process
+    """
+    _objects.add(obj)
+    return obj
+
+
+def reset_session(session):
+    """
+    New connection pools for the adapters of a requests session
+    """
+    for adapter in session.adapters.values():
+        if hasattr(adapter, "init_poolmanager"):
+            adapter.proxy_manager = {}
+            adapter.init_poolmanager(
+                adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block
+            )
+
+
+def after_fork():
+    for obj in list(_objects):
+        try:
+            obj.after_fork()
+        except Exception:
+            logger.exception("Error resetting %r after fork", obj)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork)
@@ -0,0 +1,233 @@
+# encoding: utf-8
+"""
+Timing events of client calls.
+
+Clients created with ``hooks=[...]`` time each phase of a call and pass a
+CallEvent to the ``on_call(event)`` method of every hook. Phases are:
+
+* build: RequestBuilder data and signature
+* queue: wait for the client Limiter, see paytpv.limits
+* serialize: SOAP envelope
+* send: network round trip, from sending the request to the response
+* parse: response to result object
+* check: DS_ERROR_ID check
+* retry: time between attempts, when a RetryPolicy retries the call
+
+Without hooks no timing is done.
+"""
+import logging
+import time
+
+from paytpv.exc import PaytpvException
+
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("build", "queue", "serialize", "send", "parse", "check", "retry")
+
+
+class CallEvent:
+    """
+    operation: operation name
+    phases: {phase: seconds}
+    spans: [(phase, offset, seconds)] in the order they ran, 'offset' the
+        seconds from the start of the call
+    duration: seconds of the whole call
+    outcome: "ok", "cached", "error" (DS_ERROR_ID) or "exception"
+    error_id: DS_ERROR_ID, None if there was no response
+    start_time: epoch nanoseconds at the start of the call
+    cold: a request was sent after the client was idle, see paytpv.warmup
+    """
+
+    __slots__ = (
+        "operation",
+        "phases",
+        "duration",
+        "outcome",
+        "error_id",
+        "start_time",
+        "cold",
+        "spans",
+    )
+
+    def __init__(
+        self, operation, phases, duration, outcome, error_id, start_time, cold=False, spans=()
+    ):
+        self.operation = operation
+        self.phases = phases
+        self.spans = spans
+        self.duration = duration
+        self.outcome = outcome
+        self.error_id = error_id
+        self.start_time = start_time
+        self.cold = cold
+
+    def __repr__(self):
+        return "CallEvent(%s, %s, %.6f, %s)" % (
+            self.operation,
+            self.outcome,
+            self.duration,
+            self.phases,
+        )
+
+
+class CallTimer:
+    __slots__ = (
+        "operation",
+        "phases",
+        "spans",
+        "start_time",
+        "start",
+        "last",
+        "attempts",
+        "cached",
+        "cold",
+    )
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.phases = {}
+        self.spans = []
+        self.start_time = time.time_ns()
+        self.start = self.last = time.perf_counter()
+        self.attempts = 0
+        self.cached = False
+        self.cold = False
+
+    def mark(self, phase):
+        """
+        Adds the time since the previous mark to 'phase'
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.spans.append((phase, self.last - self.start, now - self.last))
+        self.last = now
+
+    def attempt(self):
+        if self.attempts:
+            self.mark("retry")
+        self.attempts += 1
+
+    def event(self, res=None, error=None):
+        if error is None:
+            outcome = "cached" if self.cached else "ok"
+            error_id = int(res.DS_ERROR_ID)
+        elif isinstance(error, PaytpvException):
+            outcome, error_id = "error", error.code
+        else:
+            outcome, error_id = "exception", None
+        return CallEvent(
+            self.operation,
+            self.phases,
+            time.perf_counter() - self.start,
+            outcome,
+            error_id,
+            self.start_time,
+            self.cold,
+            self.spans,
+        )
+
+
+def emit(hooks, timer, res=None, error=None):
+    event = timer.event(res, error)
+    for hook in hooks:
+        try:
+            hook.on_call(event)
+        except Exception:
+            logger.exception("Error in hook %r", hook)
+
+
+class Hook:
+    """
+    Base class of hooks
+    """
+
+    def on_call(self, event):
+        pass
+
+
+class PrometheusHook(Hook):
+    """
+    Prometheus histograms of call and phase durations, needs prometheus_client.
+
+    paytpv_call_seconds{operation, outcome}
+    paytpv_phase_seconds{operation, phase}
+    paytpv_errors_total{operation, error_id}
+    paytpv_cold_calls_total{operation}
+    """
+
+    def __init__(self, registry=None, prefix="paytpv", buckets=None):
+        from prometheus_client import REGISTRY
+        from prometheus_client import Counter
+        from prometheus_client import Histogram
+
+        kwargs = {"registry": registry or REGISTRY}
+        if buckets is not None:
+            kwargs["buckets"] = buckets
+        self.calls = Histogram(
+            prefix + "_call_seconds",
+            "Duration of PAYTPV calls",
+            ["operation", "outcome"],
+            **kwargs
+        )
+        self.phases = Histogram(
+            prefix + "_phase_seconds",
+            "Duration of the phases of PAYTPV calls",
+            ["operation", "phase"],
+            **kwargs
+        )
+        self.errors = Counter(
+            prefix + "_errors_total",
+            "PAYTPV DS_ERROR_ID errors",
+            ["operation", "error_id"],
+            registry=kwargs["registry"],
+        )
+        self.cold = Counter(
+            prefix + "_cold_calls_total",
+            "PAYTPV calls sent after the client was idle",
+            ["operation"],
+            registry=kwargs["registry"],
+        )
+
+    def on_call(self, event):
+        self.calls.labels(event.operation, event.outcome).observe(event.duration)
+        if event.cold:
+            self.cold.labels(event.operation).inc()
+        for phase, seconds in event.phases.items():
+            self.phases.labels(event.operation, phase).observe(seconds)
+        if event.outcome == "error":
+            self.errors.labels(event.operation, str(event.error_id)).inc()
+
+
+class OpenTelemetryHook(Hook):
+    """
+    One OpenTelemetry span per call with a child span per phase, as many as
+    the phase ran (ie a send per attempt), needs opentelemetry-api. Spans
+    are created when the call ends, with the recorded start and end times.
+    """
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+
+        self.trace = trace
+        self.tracer = tracer or trace.get_tracer("paytpv")
+
+    def on_call(self, event):
+        start = event.start_time
+        span = self.tracer.start_span(
+            "paytpv." + event.operation,
+            start_time=start,
+            attributes={
+                "paytpv.operation": event.operation,
+                "paytpv.outcome": event.outcome,
+                "paytpv.error_id": -1 if event.error_id is None else event.error_id,
+            },
+        )
+        if event.outcome in ("error", "exception"):
+            span.set_status(self.trace.Status(self.trace.StatusCode.ERROR))
+        context = self.trace.set_span_in_context(span)
+        for phase, offset, seconds in event.spans:
+            child_start = start + round(offset * 1e9)
+            child = self.tracer.start_span(phase, context=context, start_time=child_start)
+            child.end(end_time=child_start + round(seconds * 1e9))
+        span.end(end_time=event.start_time + int(event.duration * 1e9))
@@ -0,0 +1,242 @@
+# encoding: utf-8
+"""
+Append-only journal of charges and refunds.
+
+A client with ``journal=Journal(path)`` writes an intent record before
+sending execute_purchase or execute_refund, and an outcome record after:
+
+* ok: the gateway answered, with DS_MERCHANT_AUTHCODE
+* error: the gateway answered with a DS_ERROR_ID, nothing was charged
+* not_sent: the call failed before reaching the gateway (client limits, open
+  circuit breaker, invalid request, connection refused), nothing was charged
+* unknown: no answer (timeout, connection reset, 5xx) or the call was
+  cancelled, it may be charged
+
+Each intent has a unique ``id``, repeated in its outcome, so calls on the
+same order (partial refunds) are told apart. Records are json lines,
+fsynced before the call is sent. Writers waiting for an fsync are committed
+together by the next one (group commit), so concurrent calls share fsyncs.
+After a crash, ``in_doubt()`` lists the intents without a known outcome, to
+check them before charging again.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+
+from paytpv import forks
+from paytpv.exc import PaytpvCircuitOpen
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvLimitExceeded
+
+
+OPERATIONS = frozenset(["execute_purchase", "execute_refund"])
+
+OK = "ok"
+ERROR = "error"
+NOT_SENT = "not_sent"
+UNKNOWN = "unknown"
+RESOLVED = "resolved"
+
+
+def not_sent(error):
+    """
+    True if 'error' was raised before the request left the client
+    """
+    from zeep.exceptions import ValidationError
+
+    from paytpv import retry
+
+    # Both engines raise ValidationError building the request, ie a missing
+    # DS_ORIGINAL_IP
+    return isinstance(
+        error, (PaytpvLimitExceeded, PaytpvCircuitOpen, ValidationError)
+    ) or retry.not_sent(error)
+
+
+class Journal:
+    """
+    :param path: journal file, created if needed
+    :param fsync: fsync records before the calls go on, disable only
+        when the journal is on storage that survives crashes without it
+    :param operations: operations journaled
+    """
+
+    def __init__(self, path, fsync=True, operations=OPERATIONS):
+        self.path = path
+        self.fsync = fsync
+        self.operations = operations
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._buffer = []
+        self._seq = 0
+        self._committed = 0
+        self.commits = 0
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        # Records not written yet are the parent's
+        self._buffer = []
+        self._committed = self._seq
+        if not self._file.closed:
+            self._file = open(self.path, "ab")
+
+    def close(self):
+        with self._commit_lock:
+            self._write()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.close()
+
+    def _append(self, record):
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self._lock:
+            self._seq += 1
+            self._buffer.append(line)
+            return self._seq
+
+    def _write(self):
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            seq = self._seq
+        if lines:
+            self._file.write(b"".join(lines))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.commits += 1
+        self._committed = seq
+
+    def commit(self, seq):
+        """
+        Waits until record 'seq' is on disk. The thread holding the commit
+        lock writes the records of every thread waiting for it.
+        """
+        with self._commit_lock:
+            if self._committed < seq:
+                self._write()
+
+    def write(self, record):
+        self.commit(self._append(record))
+
+    async def awrite(self, record):
+        seq = self._append(record)
+        await asyncio.get_running_loop().run_in_executor(None, self.commit, seq)
+
+    def intent_record(self, method_name, data):
+        return {
+            "event": "intent",
+            "id": uuid.uuid4().hex,
+            "time": time.time(),
+            "operation": method_name,
+            "order": data["DS_MERCHANT_ORDER"],
+            "amount": data["DS_MERCHANT_AMOUNT"],
+            "currency": data.get("DS_MERCHANT_CURRENCY"),
+            "iduser": data["DS_IDUSER"],
+            "terminal": data["DS_MERCHANT_TERMINAL"],
+        }
+
+    def outcome_record(self, method_name, data, res=None, error=None, intent=None):
+        record = {
+            "event": "outcome",
+            "id": intent,
+            "time": time.time(),
+            "operation": method_name,
+            "order": data["DS_MERCHANT_ORDER"],
+        }
+        if error is None:
+            record["status"] = OK
+            record["authcode"] = getattr(res, "DS_MERCHANT_AUTHCODE", None)
+        elif isinstance(error, PaytpvException):
+            record["status"] = ERROR
+            record["error_id"] = error.code
+        elif not_sent(error):
+            record["status"] = NOT_SENT
+            record["error"] = repr(error)
+        else:
+            record["status"] = UNKNOWN
+            record["error"] = repr(error)
+        return record
+
+    def intent(self, method_name, data):
+        """
+        Writes the intent of a call, returns its id for the outcome
+        """
+        record = self.intent_record(method_name, data)
+        self.write(record)
+        return record["id"]
+
+    def outcome(self, method_name, data, res=None, error=None, intent=None):
+        self.write(self.outcome_record(method_name, data, res, error, intent))
+
+    async def aintent(self, method_name, data):
+        record = self.intent_record(method_name, data)
+        await self.awrite(record)
+        return record["id"]
+
+    async def aoutcome(self, method_name, data, res=None, error=None, intent=None):
+        await self.awrite(self.outcome_record(method_name, data, res, error, intent))
+
+    def resolve(self, operation, order, status, intent=None, **info):
+        """
+        Records the outcome of an in-doubt call, checked by other means:
+        the intent with id 'intent', or else every intent of the order
+        """
+        record = {
+            "event": RESOLVED,
+            "id": intent,
+            "time": time.time(),
+            "operation": operation,
+            "order": order,
+            "status": status,
+        }
+        record.update(info)
+        self.write(record)
+
+    def in_doubt(self):
+        """
+        Intent records of calls without an ok or error outcome
+        """
+        return in_doubt(self.path)
+
+
+def read(path):
+    """
+    Yields the records of a journal. A line cut by a crash is skipped.
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def in_doubt(path):
+    """
+    Intent records of calls without an ok or error outcome, in the
+    journal at 'path'
+    """
+    pending = {}
+    for record in read(path):
+        key = (record["operation"], record["order"])
+        if record["event"] == "intent":
+            # Intents written before ids are told apart by order
+            pending[record.get("id") or key] = record
+        elif record["event"] == RESOLVED or record.get("status") != UNKNOWN:
+            if record.get("id"):
+                pending.pop(record["id"], None)
+            else:
+                for intent_id, intent in list(pending.items()):
+                    if (intent["operation"], intent["order"]) == key:
+                        del pending[intent_id]
+    return list(pending.values())
@@ -0,0 +1,255 @@
+# encoding: utf-8
+"""
+Client side rate and concurrency limits.
+
+A Limiter in front of the client sends (``PaytpvClient(..., limiter=...)``)
+combines a token bucket of 'rate' calls per second with an adaptive limit of
+calls in flight. The limit grows by one every 'limit' successful calls
+(additive increase) and is multiplied by 'backoff' (multiplicative decrease)
+when calls fail with gateway errors or their latency is above target: a
+fixed 'latency_target', or 'tolerance' times the best latency seen.
+
+Calls over the limits wait up to 'timeout' seconds and then fail with
+PaytpvLimitExceeded, ``timeout=0`` sheds them at once. With a SharedState
+the limits are shared by the processes of a host.
+"""
+import asyncio
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from paytpv import forks
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvLimitExceeded
+from paytpv.retry import RETRYABLE_CODES
+from paytpv.retry import transport_error
+
+
+# Seconds between checks for a free slot
+POLL = 0.005
+
+# State fields
+TOKENS, UPDATED, LIMIT, IN_FLIGHT, MIN_LATENCY, DECREASED = range(6)
+
+
+def overloaded(error):
+    """
+    True if 'error' tells the gateway is overloaded or failing
+    """
+    if isinstance(error, PaytpvException):
+        return error.code in RETRYABLE_CODES
+    return transport_error(error)
+
+
+class LocalState:
+    """
+    Limiter state of one process
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        # Calls in flight are the parent's
+        self.values[IN_FLIGHT] = 0
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self.values
+
+
+class SharedState:
+    """
+    Limiter state in a memory mapped file, shared by the processes of a
+    host. Access is serialized with flock(). Calls in flight of a process
+    killed during a call are not released, see reset().
+    """
+
+    FORMAT = "6d"
+
+    def __init__(self, path, values):
+        self.path = path
+        self.size = struct.calcsize(self.FORMAT)
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, struct.pack(self.FORMAT, *values), 0)
+            self._map = mmap.mmap(self._fd, self.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self.initial = list(values)
+        forks.register(self)
+
+    def after_fork(self):
+        # flock() locks belong to the open file, shared with the parent
+        # after a fork: open it again to lock against the parent too
+        self._map.close()
+        os.close(self._fd)
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                values = list(struct.unpack_from(self.FORMAT, self._map))
+                yield values
+                struct.pack_into(self.FORMAT, self._map, 0, *values)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reset(self):
+        with self.transaction() as values:
+            values[:] = self.initial
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def shared_path(settings, directory=None):
+    """
+    State file of the merchant terminal of 'settings'
+    """
+    if directory is None:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    key = "%s:%s" % (settings["MERCHANTCODE"], settings["MERCHANTTERMINAL"])
+    return os.path.join(
+        directory, "paytpv-limits-%s" % hashlib.sha1(key.encode()).hexdigest()[:16]
+    )
+
+
+class Limiter:
+    """
+    :param rate: calls per second, None for no rate limit
+    :param burst: token bucket size, by default one second of calls
+    :param limit: initial limit of calls in flight
+    :param min_limit, max_limit: bounds of the adaptive limit
+    :param latency_target: seconds, None to use 'tolerance' times the best
+        latency seen
+    :param backoff: limit multiplier on overload
+    :param timeout: seconds a call waits for the limits, None waits forever
+    :param shared: settings of the terminal to share the state with the
+        other processes of the host (see shared_path), or a path
+    """
+
+    def __init__(
+        self,
+        rate=None,
+        burst=None,
+        limit=10,
+        min_limit=1,
+        max_limit=100,
+        latency_target=None,
+        tolerance=2.0,
+        backoff=0.9,
+        timeout=0,
+        shared=None,
+    ):
+        self.rate = rate
+        self.burst = burst or rate or 0
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.timeout = timeout
+        values = [self.burst, time.monotonic(), limit, 0, 0, 0]
+        if shared is None:
+            self.state = LocalState(values)
+        else:
+            if isinstance(shared, dict):
+                shared = shared_path(shared)
+            self.state = SharedState(shared, values)
+
+    def _try_acquire(self):
+        """
+        Takes a slot, returns None or (reason, seconds to wait)
+        """
+        with self.state.transaction() as state:
+            now = time.monotonic()
+            if self.rate:
+                state[TOKENS] = min(
+                    self.burst, state[TOKENS] + (now - state[UPDATED]) * self.rate
+                )
+                state[UPDATED] = now
+            if state[IN_FLIGHT] >= int(state[LIMIT]):
+                return "concurrency", POLL
+            if self.rate:
+                if state[TOKENS] < 1:
+                    return "rate", (1 - state[TOKENS]) / self.rate
+                state[TOKENS] -= 1
+            state[IN_FLIGHT] += 1
+        return None
+
+    def _wait(self, deadline, refused):
+        reason, wait = refused
+        if deadline is not None and time.monotonic() + wait > deadline:
+            raise PaytpvLimitExceeded(reason)
+        return wait
+
+    def acquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            refused = self._try_acquire()
+            if refused is None:
+                return
+            time.sleep(self._wait(deadline, refused))
+
+    async def aacquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            refused = self._try_acquire()
+            if refused is None:
+                return
+            await asyncio.sleep(self._wait(deadline, refused))
+
+    def release(self, latency, error=None):
+        """
+        Frees the slot of a call that took 'latency' seconds and adapts
+        the limit, unless the call was cancelled
+        """
+        with self.state.transaction() as state:
+            state[IN_FLIGHT] = max(0, state[IN_FLIGHT] - 1)
+            if error is not None and not isinstance(error, Exception):
+                # CancelledError, KeyboardInterrupt: the latency tells nothing
+                return
+            failed = error is not None and overloaded(error)
+            if not failed:
+                # The best latency slowly rises, to follow a slower network
+                best = state[MIN_LATENCY] * 1.01
+                state[MIN_LATENCY] = latency if not best else min(best, latency)
+            target = self.latency_target or state[MIN_LATENCY] * self.tolerance
+            now = time.monotonic()
+            if failed or latency > target:
+                # At most once per round trip, calls in flight see the same
+                # overload
+                if now - state[DECREASED] > latency:
+                    state[LIMIT] = max(self.min_limit, state[LIMIT] * self.backoff)
+                    state[DECREASED] = now
+            else:
+                state[LIMIT] = min(self.max_limit, state[LIMIT] + 1 / state[LIMIT])
+
+    def stats(self):
+        with self.state.transaction() as state:
+            return {
+                "limit": state[LIMIT],
+                "in_flight": int(state[IN_FLIGHT]),
+                "tokens": state[TOKENS],
+                "min_latency": state[MIN_LATENCY],
+            }
@@ -0,0 +1,110 @@
+# encoding: utf-8
+"""
+Bulk payment links.
+
+Records are dicts of get_iframe_url arguments:
+
+    {"idpayuser": "1", "tokenpayuser": "...", "amount": 10, "order": "o1",
+     "language": "ES", "urlok": "https://...", "urlko": "https://..."}
+
+Missing arguments are taken from the defaults given to generate_links or
+write_links. Links are built with one RequestBuilder per process, on a
+process pool when 'processes' is given.
+"""
+import csv
+import multiprocessing
+from itertools import islice
+
+from paytpv.builder import RequestBuilder
+
+
+def link(builder, record, html=False, defaults=None):
+    """
+    Returns (order, link) for 'record', link being the ValueError raised
+    for an invalid record
+    """
+    kwargs = dict(defaults, **record) if defaults else record
+    try:
+        if html:
+            url = builder.get_secure_iframe(**kwargs)
+        else:
+            url = builder.get_iframe_url(**kwargs)
+    except (TypeError, ValueError) as e:
+        return kwargs.get("order"), e
+    return kwargs["order"], url
+
+
+# State of pool workers
+_worker = None
+
+
+def _init(settings, html, defaults):
+    global _worker
+    _worker = (RequestBuilder(settings), html, defaults)
+
+
+def _links(records):
+    builder, html, defaults = _worker
+    return [link(builder, record, html, defaults) for record in records]
+
+
+def _chunks(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def generate_links(
+    settings, records, html=False, processes=None, chunksize=1000, **defaults
+):
+    """
+    Yields (order, link) for every record, in order. 'link' is the iframe
+    url, or the iframe html with ``html=True``, or the ValueError raised
+    for an invalid record.
+
+    processes: size of the process pool, 0 for os.cpu_count(), None to
+    build the links in this process. Records are sent to the workers in
+    chunks of 'chunksize' and read from the iterable as they are needed.
+    """
+    if processes is None:
+        builder = RequestBuilder(settings)
+        for record in records:
+            yield link(builder, record, html, defaults)
+        return
+
+    with multiprocessing.Pool(
+        processes or None, initializer=_init, initargs=(settings, html, defaults)
+    ) as pool:
+        for links in pool.imap(_links, _chunks(records, chunksize)):
+            yield from links
+
+
+def write_links(
+    settings, records, out, html=False, processes=None, chunksize=1000, **defaults
+):
+    """
+    Streams the links of 'records' to 'out', a file path or a text file,
+    as a csv with order, link and error columns. Returns (written, failed).
+    """
+    if isinstance(out, str):
+        with open(out, "w", newline="") as f:
+            return write_links(
+                settings, records, f, html, processes, chunksize, **defaults
+            )
+
+    writer = csv.writer(out)
+    writer.writerow(["order", "link", "error"])
+    written = failed = 0
+    for order, url in generate_links(
+        settings, records, html, processes, chunksize, **defaults
+    ):
+        if isinstance(url, Exception):
+            writer.writerow([order, "", str(url)])
+            failed += 1
+        else:
+            writer.writerow([order, url, ""])
+            written += 1
+    return written, failed
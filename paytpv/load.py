@@ -0,0 +1,520 @@
+# encoding: utf-8
+"""
+Load generator for the clients, ``python -m paytpv load``.
+
+Runs a mix of add_user, info_user, execute_purchase and execute_refund
+calls for a while, at a target rate or as fast as 'concurrency' workers
+(threads of a PaytpvClient or tasks of a PaytpvAsyncClient) can go, and
+reports throughput, latency percentiles, errors, CPU time and peak RSS of
+this process.
+
+    python -m paytpv load --client async --concurrency 1,8,32 --duration 10 \\
+        --mix info_user=6,execute_purchase=2,execute_refund=1,add_user=1 \\
+        --output load.json
+
+With several concurrencies each one is a step of the same run, to see
+where throughput stops growing. The calls go to a fake bankstore started in
+another process, so its CPU is not counted. --settings sends them to
+another bankstore instead, ie a test environment: they add real cards and
+charges, so it needs --i-know-this-charges, and the production gateway is
+refused.
+
+Latencies are measured from the time a call was due, so with --rps a
+saturated client shows queueing delays instead of hiding them.
+"""
+import collections
+import itertools
+import json
+import math
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+from paytpv.exc import PaytpvException
+
+
+PAN = "4539232076648253"
+
+MIX = {
+    "add_user": 1,
+    "info_user": 6,
+    "execute_purchase": 2,
+    "execute_refund": 1,
+}
+
+# Users kept to call info_user and charge
+MAX_USERS = 1000
+
+
+def parse_mix(value):
+    """
+    {operation: weight} of "info_user=6,execute_purchase=2"
+    """
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in MIX:
+            raise ValueError("Unknown operation %s" % name)
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile 'p' of sorted 'values'
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class Workload:
+    """
+    Chooses the calls of the mix. Users added and charges made are kept to
+    call info_user, charge and refund; a refund without charges left is
+    a charge.
+    """
+
+    def __init__(self, mix=MIX, amount=1, seed=None):
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.amount = amount
+        self.random = random.Random(seed)
+        self.users = []
+        self.charges = collections.deque()
+        # Orders are unique across runs against the same bankstore
+        self.prefix = "%x" % int(time.time() * 1000)
+        self._orders = itertools.count()
+
+    def add_user(self):
+        return "add_user", (PAN, "0599", "123", "load")
+
+    def next(self):
+        """
+        (method_name, args) of the next call
+        """
+        operation = self.random.choices(self.operations, self.weights)[0]
+        if operation == "execute_refund":
+            try:
+                iduser, token, order, authcode = self.charges.popleft()
+            except IndexError:
+                operation = "execute_purchase"
+            else:
+                return operation, (iduser, token, self.amount, order, authcode)
+        if operation == "add_user" or not self.users:
+            return self.add_user()
+        iduser, token = self.random.choice(self.users)
+        if operation == "info_user":
+            return operation, (iduser, token)
+        order = "%s-%d" % (self.prefix, next(self._orders))
+        return "execute_purchase", (iduser, token, self.amount, order)
+
+    def done(self, method_name, args, res):
+        if method_name == "add_user":
+            if len(self.users) < MAX_USERS:
+                self.users.append((res.DS_IDUSER, res.DS_TOKEN_USER))
+        elif method_name == "execute_purchase":
+            self.charges.append((args[0], args[1], args[3], res.DS_MERCHANT_AUTHCODE))
+
+
+class Recorder:
+    """
+    Latencies and errors of a step, by operation
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        # Gateway errors (DS_ERROR_ID) and failures (no answer)
+        self.errors = collections.Counter()
+        self.failures = collections.Counter()
+
+    def add(self, method_name, latency, error=None):
+        self.latencies[method_name].append(latency)
+        if isinstance(error, PaytpvException):
+            self.errors[method_name] += 1
+        elif error is not None:
+            self.failures[method_name] += 1
+
+    @staticmethod
+    def summary(latencies, errors, failures):
+        latencies = sorted(latencies)
+        calls = len(latencies)
+        ms = {
+            "p%d" % p: round(percentile(latencies, p) * 1000, 3) if calls else None
+            for p in (50, 95, 99)
+        }
+        ms["max"] = round(latencies[-1] * 1000, 3) if calls else None
+        return dict(
+            calls=calls,
+            errors=errors,
+            failures=failures,
+            error_rate=round((errors + failures) / calls, 4) if calls else 0,
+            latency_ms=ms,
+        )
+
+    def report(self):
+        operations = {
+            name: self.summary(latencies, self.errors[name], self.failures[name])
+            for name, latencies in sorted(self.latencies.items())
+        }
+        total = self.summary(
+            [latency for latencies in self.latencies.values() for latency in latencies],
+            sum(self.errors.values()),
+            sum(self.failures.values()),
+        )
+        total["operations"] = operations
+        return total
+
+
+class Pacer:
+    """
+    Due times of the calls, 1 / rps apart, or now without a rate
+    """
+
+    def __init__(self, rps=None):
+        self.interval = 1.0 / rps if rps else 0
+        self.next = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def due(self):
+        if not self.interval:
+            return time.perf_counter()
+        with self._lock:
+            due = self.next
+            self.next += self.interval
+        return due
+
+
+def usage():
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return usage.ru_utime + usage.ru_stime, rss
+
+
+def run_threads(client, workload, concurrency, duration, rps=None):
+    """
+    Runs the workload with 'concurrency' threads, returns the Recorder
+    """
+    recorder = Recorder()
+    pacer = Pacer(rps)
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while True:
+            due = pacer.due()
+            if due >= deadline:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            method_name, args = workload.next()
+            try:
+                res = client.proxy(method_name, *args)
+            except Exception as e:
+                recorder.add(method_name, time.perf_counter() - due, e)
+            else:
+                recorder.add(method_name, time.perf_counter() - due)
+                workload.done(method_name, args, res)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder
+
+
+async def run_tasks(client, workload, concurrency, duration, rps=None):
+    """
+    Async version of run_threads, with 'concurrency' tasks
+    """
+    import asyncio
+
+    recorder = Recorder()
+    pacer = Pacer(rps)
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while True:
+            due = pacer.due()
+            if due >= deadline:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            method_name, args = workload.next()
+            try:
+                res = await client.proxy(method_name, *args)
+            except Exception as e:
+                recorder.add(method_name, time.perf_counter() - due, e)
+            else:
+                recorder.add(method_name, time.perf_counter() - due)
+                workload.done(method_name, args, res)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return recorder
+
+
+def start():
+    return time.perf_counter(), usage()[0]
+
+
+def result(started, concurrency, rps, recorder):
+    """
+    Results of a step 'started' with start()
+    """
+    elapsed = time.perf_counter() - started[0]
+    cpu, rss = usage()
+    cpu -= started[1]
+    res = {"concurrency": concurrency, "rps_target": rps, "duration": round(elapsed, 3)}
+    res.update(recorder.report())
+    res["throughput"] = round(res["calls"] / elapsed, 2)
+    res["cpu_seconds"] = round(cpu, 3)
+    res["cpu_percent"] = round(cpu / elapsed * 100, 1)
+    res["peak_rss_mb"] = round(rss, 1)
+    return res
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Stub:
+    """
+    Fake bankstore in another process, 'settings' to call it
+    """
+
+    def __init__(self, latency=0, failure_rate=0, timeout=10):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.timeout = timeout
+        self.process = None
+        self.settings = None
+
+    def __enter__(self):
+        from paytpv.testing import FakeBankstore
+
+        port = free_port()
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "paytpv.testing",
+                "--port",
+                str(port),
+                "--latency",
+                str(self.latency),
+                "--failure-rate",
+                str(self.failure_rate),
+            ],
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), 0.1).close()
+                break
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.__exit__()
+                    raise RuntimeError("Fake bankstore did not start")
+                time.sleep(0.05)
+        url = "http://127.0.0.1:%d/" % port
+        self.settings = FakeBankstore("MERCHANT", "PASSWORD", ["1"]).settings(url)
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run(
+    settings,
+    client="sync",
+    engine="zeep",
+    concurrency=(10,),
+    duration=10,
+    rps=None,
+    warmup=1,
+    mix=MIX,
+    users=10,
+    ip="127.0.0.1",
+):
+    """
+    Runs a step per concurrency, returns the results
+    """
+    workload = Workload(mix)
+    steps = []
+    max_concurrency = max(concurrency)
+    if client == "sync":
+        from paytpv.client import PaytpvClient
+        from paytpv.transport import PooledTransport
+
+        paytpv = PaytpvClient(
+            settings,
+            ip,
+            engine=engine,
+            transport=PooledTransport(max_connections=max_concurrency),
+        )
+        # Users to start with, failed ones are added by the workload later
+        for _ in range(users):
+            method_name, args = workload.add_user()
+            try:
+                workload.done(method_name, args, paytpv.proxy(method_name, *args))
+            except Exception:
+                pass
+
+        try:
+            for n in concurrency:
+                if warmup:
+                    run_threads(paytpv, workload, n, warmup, rps)
+                started = start()
+                recorder = run_threads(paytpv, workload, n, duration, rps)
+                steps.append(result(started, n, rps, recorder))
+        finally:
+            paytpv.close()
+    else:
+        import asyncio
+
+        from paytpv.client import PaytpvAsyncClient
+        from paytpv.transport import PooledAsyncTransport
+
+        async def main():
+            transport = PooledAsyncTransport(
+                max_connections=max_concurrency, max_keepalive_connections=max_concurrency
+            )
+            async with PaytpvAsyncClient(settings, ip, transport=transport) as paytpv:
+                for _ in range(users):
+                    method_name, args = workload.add_user()
+                    try:
+                        res = await paytpv.proxy(method_name, *args)
+                    except Exception:
+                        continue
+                    workload.done(method_name, args, res)
+                for n in concurrency:
+                    if warmup:
+                        await run_tasks(paytpv, workload, n, warmup, rps)
+                    started = start()
+                    recorder = await run_tasks(paytpv, workload, n, duration, rps)
+                    steps.append(result(started, n, rps, recorder))
+
+        asyncio.run(main())
+
+    return {
+        "client": client,
+        "engine": engine if client == "sync" else "zeep",
+        "mix": mix,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time": time.time(),
+        "steps": steps,
+    }
+
+
+def print_results(results, out=None):
+    out = out or sys.stdout
+    out.write(
+        "%-6s %5s %7s %8s %9s %9s %9s %9s %7s %6s %8s\n"
+        % (
+            "client",
+            "conc",
+            "rps",
+            "calls",
+            "calls/s",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "errors",
+            "cpu%",
+            "rss MB",
+        )
+    )
+    for step in results["steps"]:
+        ms = step["latency_ms"]
+        out.write(
+            "%-6s %5d %7s %8d %9.1f %9s %9s %9s %6.2f%% %6.1f %8.1f\n"
+            % (
+                results["client"],
+                step["concurrency"],
+                step["rps_target"] or "-",
+                step["calls"],
+                step["throughput"],
+                ms["p50"],
+                ms["p95"],
+                ms["p99"],
+                step["error_rate"] * 100,
+                step["cpu_percent"],
+                step["peak_rss_mb"],
+            )
+        )
+
+
+def command(args, out=None):
+    """
+    ``python -m paytpv load``, returns the results
+    """
+    mix = parse_mix(args.mix) if args.mix else MIX
+    concurrency = [int(n) for n in args.concurrency.split(",")]
+    options = dict(
+        client=args.client,
+        engine=args.engine,
+        concurrency=concurrency,
+        duration=args.duration,
+        rps=args.rps or None,
+        warmup=args.warmup,
+        mix=mix,
+        ip=args.ip,
+    )
+    if args.settings:
+        from paytpv.cli import GATEWAY
+        from paytpv.cli import load_settings
+
+        if not args.i_know_this_charges:
+            raise SystemExit(
+                "--settings adds cards and charges on that gateway, "
+                "pass --i-know-this-charges to run"
+            )
+        settings = load_settings(args.settings)
+        if urlparse(settings["PAYTPVURL"]).hostname == urlparse(GATEWAY).hostname:
+            raise SystemExit("Refusing to load test the production gateway")
+        results = run(settings, **options)
+    else:
+        with Stub(args.latency, args.failure_rate) as stub:
+            results = run(stub.settings, **options)
+    print_results(results, out)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+
+def add_parser(commands):
+    parser = commands.add_parser("load", help="load test the clients against a bankstore")
+    parser.add_argument("--client", choices=["sync", "async"], default="sync")
+    parser.add_argument("--engine", choices=["zeep", "fast"], default="zeep",
+                        help="engine of the sync client")
+    parser.add_argument("--concurrency", default="10",
+                        help="threads or tasks, a comma separated list runs a step for each")
+    parser.add_argument("--rps", type=float, help="target calls per second, as fast as possible if not set")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per step")
+    parser.add_argument("--warmup", type=float, default=1, help="seconds before each step, not measured")
+    parser.add_argument("--mix", help="weights by operation, ie info_user=6,execute_purchase=2")
+    parser.add_argument("--settings",
+                        help="json file of settings of a test bankstore, a fake one if not set")
+    parser.add_argument("--i-know-this-charges", action="store_true",
+                        help="allow --settings, whose gateway gets real cards and charges")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added by the fake bankstore")
+    parser.add_argument("--failure-rate", type=float, default=0, help="share of calls the fake bankstore fails")
+    parser.add_argument("--ip", default="127.0.0.1", help="DS_ORIGINAL_IP of the calls")
+    parser.add_argument("--output", help="write the results as json")
+    return parser
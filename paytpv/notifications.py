@@ -0,0 +1,177 @@
+# encoding: utf-8
+"""
+Verification of PAYTPV notifications (URLNOT) of iframe payments.
+
+PAYTPV posts the result of each operation as a form with the notification
+fields. Its signature is, as for iframe urls:
+
+    md5(AccountCode + TpvID + TransactionType + Order + Amount + Currency
+        + md5(PASSWORD) + BankDateTime + Response)
+
+    verifier = NotificationVerifier(settings)
+    notification = verifier.verify(request.body)  # PaytpvInvalidNotification
+    if notification.ok:
+        ...
+"""
+import secrets
+from hashlib import md5
+from urllib.parse import parse_qsl
+
+from paytpv.exc import PaytpvInvalidNotification
+
+
+SIGNATURE = [
+    "AccountCode",
+    "TpvID",
+    "TransactionType",
+    "Order",
+    "Amount",
+    "Currency",
+    # md5(PASSWORD)
+    "BankDateTime",
+    "Response",
+]
+
+
+def parse(payload):
+    """
+    Returns the fields of a notification: a form encoded body (bytes or
+    str) or a mapping as request.POST
+    """
+    if isinstance(payload, bytes):
+        payload = payload.decode("utf-8", "replace")
+    if isinstance(payload, str):
+        return dict(parse_qsl(payload, keep_blank_values=True))
+    return {key: payload[key] for key in payload}
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Notification:
+    """
+    A notification, 'valid' if its signature and merchant are right.
+
+    ok: the operation succeeded (Response "OK")
+    amount: in cents, as in iframe urls
+    reason: why it is not valid, None if it is
+    data: all the fields
+    """
+
+    __slots__ = (
+        "valid",
+        "reason",
+        "order",
+        "amount",
+        "currency",
+        "response",
+        "transaction_type",
+        "error_id",
+        "auth_code",
+        "iduser",
+        "token",
+        "bank_datetime",
+        "data",
+    )
+
+    def __init__(self, data, valid=True, reason=None):
+        self.valid = valid
+        self.reason = reason
+        self.order = data.get("Order")
+        self.amount = _int(data.get("Amount"))
+        self.currency = data.get("Currency")
+        self.response = data.get("Response")
+        self.transaction_type = _int(data.get("TransactionType"))
+        self.error_id = _int(data.get("ErrorID"))
+        self.auth_code = data.get("AuthCode")
+        self.iduser = data.get("IdUser")
+        self.token = data.get("TokenUser")
+        self.bank_datetime = data.get("BankDateTime")
+        self.data = data
+
+    @property
+    def ok(self):
+        return self.valid and self.response == "OK"
+
+    def __repr__(self):
+        return "Notification(%s, %s, %s, valid=%s)" % (
+            self.order,
+            self.response,
+            self.amount,
+            self.valid,
+        )
+
+
+class NotificationVerifier:
+    """
+    Verifies notifications of the merchant terminal of 'settings'. The md5
+    state of the merchant code and terminal is computed once.
+    """
+
+    def __init__(self, settings):
+        self.code = settings["MERCHANTCODE"]
+        self.terminal = settings["MERCHANTTERMINAL"]
+        self.password_md5 = md5(settings["MERCHANTPASSWORD"].encode()).hexdigest()
+        self._prefix = md5((self.code + self.terminal).encode())
+
+    def sign(self, data):
+        """
+        Signature of the notification fields in 'data'
+        """
+        signature = self._prefix.copy()
+        signature.update(
+            (
+                data.get("TransactionType", "")
+                + data.get("Order", "")
+                + data.get("Amount", "")
+                + data.get("Currency", "")
+                + self.password_md5
+                + data.get("BankDateTime", "")
+                + data.get("Response", "")
+            ).encode()
+        )
+        return signature.hexdigest()
+
+    def check(self, payload):
+        """
+        Returns the Notification of 'payload', valid or not
+        """
+        data = parse(payload)
+        if data.get("AccountCode") != self.code or data.get("TpvID") != self.terminal:
+            return Notification(data, False, "unknown merchant terminal")
+        signature = data.get("Signature", "")
+        if not secrets.compare_digest(
+            self.sign(data).encode(), signature.lower().encode()
+        ):
+            return Notification(data, False, "invalid signature")
+        return Notification(data)
+
+    def verify(self, payload):
+        """
+        Returns the Notification of 'payload', raises
+        PaytpvInvalidNotification if it is not valid
+        """
+        notification = self.check(payload)
+        if not notification.valid:
+            raise PaytpvInvalidNotification(notification.reason, notification)
+        return notification
+
+    def check_many(self, payloads):
+        """
+        Returns the Notification of every payload
+        """
+        return [self.check(payload) for payload in payloads]
+
+    async def acheck_many(self, payloads, executor=None):
+        """
+        check_many in 'executor' (the loop default one if None), so big
+        batches don't block the loop
+        """
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.check_many, list(payloads))
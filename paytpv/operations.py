@@ -0,0 +1,378 @@
+# encoding: utf-8
+"""
+Declarative specs of the bankstore operations.
+
+An OperationSpec lists the arguments, the request fields and where their
+values come from, the fields of the signature and the argument validators.
+Specs are compiled to plain python functions, once per process, and bound
+to the merchant settings when a RequestBuilder is created: constant fields
+are pre-bound and the hash of the constant signature prefix is reused.
+"""
+from hashlib import sha1
+
+
+NODEFAULT = object()
+
+
+class Setting:
+    """
+    Field value from the settings, ie Setting("MERCHANTCODE")
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+
+class Const:
+    def __init__(self, value):
+        self.value = value
+
+
+class Amount:
+    """
+    Amount argument in cents, as a string: 1€ = "100"
+    """
+
+    def __init__(self, arg):
+        self.arg = arg
+
+
+class OriginalIp:
+    """
+    'ip' argument of the call, or the ip of the builder
+    """
+
+
+class Positive:
+    def __init__(self, arg, message):
+        self.arg = arg
+        self.message = message
+
+    def __call__(self, value):
+        if value <= 0:
+            raise ValueError(self.message % (value))
+
+
+class MaxLength:
+    def __init__(self, arg, length, message):
+        self.arg = arg
+        self.length = length
+        self.message = message
+
+    def __call__(self, value):
+        if len(value) > self.length:
+            raise ValueError(self.message % (value))
+
+
+class OperationSpec:
+    """
+    name: operation name
+    args: argument names, or (name, default) tuples. An ``ip=None``
+        argument is always added.
+    fields: (field name, source) pairs, source being an argument name,
+        a Setting, Const, Amount or OriginalIp.
+    signature: fields of the signature, in order
+    validators: called with their argument before building the request
+    """
+
+    def __init__(self, name, args, fields, signature, validators=(), doc=None):
+        self.name = name
+        self.args = [
+            arg if isinstance(arg, tuple) else (arg, NODEFAULT) for arg in args
+        ]
+        self.fields = fields
+        self.signature = signature
+        self.validators = validators
+        self.doc = doc
+        self._factory = None
+
+    def is_constant(self, source):
+        return isinstance(source, (Setting, Const))
+
+    def constant(self, source, settings):
+        if isinstance(source, Setting):
+            return settings[source.key]
+        return source.value
+
+    def source(self):
+        """
+        Python source of a factory returning the builder function
+        """
+        sources = dict(self.fields)
+        params = []
+        for arg, default in self.args:
+            params.append(arg if default is NODEFAULT else "%s=%s" % (arg, "_d_" + arg))
+        params.append("ip=None")
+
+        body = []
+        for i, validator in enumerate(self.validators):
+            body.append("_v%d(%s)" % (i, validator.arg))
+
+        values = {}
+        for i, (field, source) in enumerate(self.fields):
+            if self.is_constant(source):
+                values[field] = "_c%d" % i
+            elif isinstance(source, Amount):
+                body.append("f%d = str(int(round(%s * 100, 0)))" % (i, source.arg))
+                values[field] = "f%d" % i
+            elif isinstance(source, OriginalIp):
+                values[field] = "(_builder.ip if ip is None else ip)"
+            else:
+                values[field] = source
+        body.append(
+            "data = {%s}"
+            % ", ".join("%r: %s" % (field, values[field]) for field, _ in self.fields)
+        )
+
+        # Leading constant fields of the signature are hashed once
+        prefix = 0
+        while prefix < len(self.signature) and self.is_constant(
+            sources[self.signature[prefix]]
+        ):
+            prefix += 1
+        parts = [values[field] for field in self.signature[prefix:]] + ["_password"]
+        body.append(
+            'data["DS_MERCHANT_MERCHANTSIGNATURE"] = _sign(%s)' % " + ".join(parts)
+        )
+        body.append("return data")
+
+        factory_params = ["_builder", "_prefix", "_password"]
+        factory_params += [
+            "_c%d" % i
+            for i, (_, source) in enumerate(self.fields)
+            if self.is_constant(source)
+        ]
+        factory_params += [
+            "_d_" + arg for arg, default in self.args if default is not NODEFAULT
+        ]
+        factory_params += ["_v%d" % i for i in range(len(self.validators))]
+        return "\n".join(
+            [
+                "def factory(%s):" % ", ".join(factory_params),
+                "    def _sign(suma):",
+                "        h = _prefix.copy()",
+                "        h.update(suma.encode())",
+                "        return h.hexdigest()",
+                "",
+                "    def %s(%s):" % (self.name, ", ".join(params)),
+            ]
+            + ["        " + line for line in body]
+            + ["    return %s" % self.name]
+        )
+
+    def compile(self, builder, settings):
+        """
+        Returns the builder function of the operation for 'settings'
+        """
+        if self._factory is None:
+            namespace = {}
+            code = compile(self.source(), "<paytpv.operations.%s>" % self.name, "exec")
+            exec(code, namespace)
+            self._factory = namespace["factory"]
+
+        sources = dict(self.fields)
+        prefix = ""
+        for field in self.signature:
+            if not self.is_constant(sources[field]):
+                break
+            prefix += self.constant(sources[field], settings)
+
+        consts = [
+            self.constant(source, settings)
+            for _, source in self.fields
+            if self.is_constant(source)
+        ]
+        defaults = [default for _, default in self.args if default is not NODEFAULT]
+        func = self._factory(
+            builder,
+            sha1(prefix.encode()),
+            settings["MERCHANTPASSWORD"],
+            *(consts + defaults + list(self.validators))
+        )
+        func.__doc__ = self.doc
+        return func
+
+
+MERCHANT = [
+    ("DS_MERCHANT_MERCHANTCODE", Setting("MERCHANTCODE")),
+    ("DS_MERCHANT_TERMINAL", Setting("MERCHANTTERMINAL")),
+    ("DS_ORIGINAL_IP", OriginalIp()),
+]
+
+USER_SIGNATURE = [
+    "DS_MERCHANT_MERCHANTCODE",
+    "DS_IDUSER",
+    "DS_TOKEN_USER",
+    "DS_MERCHANT_TERMINAL",
+]
+
+SPECS = {}
+
+
+def register(spec):
+    SPECS[spec.name] = spec
+    return spec
+
+
+register(
+    OperationSpec(
+        "add_user",
+        args=["pan", "expdate", "cvv", "name"],
+        fields=[
+            ("DS_MERCHANT_PAN", "pan"),  # Número de tarjeta, sin espacios ni guiones {16,19}
+            ("DS_MERCHANT_EXPIRYDATE", "expdate"),  # Fecha de caducidad mmyy
+            ("DS_MERCHANT_CVV2", "cvv"),  # Código CVC2 {3,4}
+            ("DS_MERCHANT_CARDHOLDERNAME", "name"),
+        ]
+        + MERCHANT,
+        signature=[
+            "DS_MERCHANT_MERCHANTCODE",
+            "DS_MERCHANT_PAN",
+            "DS_MERCHANT_CVV2",
+            "DS_MERCHANT_TERMINAL",
+        ],
+        doc="""
+        * Añade una tarjeta a PAYTPV. ¡¡¡ IMPORTANTE !!!
+          Esta entrada directa debe ser activada por PAYTPV.
+        * En su defecto el método de entrada de tarjeta para el cumplimiento del
+          PCI-DSS debe ser AddUserUrl o AddUserToken (método utilizado por BankStore JET)
+        * @param int $pan Número de tarjeta, sin espacios ni guiones
+        * @param string $expdate Fecha de caducidad de la tarjeta,
+          expresada como “mmyy” (mes en dos cifras y año en dos cifras)
+        * @param string $cvv Código CVC2 de la tarjeta
+        * @return object Objeto de respuesta de la operación
+
+        :return:
+         {
+          'DS_IDUSER': '0',
+          'DS_TOKEN_USER': '0',
+          'DS_ERROR_ID': '0'  # 0 no error, else error code
+          }
+        """,
+    )
+)
+
+register(
+    OperationSpec(
+        "info_user",
+        args=["idpayuser", "tokenpayuser"],
+        fields=[("DS_IDUSER", "idpayuser"), ("DS_TOKEN_USER", "tokenpayuser")] + MERCHANT,
+        signature=USER_SIGNATURE,
+        doc="""
+        * Devuelve la información de un usuario almacenada en PAYTPV mediante llamada soap
+        * @param int $idpayuser Id del usuario en PAYTPV
+        * @param string $tokenpayuser Token del usuario en PAYTPV
+        * @return object Objeto de respuesta de la operación
+        """,
+    )
+)
+
+register(
+    OperationSpec(
+        "remove_user",
+        args=["idpayuser", "tokenpayuser"],
+        fields=[("DS_IDUSER", "idpayuser"), ("DS_TOKEN_USER", "tokenpayuser")] + MERCHANT,
+        signature=USER_SIGNATURE,
+        doc="""
+        * Elimina un usuario de PAYTPV mediante llamada soap
+        * @param int $idpayuser Id de usuario en PAYTPV
+        * @param string $tokenpayuser Token de usuario en PAYTPV
+        * @return object Objeto de respuesta de la operación
+
+        :return: DS_RESPONSE: 0 error, 1 completat
+        """,
+    )
+)
+
+register(
+    OperationSpec(
+        "execute_purchase",
+        args=[
+            "idpayuser",
+            "tokenpayuser",
+            "amount",
+            "order",
+            ("description", ""),
+            ("scoring", 0),
+            ("merchant_data", ""),
+            ("merchant_description", ""),
+        ],
+        fields=[
+            ("DS_IDUSER", "idpayuser"),
+            ("DS_TOKEN_USER", "tokenpayuser"),
+            ("DS_MERCHANT_AMOUNT", Amount("amount")),
+            ("DS_MERCHANT_ORDER", "order"),
+            ("DS_MERCHANT_CURRENCY", Const("EUR")),
+            ("DS_MERCHANT_PRODUCTDESCRIPTION", "description"),
+            ("DS_MERCHANT_OWNER", Const("Vinissimus")),
+            ("DS_MERCHANT_SCORING", "scoring"),
+            ("DS_MERCHANT_DATA", "merchant_data"),
+            ("DS_MERCHANT_MERCHANTDESCRIPTOR", "merchant_description"),
+        ]
+        + MERCHANT,
+        signature=USER_SIGNATURE + ["DS_MERCHANT_AMOUNT", "DS_MERCHANT_ORDER"],
+        validators=[
+            Positive(
+                "amount", u"paytpv.executeCharge(): el importe debe ser positivo: %s"
+            ),
+            MaxLength(
+                "order", 20, u"paytpv.executeCharge(): la longitud máxima de order es 20: %s"
+            ),
+            MaxLength(
+                "description",
+                40,
+                u"paytpv.executeCharge(): la longitud máxima de description es 40: %s",
+            ),
+        ],
+        doc="""
+        * Realiza un cobro mediante llamada soap.
+        * @param int $idpayuser Id de usuario en PAYTPV
+        * @param string $tokenpayuser Token de usuario en PAYTPV
+        * @param int $amount Importe del pago 1€ = 100
+        * @param string $order Identificador único del pago
+        * @return object Objeto de respuesta de la operación
+        """,
+    )
+)
+
+register(
+    OperationSpec(
+        "execute_refund",
+        args=[
+            "idpayuser",
+            "tokenpayuser",
+            "amount",
+            "order",
+            "authcode",
+            ("merchant_description", ""),
+        ],
+        fields=[
+            ("DS_IDUSER", "idpayuser"),
+            ("DS_TOKEN_USER", "tokenpayuser"),
+            ("DS_MERCHANT_AMOUNT", Amount("amount")),
+            ("DS_MERCHANT_ORDER", "order"),
+            ("DS_MERCHANT_CURRENCY", Const("EUR")),
+            ("DS_MERCHANT_AUTHCODE", "authcode"),
+            ("DS_MERCHANT_MERCHANTDESCRIPTOR", "merchant_description"),
+        ]
+        + MERCHANT,
+        signature=USER_SIGNATURE + ["DS_MERCHANT_AUTHCODE", "DS_MERCHANT_ORDER"],
+        validators=[
+            Positive(
+                "amount", u"paytpv.executeCharge(): el importe debe ser positivo: %s"
+            ),
+            MaxLength(
+                "order", 20, u"paytpv.executeCharge(): la longitud máxima de order es 20: %s"
+            ),
+        ],
+        doc="""
+        * Realiza devolución mediante llamada soap
+        * @param int $idpayuser Id de usuario en PAYTPV
+        * @param string $tokenpayuser Token de usuario en PAYTPV
+        * @param int $amount Importe del pago 1€ = 100
+        * @param string $order Identificador único del pago (debe ser el mismo del cobro)
+        * @param string authcode Identificador devuelto en el momento del cobro
+        * @return object Objeto de respuesta de la operación
+        """,
+    )
+)
@@ -0,0 +1,341 @@
+# encoding: utf-8
+"""
+Reconciliation of local charges and refunds with PAYTPV settlement exports.
+
+Local records are indexed by order (and charges by authcode), then the
+settlement rows are streamed and matched against the index in one pass.
+Memory grows with the local records of the run, not with the export.
+
+    reconciler = Reconciler.load("reconcile.json", grace_days=2)
+    report = reconciler.run(local_records, read_settlement("export.csv", unit=EUROS))
+    reconciler.save("reconcile.json")
+    report.write_csv(open("discrepancies.csv", "w"))
+
+Local records are dicts with operation ("execute_purchase" or
+"execute_refund"), order, amount in cents and authcode, as returned by the
+client calls. records_from_journal() reads them from a Journal.
+"""
+import csv
+import datetime
+import json
+import os
+from decimal import Decimal
+
+from paytpv.journal import OK
+from paytpv.journal import read
+
+
+CHARGE = "charge"
+REFUND = "refund"
+
+OPERATIONS = {
+    "execute_purchase": CHARGE,
+    "execute_refund": REFUND,
+    CHARGE: CHARGE,
+    REFUND: REFUND,
+}
+
+# Settlement column names
+COLUMNS = {
+    "order": "Order",
+    "amount": "Amount",
+    "authcode": "AuthCode",
+    "type": "TransactionType",
+}
+
+# Values of the type column for refunds, TransactionType 2 in PAYTPV
+REFUND_TYPES = frozenset(["2", "refund", "devolución", "devolucion"])
+
+# Units of amounts
+CENTS = "cents"
+EUROS = "euros"
+
+
+def cents(value, unit=CENTS):
+    """
+    Amount in cents of 'value', an int or a string in 'unit': CENTS
+    ("3300") or EUROS ("33", "33.00", "33,00", "1.033,00")
+    """
+    if unit not in (CENTS, EUROS):
+        raise ValueError("Unknown unit: %s" % unit)
+    if isinstance(value, int):
+        return value if unit == CENTS else value * 100
+    value = value.strip()
+    if unit == CENTS:
+        return int(value)
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    return int(Decimal(value) * 100)
+
+
+class Entry:
+    __slots__ = ("kind", "order", "amount", "authcode", "day")
+
+    def __init__(self, kind, order, amount, authcode=None, day=None):
+        self.kind = kind
+        self.order = order
+        self.amount = amount
+        self.authcode = authcode
+        self.day = day
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return "Entry(%s, %s, %s, %s)" % (self.kind, self.order, self.amount, self.authcode)
+
+
+def local_entry(record, day=None):
+    return Entry(
+        OPERATIONS[record.get("operation") or record["type"]],
+        str(record["order"]),
+        cents(record["amount"]),
+        record.get("authcode"),
+        day,
+    )
+
+
+def records_from_journal(path):
+    """
+    Yields local records of the ok calls in a Journal
+    """
+    intents = {}
+    for record in read(path):
+        key = (record["operation"], record["order"])
+        if record["event"] == "intent":
+            intents[record.get("id") or key] = record
+            continue
+        intent_id = record.get("id")
+        if intent_id is None:
+            # Resolved by order, or written before ids
+            intent_id = next(
+                (i for i, intent in intents.items() if (intent["operation"], intent["order"]) == key),
+                None,
+            )
+        intent = intents.pop(intent_id, None)
+        if intent is not None and record.get("status") == OK:
+            yield {
+                "operation": record["operation"],
+                "order": record["order"],
+                "amount": intent["amount"],
+                "authcode": record.get("authcode"),
+            }
+
+
+def read_settlement(f, columns=COLUMNS, refund_types=REFUND_TYPES, unit=EUROS, **kwargs):
+    """
+    Yields settlement entries of a csv export, 'f' a path or a text file,
+    with amounts in 'unit' (EUROS or CENTS). Other arguments are passed to
+    csv.DictReader, ie ``delimiter=";"``.
+    """
+    if isinstance(f, str):
+        with open(f, newline="", encoding="utf-8-sig") as f:
+            yield from read_settlement(f, columns, refund_types, unit, **kwargs)
+        return
+    order, amount, authcode, type_ = (
+        columns["order"],
+        columns["amount"],
+        columns["authcode"],
+        columns["type"],
+    )
+    for row in csv.DictReader(f, **kwargs):
+        kind = REFUND if row[type_].strip().lower() in refund_types else CHARGE
+        yield Entry(
+            kind, row[order].strip(), cents(row[amount], unit), row[authcode].strip()
+        )
+
+
+class Report:
+    """
+    matched: number of settlement entries matching a local one
+    missing_local: settlement entries without a local record
+    missing_settlement: local entries not settled after the grace days
+    pending: local entries not settled yet, carried to the next run
+    amount_mismatch: (local, settlement) pairs with different amounts
+    refunded_twice: settlement refunds over the amount of the charge
+    """
+
+    def __init__(self):
+        self.matched = 0
+        self.missing_local = []
+        self.missing_settlement = []
+        self.pending = []
+        self.amount_mismatch = []
+        self.refunded_twice = []
+
+    @property
+    def ok(self):
+        return not (
+            self.missing_local
+            or self.missing_settlement
+            or self.amount_mismatch
+            or self.refunded_twice
+        )
+
+    def summary(self):
+        return {
+            "matched": self.matched,
+            "missing_local": len(self.missing_local),
+            "missing_settlement": len(self.missing_settlement),
+            "pending": len(self.pending),
+            "amount_mismatch": len(self.amount_mismatch),
+            "refunded_twice": len(self.refunded_twice),
+        }
+
+    def write_csv(self, out):
+        """
+        Writes the discrepancies to the text file 'out'
+        """
+        writer = csv.writer(out)
+        writer.writerow(
+            ["issue", "kind", "order", "amount", "settled_amount", "authcode"]
+        )
+        for entry in self.missing_local:
+            writer.writerow(
+                ["missing_local", entry.kind, entry.order, "", entry.amount, entry.authcode]
+            )
+        for entry in self.missing_settlement:
+            writer.writerow(
+                ["missing_settlement", entry.kind, entry.order, entry.amount, "", entry.authcode]
+            )
+        for local, settled in self.amount_mismatch:
+            writer.writerow(
+                [
+                    "amount_mismatch",
+                    local.kind,
+                    local.order,
+                    local.amount,
+                    settled.amount,
+                    settled.authcode,
+                ]
+            )
+        for entry in self.refunded_twice:
+            writer.writerow(
+                ["refunded_twice", entry.kind, entry.order, "", entry.amount, entry.authcode]
+            )
+
+
+class Reconciler:
+    """
+    Reconciles local records with settlement entries. For daily runs, the
+    state keeps the local entries not settled yet, for 'grace_days', and
+    the charged and refunded amounts of the last 'keep_days', to detect
+    refunds of charges settled in previous runs.
+    """
+
+    def __init__(self, grace_days=0, keep_days=7, state=None):
+        self.grace_days = grace_days
+        self.keep_days = keep_days
+        state = state or {}
+        self.pending = [Entry(**entry) for entry in state.get("pending", [])]
+        # order: [amount, day]
+        self.charged = state.get("charged", {})
+        self.refunded = state.get("refunded", {})
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        state = None
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+        return cls(state=state, **kwargs)
+
+    def state(self):
+        return {
+            "pending": [entry.as_dict() for entry in self.pending],
+            "charged": self.charged,
+            "refunded": self.refunded,
+        }
+
+    def save(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state(), f)
+        os.replace(tmp, path)
+
+    def run(self, local, settlement, day=None):
+        """
+        Reconciles 'local' records and 'settlement' entries of 'day' (an
+        ordinal date, today by default), returns a Report
+        """
+        day = day or datetime.date.today().toordinal()
+        report = Report()
+
+        # Index of the local entries: charges by order and authcode, refunds
+        # by order
+        charges, authcodes, refunds = {}, {}, {}
+        for entry in self.pending + [local_entry(record, day) for record in local]:
+            if entry.kind == CHARGE:
+                charges[entry.order] = entry
+                if entry.authcode:
+                    authcodes[entry.authcode] = entry.order
+                self.charged[entry.order] = [entry.amount, day]
+            else:
+                refunds.setdefault(entry.order, []).append(entry)
+
+        for settled in settlement:
+            if settled.kind == CHARGE:
+                self._charge(settled, charges, authcodes, report, day)
+            else:
+                self._refund(settled, refunds, report, day)
+
+        self.pending = []
+        for entry in list(charges.values()) + [
+            entry for entries in refunds.values() for entry in entries
+        ]:
+            if day - entry.day >= self.grace_days:
+                report.missing_settlement.append(entry)
+            else:
+                report.pending.append(entry)
+                self.pending.append(entry)
+
+        for amounts in (self.charged, self.refunded):
+            for order in [o for o, (_, d) in amounts.items() if day - d > self.keep_days]:
+                del amounts[order]
+        return report
+
+    def _charge(self, settled, charges, authcodes, report, day):
+        local = charges.pop(settled.order, None)
+        if local is None and settled.authcode in authcodes:
+            local = charges.pop(authcodes[settled.authcode], None)
+        if local is None:
+            report.missing_local.append(settled)
+            return
+        authcodes.pop(local.authcode, None)
+        if local.amount != settled.amount:
+            report.amount_mismatch.append((local, settled))
+        else:
+            report.matched += 1
+
+    def _refund(self, settled, refunds, report, day):
+        refunded = self.refunded.get(settled.order, [0, day])[0] + settled.amount
+        self.refunded[settled.order] = [refunded, day]
+        charged = self.charged.get(settled.order)
+
+        over = charged is not None and refunded > charged[0]
+
+        entries = refunds.get(settled.order)
+        if not entries:
+            if over:
+                report.refunded_twice.append(settled)
+            else:
+                report.missing_local.append(settled)
+            return
+        for i, local in enumerate(entries):
+            if local.amount == settled.amount:
+                break
+        else:
+            i, local = 0, entries[0]
+        del entries[i]
+        if not entries:
+            del refunds[settled.order]
+
+        if over:
+            report.refunded_twice.append(settled)
+        elif local.amount != settled.amount:
+            report.amount_mismatch.append((local, settled))
+        else:
+            report.matched += 1
@@ -0,0 +1,64 @@
+# encoding: utf-8
+import threading
+
+from paytpv import forks
+from paytpv.client import PaytpvClient
+
+
+class ClientRegistry:
+    """
+    Process wide clients, one per client class, WSDL, endpoint and merchant
+    terminal. Shared clients keep no per-request state: pass the customer
+    ip on each call, ``client.execute_purchase(..., ip=ip)``.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        # Clients are kept, they reset themselves
+        self._lock = threading.Lock()
+
+    def key(self, settings, cls):
+        return (
+            cls,
+            settings["PAYTPVWSDL"],
+            settings["PAYTPVURL"],
+            settings["MERCHANTCODE"],
+            settings["MERCHANTTERMINAL"],
+            settings["MERCHANTPASSWORD"],
+        )
+
+    def get(self, settings, cls=PaytpvClient, **kwargs):
+        """
+        Returns the shared client for 'settings', built with 'kwargs' the
+        first time. Raises ValueError if the client was built with other
+        kwargs; without kwargs, the shared client is returned as it is.
+        """
+        key = self.key(settings, cls)
+        entry = self._clients.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._clients.get(key)
+                if entry is None:
+                    entry = self._clients[key] = (cls(settings, **kwargs), kwargs)
+        client, client_kwargs = entry
+        if kwargs and kwargs != client_kwargs:
+            raise ValueError(
+                "Shared client for terminal %s was built with other arguments: %s"
+                % (settings["MERCHANTTERMINAL"], sorted(client_kwargs))
+            )
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+registry = ClientRegistry()
+
+
+def get_client(settings, cls=PaytpvClient, **kwargs):
+    return registry.get(settings, cls, **kwargs)
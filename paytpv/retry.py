@@ -0,0 +1,270 @@
+# encoding: utf-8
+import asyncio
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+from zeep.exceptions import Fault
+from zeep.exceptions import TransportError
+
+from paytpv import forks
+from paytpv.exc import PaytpvCircuitOpen
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvFault
+
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+# DS_ERROR_ID codes for transient gateway failures. The request was likely
+# not processed, but a charge may have been: they are only retried for
+# idempotent operations by default. The rest of the codes are terminal.
+RETRYABLE_CODES = frozenset(
+    [
+        104,  # Unexpected error
+        1002,  # External provider error
+        1011,  # Database connection failed
+        1099,  # Unexpected error
+    ]
+)
+
+# Operations that can be repeated without side effects, even if the first
+# request may have reached the gateway
+IDEMPOTENT = frozenset(["info_user", "remove_user"])
+
+
+def not_sent(error):
+    """
+    True if 'error' happened before the request reached the gateway
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0] if error.args else None, "reason", None)
+        return isinstance(reason, NewConnectionError)
+    return httpx is not None and isinstance(
+        error, (httpx.ConnectError, httpx.ConnectTimeout)
+    )
+
+
+def transport_error(error):
+    """
+    True for network errors and 5xx responses
+    """
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    if isinstance(error, TransportError):
+        return error.status_code >= 500
+    if httpx is not None and isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, requests.exceptions.RequestException) or (
+        httpx is not None and isinstance(error, httpx.TransportError)
+    )
+
+
+def gateway_answer(error):
+    """
+    True if 'error' was answered by the gateway: an error code, a SOAP
+    fault or an HTTP error status
+    """
+    if isinstance(error, (PaytpvException, PaytpvFault, Fault, TransportError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        return error.response is not None
+    return httpx is not None and isinstance(error, httpx.HTTPStatusError)
+
+
+class CircuitBreaker:
+    """
+    Fails fast with PaytpvCircuitOpen after 'failure_threshold' consecutive
+    gateway failures. After 'reset_timeout' seconds one trial call is let
+    through, its success closes the circuit again. A trial that is cancelled
+    opens it again, one never settled is replaced after 'reset_timeout'.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_at = None
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_at = now
+                return
+            if self.state == self.HALF_OPEN and now - self.trial_at >= self.reset_timeout:
+                self.trial_at = now
+                return
+            if self.state == self.HALF_OPEN:
+                raise PaytpvCircuitOpen(self.trial_at + self.reset_timeout)
+            raise PaytpvCircuitOpen(self.opened_at + self.reset_timeout)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_cancel(self):
+        """
+        A call was cancelled before its outcome was known
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Retries failed calls with exponential backoff and full jitter, while
+    'max_attempts' and the total 'deadline' (seconds) allow it.
+
+    Errors raised before the request was sent are retried for every
+    operation. Gateway errors in 'retryable_codes' and other transport
+    errors (timeouts, 5xx) are only retried for 'idempotent' operations, as
+    a charge may have been processed; with 'retry_unsafe', gateway errors
+    in 'retryable_codes' are retried for every operation too.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        base_delay=0.1,
+        max_delay=2,
+        deadline=10,
+        retryable_codes=RETRYABLE_CODES,
+        idempotent=IDEMPOTENT,
+        breaker=None,
+        retry_unsafe=False,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retryable_codes = retryable_codes
+        self.idempotent = idempotent
+        self.breaker = breaker
+        self.retry_unsafe = retry_unsafe
+
+    def is_failure(self, error):
+        """
+        True if 'error' tells the gateway is unhealthy
+        """
+        if isinstance(error, PaytpvException):
+            return error.code in self.retryable_codes
+        return transport_error(error)
+
+    def is_retryable(self, method_name, error):
+        if isinstance(error, PaytpvException):
+            return error.code in self.retryable_codes and (
+                self.retry_unsafe or method_name in self.idempotent
+            )
+        if not_sent(error):
+            return True
+        return method_name in self.idempotent and transport_error(error)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _before(self):
+        if self.breaker is not None:
+            self.breaker.allow()
+
+    def _after(self, error=None):
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.record_success()
+        elif not isinstance(error, Exception):
+            # Cancelled (CancelledError, KeyboardInterrupt): settle a trial
+            self.breaker.record_cancel()
+        elif self.is_failure(error):
+            self.breaker.record_failure()
+        elif gateway_answer(error):
+            self.breaker.record_success()
+        else:
+            # Raised here (limiter, validation), the gateway wasn't reached
+            self.breaker.record_cancel()
+
+    def _delay(self, method_name, error, attempt, start):
+        """
+        Returns seconds to wait before the next attempt, None to give up
+        """
+        if attempt + 1 >= self.max_attempts or not self.is_retryable(
+            method_name, error
+        ):
+            return None
+        delay = self.backoff(attempt)
+        if time.monotonic() - start + delay > self.deadline:
+            return None
+        return delay
+
+    def call(self, method_name, func, *args):
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self._before()
+            try:
+                res = func(*args)
+            except Exception as e:
+                self._after(e)
+                delay = self._delay(method_name, e, attempt, start)
+                if delay is None:
+                    raise
+            except BaseException as e:
+                self._after(e)
+                raise
+            else:
+                self._after()
+                return res
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, method_name, func, *args):
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self._before()
+            try:
+                res = await func(*args)
+            except Exception as e:
+                self._after(e)
+                delay = self._delay(method_name, e, attempt, start)
+                if delay is None:
+                    raise
+            except BaseException as e:
+                self._after(e)
+                raise
+            else:
+                self._after()
+                return res
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,213 @@
+# encoding: utf-8
+"""
+Several merchant terminals behind one client.
+
+New users are spread over the terminals. A user belongs to the terminal
+that created its token, so the calls on an existing user (info_user,
+remove_user, execute_purchase, execute_refund) go to that terminal; users
+the pool doesn't know are on the first terminal.
+"""
+import itertools
+import threading
+import time
+from functools import partial
+
+from paytpv import forks
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+
+
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+
+# Operations routed by the pool strategy, the rest go to the token owner
+SPREAD = frozenset(["add_user"])
+
+
+class TerminalStats:
+    """
+    in_flight: calls in progress
+    calls: finished calls
+    errors: calls that raised
+    seconds: total duration of the finished calls
+    """
+
+    __slots__ = ("terminal", "in_flight", "calls", "errors", "seconds")
+
+    def __init__(self, terminal):
+        self.terminal = terminal
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def as_dict(self):
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "avg_seconds": self.seconds / self.calls if self.calls else 0.0,
+        }
+
+    def __repr__(self):
+        return "TerminalStats(%s, %s)" % (self.terminal, self.as_dict())
+
+
+class TerminalPool:
+    """
+    Clients for several terminals, one settings dict per terminal:
+
+        pool = TerminalPool([settings_1, settings_2], strategy="least_loaded")
+        user = pool.add_user(pan, expdate, cvv, name, ip=ip)
+        pool.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, order)
+        pool.load()
+
+    strategy: "round_robin" or "least_loaded" (fewest calls in flight)
+    owners: mapping of idpayuser to its terminal, filled by add_user. Pass
+        a persistent mapping to keep it between processes.
+    limiter: function of the settings of a terminal returning its Limiter,
+        ie ``lambda settings: Limiter(rate=50, shared=settings)``
+    Other arguments are passed to the client of each terminal. Every call
+    accepts a ``terminal=`` argument to choose the terminal.
+    """
+
+    client_class = PaytpvClient
+
+    def __init__(
+        self, settings, strategy=ROUND_ROBIN, owners=None, limiter=None, **kwargs
+    ):
+        if strategy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError("Unknown strategy: %s" % strategy)
+        if limiter is not None and not callable(limiter):
+            raise ValueError("limiter must build a Limiter for each terminal's settings")
+        self.clients = {}
+        for terminal_settings in settings:
+            terminal = terminal_settings["MERCHANTTERMINAL"]
+            if limiter is not None:
+                kwargs["limiter"] = limiter(terminal_settings)
+            self.clients[terminal] = self.client_class(terminal_settings, **kwargs)
+        if not self.clients:
+            raise ValueError("TerminalPool needs at least one terminal")
+        self.terminals = list(self.clients)
+        self.default = self.terminals[0]
+        self.strategy = strategy
+        self.owners = {} if owners is None else owners
+        self.stats = {terminal: TerminalStats(terminal) for terminal in self.terminals}
+        self._cycle = itertools.cycle(self.terminals)
+        self._lock = threading.Lock()
+        forks.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        for stats in self.stats.values():
+            stats.in_flight = 0
+
+    def __getattr__(self, name):
+        if name in PaytpvClient.methods:
+            return partial(self.call, name)
+        raise AttributeError(name)
+
+    def choose(self):
+        """
+        Terminal for a new user
+        """
+        with self._lock:
+            if self.strategy == ROUND_ROBIN:
+                return next(self._cycle)
+            return min(
+                self.terminals,
+                key=lambda terminal: (
+                    self.stats[terminal].in_flight,
+                    self.stats[terminal].calls,
+                ),
+            )
+
+    def terminal_for(self, idpayuser):
+        """
+        Terminal owning the token of 'idpayuser'
+        """
+        return self.owners.get(str(idpayuser), self.default)
+
+    def route(self, method_name, args, kwargs):
+        if method_name in SPREAD:
+            return self.choose()
+        idpayuser = args[0] if args else kwargs["idpayuser"]
+        return self.terminal_for(idpayuser)
+
+    def load(self):
+        """
+        {terminal: stats dict} of every terminal
+        """
+        with self._lock:
+            return {terminal: stats.as_dict() for terminal, stats in self.stats.items()}
+
+    def _start(self, terminal):
+        with self._lock:
+            self.stats[terminal].in_flight += 1
+        return time.perf_counter()
+
+    def _end(self, terminal, start, error=False):
+        seconds = time.perf_counter() - start
+        with self._lock:
+            stats = self.stats[terminal]
+            stats.in_flight -= 1
+            stats.calls += 1
+            stats.seconds += seconds
+            if error:
+                stats.errors += 1
+
+    def _update_owners(self, method_name, args, kwargs, res, terminal):
+        if method_name == "add_user":
+            self.owners[str(res.DS_IDUSER)] = terminal
+        elif method_name == "remove_user":
+            idpayuser = args[0] if args else kwargs["idpayuser"]
+            self.owners.pop(str(idpayuser), None)
+
+    def call(self, method_name, *args, terminal=None, **kwargs):
+        if terminal is None:
+            terminal = self.route(method_name, args, kwargs)
+        method = getattr(self.clients[terminal], method_name)
+        start = self._start(terminal)
+        failed = True
+        try:
+            res = method(*args, **kwargs)
+            failed = False
+        finally:
+            # Cancelled calls leave the terminal too
+            self._end(terminal, start, error=failed)
+        self._update_owners(method_name, args, kwargs, res, terminal)
+        return res
+
+
+class AsyncTerminalPool(TerminalPool):
+    """
+    TerminalPool of PaytpvAsyncClient
+    """
+
+    client_class = PaytpvAsyncClient
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type=None, exc_value=None, traceback=None):
+        await self.aclose()
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+
+    async def call(self, method_name, *args, terminal=None, **kwargs):
+        if terminal is None:
+            terminal = self.route(method_name, args, kwargs)
+        method = getattr(self.clients[terminal], method_name)
+        start = self._start(terminal)
+        failed = True
+        try:
+            res = await method(*args, **kwargs)
+            failed = False
+        finally:
+            # Cancelled calls leave the terminal too
+            self._end(terminal, start, error=failed)
+        self._update_owners(method_name, args, kwargs, res, terminal)
+        return res
@@ -0,0 +1,433 @@
+# encoding: utf-8
+"""
+Local stand-in for the PAYTPV bankstore SOAP service, for tests and load
+runs without credentials or network.
+
+    python -m paytpv.testing --port 8000 --latency 0.05
+
+Serves the WSDL on GET ``?wsdl`` and implements add_user, info_user,
+remove_user, execute_purchase and execute_refund with in-memory state.
+"""
+import argparse
+import datetime
+import hashlib
+import os
+import random
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from paytpv.builder import RequestBuilder
+from paytpv.operations import SPECS
+
+
+# The WSDL served, the one bundled with the package
+WSDL = os.path.join(os.path.dirname(__file__), "data", "xml-bankstore.wsdl")
+NAMESPACE = "https://secure.paytpv.com/gateway/xml-bankstore"
+
+_WSDL_NS = "{http://schemas.xmlsoap.org/wsdl/}"
+
+
+# Error codes returned by the fake gateway
+ERROR_PAN = 108  # PAN check error
+ERROR_EXPIRY = 109  # Expiry date error
+ERROR_CVV = 111  # CVC2 error
+ERROR_UNEXPECTED = 1099  # Unexpected error, used for failure injection
+ERROR_USER_NOT_FOUND = 1001  # User not found
+ERROR_SIGNATURE = 1003  # Wrong signature
+ERROR_AMOUNT = 1005  # Wrong amount
+ERROR_OPERATION_NOT_FOUND = 1017  # Charge not found for order and authcode
+ERROR_DUPLICATE_ORDER = 1024  # Order already used
+ERROR_REFUND_AMOUNT = 1049  # Refund exceeds the charged amount
+
+# Known test cards, other cards get data derived from the PAN
+TEST_CARDS = {
+    "4539232076648253": {
+        "DS_CARD_BRAND": "VISA",
+        "DS_CARD_TYPE": "CREDIT",
+        "DS_CARD_I_COUNTRY_ISO3": "ESP",
+        "DS_CARD_CATEGORY": "BUSINESS",
+        "DS_CARD_HASH": "d752d8a349d88ba10f5d09f2ec09baba7b527d82d3fdaef175048a15e19e34bc",
+        "country": 724,
+    },
+}
+
+# Fields signed by each operation
+SIGNATURES = {name: spec.signature for name, spec in SPECS.items()}
+
+
+def response_types(filename=WSDL):
+    """
+    Returns {operation: {part: int or str}} of the responses of an rpc
+    style WSDL
+    """
+    root = ElementTree.parse(filename).getroot()
+    messages = {
+        message.get("name"): {
+            part.get("name"): int if part.get("type") == "xsd:int" else str
+            for part in message.iter(_WSDL_NS + "part")
+        }
+        for message in root.iter(_WSDL_NS + "message")
+    }
+    return {
+        operation.get("name"): messages[
+            operation.find(_WSDL_NS + "output").get("message").partition(":")[2]
+        ]
+        for operation in root.find(_WSDL_NS + "portType")
+    }
+
+
+RESPONSE_TYPES = response_types()
+
+RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:ns1="%s"><SOAP-ENV:Body><ns1:%%sResponse>%%s</ns1:%%sResponse>'
+    "</SOAP-ENV:Body></SOAP-ENV:Envelope>" % NAMESPACE
+)
+
+FAULT = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+    "<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode>"
+    "<faultstring>%s</faultstring></SOAP-ENV:Fault></SOAP-ENV:Body></SOAP-ENV:Envelope>"
+)
+
+
+class GatewayError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def luhn(pan):
+    digits = [int(d) for d in reversed(pan)]
+    total = sum(digits[::2]) + sum(sum(divmod(d * 2, 10)) for d in digits[1::2])
+    return total % 10 == 0
+
+
+class FakeBankstore:
+    """
+    In-memory state and rules of the bankstore operations. Each method
+    takes the request fields and returns the response fields, raising
+    GatewayError for gateway errors.
+    """
+
+    def __init__(self, merchantcode, password, terminals):
+        self.merchantcode = merchantcode
+        self.password = password
+        self.terminals = set(terminals)
+        self.users = {}
+        self.charges = {}
+        self._ids = iter(range(1, 2 ** 62))
+        self._lock = threading.Lock()
+
+    def settings(self, url, terminal=None):
+        return {
+            "MERCHANTCODE": self.merchantcode,
+            "MERCHANTPASSWORD": self.password,
+            "MERCHANTTERMINAL": terminal or sorted(self.terminals)[0],
+            "PAYTPVURL": url,
+            "PAYTPVWSDL": url + "?wsdl",
+        }
+
+    def call(self, method_name, data):
+        if (
+            data.get("DS_MERCHANT_MERCHANTCODE") != self.merchantcode
+            or data.get("DS_MERCHANT_TERMINAL") not in self.terminals
+        ):
+            raise GatewayError(ERROR_SIGNATURE)
+        builder = RequestBuilder(
+            {
+                "MERCHANTCODE": self.merchantcode,
+                "MERCHANTPASSWORD": self.password,
+                "MERCHANTTERMINAL": data["DS_MERCHANT_TERMINAL"],
+                "PAYTPVURL": None,
+                "PAYTPVWSDL": None,
+            }
+        )
+        data = dict(data)
+        for field in SIGNATURES[method_name]:
+            data.setdefault(field, "")
+        signature = builder.signature(data, SIGNATURES[method_name])
+        if not secrets.compare_digest(
+            signature, data.get("DS_MERCHANT_MERCHANTSIGNATURE", "")
+        ):
+            raise GatewayError(ERROR_SIGNATURE)
+        with self._lock:
+            return getattr(self, method_name)(data)
+
+    def _user(self, data):
+        user = self.users.get(data["DS_IDUSER"])
+        if (
+            user is None
+            or user["token"] != data["DS_TOKEN_USER"]
+            or user["terminal"] != data["DS_MERCHANT_TERMINAL"]
+        ):
+            raise GatewayError(ERROR_USER_NOT_FOUND)
+        return user
+
+    def _amount(self, data):
+        amount = data.get("DS_MERCHANT_AMOUNT", "")
+        if not amount.isdigit() or int(amount) <= 0:
+            raise GatewayError(ERROR_AMOUNT)
+        return int(amount)
+
+    def add_user(self, data):
+        expdate = data.get("DS_MERCHANT_EXPIRYDATE", "")
+        if not re.match(r"^(0[1-9]|1[0-2])\d\d$", expdate):
+            raise GatewayError(ERROR_EXPIRY)
+        today = datetime.date.today()
+        if (2000 + int(expdate[2:]), int(expdate[:2])) < (today.year, today.month):
+            raise GatewayError(ERROR_EXPIRY)
+        pan = data["DS_MERCHANT_PAN"]
+        if not re.match(r"^\d{13,19}$", pan) or not luhn(pan):
+            raise GatewayError(ERROR_PAN)
+        if not re.match(r"^\d{3,4}$", data["DS_MERCHANT_CVV2"]):
+            raise GatewayError(ERROR_CVV)
+
+        iduser = str(next(self._ids))
+        card = TEST_CARDS.get(pan) or {
+            "DS_CARD_BRAND": {"3": "AMEX", "4": "VISA", "5": "MASTERCARD"}.get(
+                pan[0], "OTHER"
+            ),
+            "DS_CARD_TYPE": "CREDIT",
+            "DS_CARD_I_COUNTRY_ISO3": "ESP",
+            "DS_CARD_CATEGORY": "CONSUMER",
+            "DS_CARD_HASH": hashlib.sha256(pan.encode()).hexdigest(),
+            "country": 724,
+        }
+        self.users[iduser] = {
+            "token": secrets.token_hex(10).upper(),
+            "terminal": data["DS_MERCHANT_TERMINAL"],
+            "pan": pan,
+            "expdate": expdate,
+            "name": data.get("DS_MERCHANT_CARDHOLDERNAME", ""),
+            "card": card,
+        }
+        return {"DS_IDUSER": iduser, "DS_TOKEN_USER": self.users[iduser]["token"]}
+
+    def info_user(self, data):
+        user = self._user(data)
+        pan, expdate = user["pan"], user["expdate"]
+        res = {
+            "DS_MERCHANT_PAN": "%s-XX-XXXX-%s" % (pan[:6], pan[-4:]),
+            "DS_EXPIRYDATE": "20%s/%s" % (expdate[2:], expdate[:2]),
+        }
+        res.update(
+            (key, value) for key, value in user["card"].items() if key.startswith("DS_")
+        )
+        return res
+
+    def remove_user(self, data):
+        self._user(data)
+        del self.users[data["DS_IDUSER"]]
+        return {"DS_RESPONSE": 1}
+
+    def execute_purchase(self, data):
+        user = self._user(data)
+        amount = self._amount(data)
+        order = data.get("DS_MERCHANT_ORDER", "")
+        if not order or order in self.charges:
+            raise GatewayError(ERROR_DUPLICATE_ORDER)
+        authcode = secrets.token_hex(3).upper()
+        self.charges[order] = {
+            "iduser": data["DS_IDUSER"],
+            "amount": amount,
+            "currency": data.get("DS_MERCHANT_CURRENCY", "EUR"),
+            "authcode": authcode,
+            "refunded": 0,
+        }
+        return {
+            "DS_MERCHANT_AMOUNT": amount,
+            "DS_MERCHANT_ORDER": order,
+            "DS_MERCHANT_CURRENCY": self.charges[order]["currency"],
+            "DS_MERCHANT_AUTHCODE": authcode,
+            "DS_MERCHANT_CARDCOUNTRY": user["card"]["country"],
+            "DS_RESPONSE": 1,
+        }
+
+    def execute_refund(self, data):
+        self._user(data)
+        amount = self._amount(data)
+        charge = self.charges.get(data.get("DS_MERCHANT_ORDER"))
+        if (
+            charge is None
+            or charge["authcode"] != data.get("DS_MERCHANT_AUTHCODE")
+            or charge["iduser"] != data["DS_IDUSER"]
+        ):
+            raise GatewayError(ERROR_OPERATION_NOT_FOUND)
+        if charge["refunded"] + amount > charge["amount"]:
+            raise GatewayError(ERROR_REFUND_AMOUNT)
+        charge["refunded"] += amount
+        return {
+            "DS_MERCHANT_ORDER": data["DS_MERCHANT_ORDER"],
+            "DS_MERCHANT_CURRENCY": charge["currency"],
+            "DS_MERCHANT_AUTHCODE": charge["authcode"],
+            "DS_RESPONSE": 1,
+        }
+
+
+def render(method_name, res, error=0):
+    types = RESPONSE_TYPES[method_name]
+    fields = []
+    for name, type_ in types.items():
+        if name == "DS_ERROR_ID":
+            value = error
+        else:
+            value = res.get(name, 0 if type_ is int else "")
+        fields.append("<%s>%s</%s>" % (name, escape(str(value)), name))
+    return RESPONSE % (method_name, "".join(fields), method_name)
+
+
+class FakeBankstoreServer(ThreadingHTTPServer):
+    """
+    HTTP server for a FakeBankstore.
+
+    :param latency: seconds added to each call, or a (min, max) range
+    :param failure_rate: share of calls answered with 'failure_code'
+    :param http_error_rate: share of calls answered with a 503
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        bankstore,
+        address=("127.0.0.1", 0),
+        latency=0,
+        failure_rate=0,
+        failure_code=ERROR_UNEXPECTED,
+        http_error_rate=0,
+    ):
+        super().__init__(address, FakeBankstoreHandler)
+        self.bankstore = bankstore
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.http_error_rate = http_error_rate
+        self.connections = set()
+        self.calls = 0
+        self.pings = 0
+        with open(WSDL) as f:
+            self.wsdl = f.read().replace(
+                '<soap:address location="%s"/>' % NAMESPACE,
+                '<soap:address location="%s"/>' % self.url,
+            )
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://%s:%d/" % self.server_address[:2]
+
+    def settings(self, terminal=None):
+        return self.bankstore.settings(self.url, terminal)
+
+    def delay(self):
+        if isinstance(self.latency, (tuple, list)):
+            return random.uniform(*self.latency)
+        return self.latency
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeBankstoreHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, content, content_type="text/xml; charset=utf-8"):
+        content = content.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path.lower().endswith("?wsdl"):
+            self.respond(200, self.server.wsdl)
+        else:
+            self.respond(404, "", "text/plain")
+
+    def do_HEAD(self):
+        # Keep-alive pings, see paytpv.warmup
+        self.server.connections.add(self.client_address)
+        self.server.pings += 1
+        self.respond(200, "", "text/plain")
+
+    def do_POST(self):
+        server = self.server
+        server.connections.add(self.client_address)
+        server.calls += 1
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        delay = server.delay()
+        if delay:
+            time.sleep(delay)
+        if server.http_error_rate and random.random() < server.http_error_rate:
+            return self.respond(503, "Service Unavailable", "text/plain")
+        try:
+            envelope = ElementTree.fromstring(body)
+            operation = envelope.find(
+                "{http://schemas.xmlsoap.org/soap/envelope/}Body"
+            )[0]
+            method_name = operation.tag.rpartition("}")[2]
+            data = {field.tag: field.text or "" for field in operation}
+        except (ElementTree.ParseError, IndexError, TypeError):
+            return self.respond(500, FAULT % "Bad Request")
+        if method_name not in SIGNATURES:
+            return self.respond(500, FAULT % escape("Unknown operation " + method_name))
+        if server.failure_rate and random.random() < server.failure_rate:
+            return self.respond(200, render(method_name, {}, server.failure_code))
+        try:
+            res = server.bankstore.call(method_name, data)
+        except GatewayError as e:
+            return self.respond(200, render(method_name, {}, e.code))
+        self.respond(200, render(method_name, res))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake PAYTPV bankstore server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--merchantcode", default="MERCHANT")
+    parser.add_argument("--password", default="PASSWORD")
+    parser.add_argument("--terminal", action="append", default=None)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--http-error-rate", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    bankstore = FakeBankstore(args.merchantcode, args.password, args.terminal or ["1"])
+    server = FakeBankstoreServer(
+        bankstore,
+        (args.host, args.port),
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        http_error_rate=args.http_error_rate,
+    )
+    print("Serving fake bankstore on %s" % server.url)
+    print(server.settings())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,52 @@ import pytest
 
 from paytpv.client import PaytpvClient
 from paytpv.client import PaytpvAsyncClient
+from paytpv.testing import FakeBankstore
+from paytpv.testing import FakeBankstoreServer
+
+
+@pytest.fixture(scope="session", autouse=True)
+def wsdl_cache_dir(tmp_path_factory):
+    """
+    Downloaded WSDLs go to a temporary directory, not the user cache
+    """
+    path = str(tmp_path_factory.mktemp("wsdl"))
+    previous = os.environ.get("PAYTPV_CACHE_DIR")
+    os.environ["PAYTPV_CACHE_DIR"] = path
+    yield path
+    if previous is None:
+        del os.environ["PAYTPV_CACHE_DIR"]
+    else:
+        os.environ["PAYTPV_CACHE_DIR"] = previous
+
+
+@pytest.fixture(scope="session")
+def bankstore_server():
+    bankstore = FakeBankstore("MERCHANT", "PASSWORD", ["1", "2"])
+    server = FakeBankstoreServer(bankstore).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def server(bankstore_server):
+    bankstore_server.connections.clear()
+    return bankstore_server
+
+
+@pytest.fixture
+def settings_local(server):
+    return server.settings()
 
 
 @pytest.fixture
-def settings():
+def settings(bankstore_server):
+    """
+    Settings for the real PAYTPV gateway if credentials are in the
+    environment, else for the local fake bankstore.
+    """
+    if "MERCHANTCODE" not in os.environ:
+        return bankstore_server.settings()
     settings = {
         'MERCHANTCODE': os.environ["MERCHANTCODE"],
         'MERCHANTPASSWORD': os.environ["MERCHANTPASSWORD"],
@@ -27,7 +69,7 @@ def paytpv(settings):
 
 
 @pytest.fixture
-def paytpv_async(settings, event_loop):
+def paytpv_async(settings):
     return PaytpvAsyncClient(settings, "1.2.3.4")
 
 
@@ -0,0 +1,70 @@
+# encoding: utf-8
+import asyncio
+import threading
+import time
+
+from paytpv.batch import arun_many
+from paytpv.batch import run_many
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+
+
+def charges(n):
+    for i in range(n):
+        yield {"idpayuser": "1", "tokenpayuser": "token", "amount": 1, "order": str(i)}
+
+
+def test_run_many():
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def charge(idpayuser, tokenpayuser, amount, order):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        if order == "3":
+            raise PaytpvException(1001)
+        return order
+
+    results = dict(run_many(charge, charges(20), concurrency=4))
+    assert len(results) == 20
+    assert running[1] <= 4
+    assert isinstance(results.pop("3"), PaytpvException)
+    assert all(order == res for order, res in results.items())
+
+
+def test_arun_many():
+    running = [0, 0]
+
+    async def charge(idpayuser, tokenpayuser, amount, order):
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        if order == "3":
+            raise PaytpvException(1001)
+        return order
+
+    async def async_charges():
+        for charge in charges(20):
+            yield charge
+
+    async def run(requests):
+        return [item async for item in arun_many(charge, requests, concurrency=4)]
+
+    for requests in (charges(20), async_charges()):
+        results = dict(asyncio.run(run(requests)))
+        assert len(results) == 20
+        assert isinstance(results.pop("3"), PaytpvException)
+    assert running[1] <= 4
+
+
+def test_execute_purchase_many(settings_local):
+    client = PaytpvClient(settings_local)
+    client.proxy = lambda method_name, **kwargs: (method_name, kwargs["order"])
+
+    results = dict(client.execute_purchase_many(charges(5), concurrency=2))
+    assert results["4"] == ("execute_purchase", "4")
@@ -0,0 +1,103 @@
+# encoding: utf-8
+import asyncio
+from types import SimpleNamespace
+
+from paytpv.cache import MemoryCache
+from paytpv.cache import UserCache
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+
+
+def test_memory_cache():
+    cache = MemoryCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" was the least recently used
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    cache.delete("a")
+    assert cache.get("a") is None
+
+    cache.ttl = -1
+    cache.set("d", 4)
+    assert cache.get("d") is None
+
+
+def fake_send(calls):
+    def send(method_name, data, timer=None):
+        calls.append(method_name)
+        return SimpleNamespace(
+            DS_ERROR_ID=0, DS_IDUSER=data.get("DS_IDUSER", "1"), DS_TOKEN_USER="token"
+        )
+
+    return send
+
+
+def test_user_cache(settings_local):
+    calls = []
+    client = PaytpvClient(settings_local, "1.2.3.4", user_cache=UserCache())
+    client.send = fake_send(calls)
+
+    res = client.info_user("1", "token")
+    assert client.info_user(idpayuser="1", tokenpayuser="token") is res
+    assert calls == ["info_user"]
+
+    client.info_user("2", "token")
+    assert calls == ["info_user", "info_user"]
+
+    client.remove_user("1", "token")
+    client.info_user("1", "token")
+    assert calls.count("info_user") == 3
+
+    client.add_user("4539232076648253", "0530", "123", "name")
+    client.info_user("1", "token")
+    assert calls.count("info_user") == 4
+
+
+def test_user_cache_version():
+    cache = UserCache()
+    data = {
+        "DS_MERCHANT_MERCHANTCODE": "code",
+        "DS_MERCHANT_TERMINAL": "1",
+        "DS_IDUSER": "1",
+        "DS_TOKEN_USER": "token",
+    }
+    # info_user sent, then the user is removed before it is answered
+    version = cache.version()
+    cache.update("remove_user", data, None)
+    cache.update("info_user", data, "res", version)
+    assert cache.get("info_user", data) is None
+
+    cache.update("info_user", data, "res", cache.version())
+    assert cache.get("info_user", data) == "res"
+
+    # forgotten drops are assumed to be newer than the call
+    cache = UserCache(max_invalidations=1)
+    version = cache.version()
+    cache.update("remove_user", data, None)
+    cache.update("remove_user", dict(data, DS_IDUSER="2"), None)
+    cache.update("info_user", data, "res", version)
+    assert cache.get("info_user", data) is None
+
+
+def test_user_cache_async(settings_local):
+    calls = []
+    client = PaytpvAsyncClient(settings_local, "1.2.3.4", user_cache=UserCache())
+    send = fake_send(calls)
+
+    async def async_send(method_name, data, timer=None):
+        return send(method_name, data)
+
+    client.send = async_send
+
+    async def run():
+        res = await client.info_user("1", "token")
+        assert await client.info_user("1", "token") is res
+        await client.remove_user("1", "token")
+        await client.info_user("1", "token")
+
+    asyncio.run(run())
+    assert calls == ["info_user", "remove_user", "info_user"]
@@ -0,0 +1,100 @@
+# encoding: utf-8
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from paytpv.cassette import AsyncCassetteTransport
+from paytpv.cassette import Cassette
+from paytpv.cassette import CassetteTransport
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvReplayMiss
+
+
+PAN = "4539232076648253"
+
+
+def calls(client, order):
+    user = client.add_user(PAN, "0599", "123", "name")
+    info = client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    charge = client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, order)
+    with pytest.raises(PaytpvException):
+        client.info_user(user.DS_IDUSER, "wrong")
+    return user.DS_IDUSER, info.DS_MERCHANT_PAN, charge.DS_MERCHANT_AUTHCODE
+
+
+@pytest.fixture
+def offline(settings_local):
+    # Nothing listens there
+    return dict(settings_local, PAYTPVURL="http://127.0.0.1:9/")
+
+
+def test_record_replay(tmp_path, server, settings_local, offline):
+    path = str(tmp_path / "bankstore.jsonl")
+    with Cassette(path) as cassette:
+        client = PaytpvClient(
+            settings_local, "1.2.3.4", transport=CassetteTransport(cassette, "record")
+        )
+        order = uuid.uuid4().hex[:20]
+        recorded = calls(client, order)
+        client.close()
+    assert len(cassette) == 4
+
+    with open(path) as f:
+        content = f.read()
+    assert PAN not in content
+    assert "MERCHANTSIGNATURE" not in content
+    assert "DS_MERCHANT_CVV2" not in content
+    assert json.loads(content.splitlines()[0])["request"]["DS_MERCHANT_PAN"] == "453923******8253"
+
+    server_calls = server.calls
+    client = PaytpvClient(offline, "1.2.3.4", transport=CassetteTransport(Cassette(path)))
+    assert calls(client, order) == recorded
+    assert server.calls == server_calls
+
+    with pytest.raises(PaytpvReplayMiss):
+        client.info_user("1", "unknown")
+    client.close()
+
+
+def test_match(tmp_path, settings_local, offline):
+    path = str(tmp_path / "bankstore.jsonl")
+    with Cassette(path) as cassette:
+        client = PaytpvClient(
+            settings_local, "1.2.3.4", transport=CassetteTransport(cassette, "record")
+        )
+        user = client.add_user(PAN, "0599", "123", "name")
+        orders = [uuid.uuid4().hex[:20] for _ in range(2)]
+        for order in orders:
+            client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, order)
+
+    cassette = Cassette(path, match={"execute_purchase": ()})
+    client = PaytpvClient(offline, "1.2.3.4", transport=CassetteTransport(cassette))
+    replayed = [
+        client.execute_purchase("1", "token", 20, "ORDER-%d" % i).DS_MERCHANT_ORDER
+        for i in range(4)
+    ]
+    assert replayed == orders * 2
+
+
+def test_async(tmp_path, server, settings_local, offline):
+    path = str(tmp_path / "bankstore.jsonl")
+
+    async def run(settings, transport):
+        async with PaytpvAsyncClient(settings, "1.2.3.4", transport=transport) as client:
+            user = await client.add_user(PAN, "0599", "123", "name")
+            infos = await asyncio.gather(
+                *[client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(3)]
+            )
+            return user.DS_IDUSER, [info.DS_MERCHANT_PAN for info in infos]
+
+    with Cassette(path) as cassette:
+        recorded = asyncio.run(run(settings_local, AsyncCassetteTransport(cassette, "record")))
+
+    server_calls = server.calls
+    replayed = asyncio.run(run(offline, AsyncCassetteTransport(Cassette(path))))
+    assert replayed == recorded
+    assert server.calls == server_calls
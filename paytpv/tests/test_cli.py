@@ -0,0 +1,185 @@
+# encoding: utf-8
+import csv
+import decimal
+import json
+import os
+import subprocess
+import sys
+
+import requests
+
+from paytpv.cli import main
+from paytpv.client import PaytpvClient
+
+
+def charges(client, n, prefix):
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    rows = []
+    for i in range(n):
+        order = "%s-%d" % (prefix, i)
+        res = client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, order)
+        rows.append(
+            {
+                "idpayuser": user.DS_IDUSER,
+                "tokenpayuser": user.DS_TOKEN_USER,
+                "amount": "10.00",
+                "order": order,
+                "authcode": res.DS_MERCHANT_AUTHCODE,
+            }
+        )
+    return rows
+
+
+def test_refund_csv(tmp_path, settings_local, capsys):
+    client = PaytpvClient(settings_local, "1.2.3.4")
+    rows = charges(client, 5, "cli-csv")
+    rows[3]["amount"] = "20"  # more than charged
+    rows.append(dict(rows[0], order=""))
+    path = str(tmp_path / "refunds.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(str(tmp_path / "settings.json"), "w") as f:
+        json.dump(settings_local, f)
+
+    argv = [
+        "refund",
+        path,
+        "--checkpoint", str(tmp_path / "checkpoint"),
+        "--output", str(tmp_path / "results.jsonl"),
+        "--settings", str(tmp_path / "settings.json"),
+        "--concurrency", "3",
+    ]
+    assert main(argv) == 1
+    assert "ok: 4, error: 1, failed: 1, in doubt: 0, skipped: 0" in capsys.readouterr().err
+    with open(str(tmp_path / "results.jsonl")) as f:
+        results = {r["order"]: r for r in map(json.loads, f)}
+    assert results["cli-csv-3"]["error_id"] == 1049
+    assert results["cli-csv-0"]["status"] == "ok"
+    assert results[""]["status"] == "failed"
+    with open(str(tmp_path / "checkpoint")) as f:
+        assert len(f.readlines()) == 5
+
+    # A rerun skips the refunds answered by the gateway
+    assert main(argv) == 1
+    assert "ok: 0, error: 0, failed: 1, in doubt: 0, skipped: 5" in capsys.readouterr().err
+
+
+def test_refund_jsonl(tmp_path, settings_local):
+    client = PaytpvClient(settings_local, "1.2.3.4")
+    path = str(tmp_path / "refunds.jsonl")
+    with open(path, "w") as f:
+        for row in charges(client, 3, "cli-jsonl"):
+            row["amount"] = 10
+            f.write(json.dumps(row) + "\n")
+    env = dict(
+        os.environ,
+        MERCHANTCODE=settings_local["MERCHANTCODE"],
+        MERCHANTPASSWORD=settings_local["MERCHANTPASSWORD"],
+        MERCHANTTERMINAL=settings_local["MERCHANTTERMINAL"],
+        PAYTPVURL=settings_local["PAYTPVURL"],
+    )
+    result = subprocess.run(
+        [sys.executable, "-m", "paytpv", "refund", path], env=env, capture_output=True, text=True
+    )
+    assert result.returncode == 0, result.stderr
+    assert [json.loads(line)["status"] for line in result.stdout.splitlines()] == ["ok"] * 3
+
+
+def test_refund_partial_and_in_doubt(tmp_path, settings_local, capsys, monkeypatch):
+    client = PaytpvClient(settings_local, "1.2.3.4")
+    row = charges(client, 1, "cli-partial")[0]
+    # Three refunds of 2.50 of the same charge of 10, the third in doubt
+    rows = [dict(row, amount="2.50")] * 3
+    path = str(tmp_path / "refunds.jsonl")
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    with open(str(tmp_path / "settings.json"), "w") as f:
+        json.dump(settings_local, f)
+    argv = [
+        "refund",
+        path,
+        "--checkpoint", str(tmp_path / "checkpoint"),
+        "--output", str(tmp_path / "results.jsonl"),
+        "--settings", str(tmp_path / "settings.json"),
+        "--concurrency", "1",
+    ]
+
+    send = PaytpvClient.send
+    calls = []
+
+    def timeout_third(self, method_name, data, timer=None):
+        calls.append(method_name)
+        if len(calls) == 3:
+            raise requests.ReadTimeout()
+        return send(self, method_name, data, timer)
+
+    monkeypatch.setattr(PaytpvClient, "send", timeout_third)
+    assert main(argv) == 1
+    assert "ok: 2, error: 0, failed: 1, in doubt: 0" in capsys.readouterr().err
+
+    # The refund in doubt is not sent again until asked to
+    assert main(argv) == 1
+    assert "failed: 0, in doubt: 1, skipped: 2" in capsys.readouterr().err
+    assert len(calls) == 3
+    assert main(argv + ["--retry-in-doubt"]) == 0
+    assert "ok: 1, error: 0, failed: 0, in doubt: 0, skipped: 2" in capsys.readouterr().err
+    assert main(argv) == 0
+    assert "skipped: 3" in capsys.readouterr().err
+
+
+def test_checkpoint_orders(tmp_path):
+    from paytpv.cli import Checkpoint
+
+    path = str(tmp_path / "checkpoint")
+    with open(path, "w") as f:
+        f.write("old-order\n")
+    checkpoint = Checkpoint(path)
+    assert checkpoint.get("old-order\tA1\t10.00\t1") == "done"
+    assert checkpoint.get("other\tA1\t10.00\t1") is None
+    checkpoint.close()
+
+
+def test_refund_args():
+    from paytpv.builder import RequestBuilder
+    from paytpv.cli import refund_args
+    from paytpv.cli import refund_key
+
+    record = {
+        "idpayuser": 1,
+        "tokenpayuser": "token",
+        "amount": "2.675",
+        "order": "order",
+        "authcode": "A1",
+    }
+    args = refund_args(record)
+    assert args["amount"] == decimal.Decimal("2.675")
+    assert refund_key(args, {}) == "order\tA1\t2.68\t1"
+    settings = dict.fromkeys(["MERCHANTCODE", "MERCHANTPASSWORD", "PAYTPVURL", "PAYTPVWSDL"], "x")
+    data = RequestBuilder(dict(settings, MERCHANTTERMINAL="1"), "1.2.3.4").execute_refund(**args)
+    # As a float, 2.675 * 100 is 267.49999999999997
+    assert data["DS_MERCHANT_AMOUNT"] == "268"
+
+
+def test_refund_not_sent(tmp_path, settings_local, capsys):
+    client = PaytpvClient(settings_local, "1.2.3.4")
+    row = charges(client, 1, "cli-invalid")[0]
+    path = str(tmp_path / "refunds.jsonl")
+    with open(path, "w") as f:
+        # Orders longer than 20 characters are rejected by the builder
+        f.write(json.dumps(dict(row, order="x" * 25)) + "\n")
+    with open(str(tmp_path / "settings.json"), "w") as f:
+        json.dump(settings_local, f)
+    output = str(tmp_path / "results.jsonl")
+    argv = ["refund", path, "--checkpoint", str(tmp_path / "checkpoint")]
+    argv += ["--output", output, "--settings", str(tmp_path / "settings.json")]
+
+    for _ in range(2):
+        assert main(argv) == 1
+        # Never sent: failed, not in doubt, and tried again on the next run
+        assert "failed: 1, in doubt: 0, skipped: 0" in capsys.readouterr().err
+        with open(output) as f:
+            line = json.loads(f.read().splitlines()[-1])
+        assert line["status"] == "failed" and "in_doubt" not in line
@@ -0,0 +1,156 @@
+# encoding: utf-8
+import asyncio
+import threading
+import time
+
+import pytest
+
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.coalesce import SingleFlight
+from paytpv.exc import PaytpvException
+
+
+@pytest.fixture
+def slow_server(server):
+    server.latency = 0.2
+    yield server
+    server.latency = 0
+
+
+def test_do():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def func(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        return value
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", func, 1)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do("key", func, 2)))
+        for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    # Fails instead of hanging if the followers are not coalesced
+    deadline = time.monotonic() + 5
+    try:
+        while flight.coalesced < 3:
+            assert time.monotonic() < deadline, "followers were not coalesced"
+            time.sleep(0.001)
+    finally:
+        release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert calls == [1]
+    assert results == [1, 1, 1, 1]
+    # Done calls are not shared
+    assert flight.do("key", func, 3) == 3
+
+
+def test_key():
+    flight = SingleFlight()
+    data = {
+        "DS_MERCHANT_MERCHANTCODE": "code",
+        "DS_MERCHANT_TERMINAL": "1",
+        "DS_IDUSER": "1",
+        "DS_TOKEN_USER": "t",
+    }
+    assert flight.key("info_user", data) == ("info_user", "code", "1", "1", "t")
+    assert flight.key("info_user", data) != flight.key(
+        "info_user", dict(data, DS_MERCHANT_TERMINAL="2")
+    )
+    assert flight.key("remove_user", data) is None
+    assert SingleFlight(keys={}).key("info_user", {}) is None
+
+    # Same order, another user or amount: not the same charge
+    charge = dict(data, DS_MERCHANT_ORDER="o", DS_MERCHANT_AMOUNT="100")
+    key = flight.key("execute_purchase", charge)
+    assert key != flight.key("execute_purchase", dict(charge, DS_IDUSER="2"))
+    assert key != flight.key("execute_purchase", dict(charge, DS_MERCHANT_AMOUNT="200"))
+
+
+def test_cancelled_leader():
+    flight = SingleFlight()
+    calls = []
+
+    async def func():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "res"
+
+    async def run():
+        leader = asyncio.ensure_future(flight.ado("key", func))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado("key", func))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert await follower == "res"
+        assert leader.cancelled()
+        assert calls == [1]
+        assert not flight._tasks
+
+    asyncio.run(run())
+
+
+def test_client(settings_local, slow_server):
+    flight = SingleFlight()
+    client = PaytpvClient(settings_local, "1.2.3.4", coalesce=flight)
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    calls = slow_server.calls
+    futures = [
+        client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(5)
+    ]
+    assert all(f.result().DS_CARD_BRAND == "VISA" for f in futures)
+    assert slow_server.calls - calls < 5
+    assert flight.coalesced == 5 - (slow_server.calls - calls)
+
+    # Errors are shared too
+    futures = [client.submit("info_user", user.DS_IDUSER, "wrong") for _ in range(5)]
+    for future in futures:
+        with pytest.raises(PaytpvException):
+            future.result()
+
+
+def test_not_coalesced(settings_local, slow_server):
+    flight = SingleFlight(keys={"execute_purchase": ("DS_MERCHANT_ORDER",)})
+    client = PaytpvClient(settings_local, "1.2.3.4", coalesce=flight)
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    calls = slow_server.calls
+    futures = [
+        client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(3)
+    ]
+    assert all(f.result() for f in futures)
+    assert slow_server.calls - calls == 3
+    assert flight.coalesced == 0
+
+
+def test_async_client(settings_local, slow_server):
+    async def run():
+        flight = SingleFlight()
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4", coalesce=flight) as client:
+            user = await client.add_user("4539232076648253", "0599", "123", "name")
+            calls = slow_server.calls
+            results = await asyncio.gather(
+                *[client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(5)]
+            )
+            assert all(res.DS_CARD_BRAND == "VISA" for res in results)
+            assert slow_server.calls - calls == 1
+            assert flight.coalesced == 4
+
+            results = await asyncio.gather(
+                *[client.info_user(user.DS_IDUSER, "wrong") for _ in range(3)],
+                return_exceptions=True,
+            )
+            assert all(isinstance(res, PaytpvException) for res in results)
+            assert slow_server.calls - calls == 2
+
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+# encoding: utf-8
+import pytest
+import requests
+from lxml import etree
+from zeep.exceptions import ValidationError
+
+from paytpv.client import PaytpvClient
+from paytpv.engine import FastEngine
+from paytpv.engine import compile_operations
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvFault
+from paytpv.wsdl import BINDING
+from paytpv.wsdl import WsdlCache
+from paytpv.wsdl import load_document
+
+
+OPERATIONS = compile_operations(
+    load_document("http://localhost/?wsdl", WsdlCache(ttl=None)).bindings[BINDING]
+)
+
+
+FAULT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">
+<SOAP-ENV:Body><SOAP-ENV:Fault>
+<faultcode>SOAP-ENV:Client</faultcode><faultstring>Bad request</faultstring>
+</SOAP-ENV:Fault></SOAP-ENV:Body></SOAP-ENV:Envelope>"""
+
+
+def test_serialize():
+    operation = OPERATIONS["info_user"]
+    data = {
+        "DS_IDUSER": "1",
+        "DS_TOKEN_USER": "<&>",
+        "DS_MERCHANT_MERCHANTCODE": "code",
+        "DS_MERCHANT_TERMINAL": "1",
+        "DS_ORIGINAL_IP": "1.2.3.4",
+        "DS_MERCHANT_MERCHANTSIGNATURE": "sign",
+    }
+    envelope = operation.serialize(data)
+    assert b"<DS_TOKEN_USER>&lt;&amp;&gt;</DS_TOKEN_USER>" in envelope
+    assert b'<ns0:info_user xmlns:ns0="' in envelope
+
+    # Required parts are not sent empty, as zeep
+    data["DS_ORIGINAL_IP"] = None
+    with pytest.raises(ValidationError):
+        operation.serialize(data)
+
+
+def test_parse():
+    res = OPERATIONS["execute_purchase"].parse(
+        b"<r><DS_MERCHANT_AMOUNT>3300</DS_MERCHANT_AMOUNT><DS_MERCHANT_ORDER/></r>"
+    )
+    assert res.DS_MERCHANT_AMOUNT == 3300
+    assert res.DS_MERCHANT_ORDER is None
+    assert res.DS_MERCHANT_AUTHCODE is None
+
+
+def test_parse_fault():
+    with pytest.raises(PaytpvFault) as e:
+        OPERATIONS["add_user"].parse(FAULT)
+    assert e.value.message == "Bad request"
+
+
+@pytest.mark.parametrize("status", [500, 502])
+def test_http_error(status):
+    class Session:
+        def post(self, url, **kwargs):
+            response = requests.Response()
+            response.status_code = status
+            response._content = b"<html>Internal Server Error</html"
+            return response
+
+    engine = FastEngine({"PAYTPVURL": "http://localhost/"}, OPERATIONS, session=Session())
+    with pytest.raises(requests.HTTPError):
+        engine.call("info_user", {field: "1" for field, _, _ in OPERATIONS["info_user"].fields})
+
+
+@pytest.mark.parametrize("engine", ["zeep", "fast"])
+def test_engines(settings_local, engine):
+    client = PaytpvClient(settings_local, "1.2.3.4", engine=engine)
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    res = client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    assert res.DS_CARD_BRAND == "VISA"
+    assert res["DS_ERROR_ID"] == 0
+
+    res = client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 33, engine)
+    assert res.DS_MERCHANT_AMOUNT == 3300
+
+    with pytest.raises(PaytpvException) as e:
+        client.remove_user("0", "token")
+    assert e.value.code == 1001
+
+
+def test_zeep_envelope(settings_local):
+    # Same parts, order and values as zeep, from the WSDL zeep loaded
+    client = PaytpvClient(settings_local, "1.2.3.4", engine="fast")
+    data = client.builder.execute_purchase("1", "token", 33, "order")
+    zeep_envelope = etree.tostring(
+        client.client.create_message(client.client.service, "execute_purchase", **data)
+    )
+    fast_envelope = client.engine.operations["execute_purchase"].serialize(data)
+
+    def parts(envelope):
+        body = etree.fromstring(envelope)[0][0]
+        return [(part.tag, part.text) for part in body]
+
+    assert parts(fast_envelope) == parts(zeep_envelope)
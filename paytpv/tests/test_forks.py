@@ -0,0 +1,119 @@
+# encoding: utf-8
+import fcntl
+import multiprocessing
+import os
+import threading
+
+from paytpv import wsdl
+from paytpv.client import PaytpvClient
+from paytpv.coalesce import SingleFlight
+from paytpv.journal import Journal
+from paytpv.limits import Limiter
+
+
+def _in_child(target, *args):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=lambda: queue.put(target(*args)))
+    process.start()
+    result = queue.get(timeout=10)
+    process.join()
+    return result
+
+
+def test_client(server, settings_local):
+    client = PaytpvClient(settings_local, "1.2.3.4")
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    assert client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER).result()
+    adapter = client.client.transport.session.get_adapter(settings_local["PAYTPVURL"])
+    poolmanager = adapter.poolmanager
+    document = client.client.wsdl
+
+    def child():
+        adapter = client.client.transport.session.get_adapter(settings_local["PAYTPVURL"])
+        infos = [
+            client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER).result()
+            for _ in range(3)
+        ]
+        return (
+            adapter.poolmanager is not poolmanager,
+            client.client.wsdl is document,
+            wsdl.load_document(settings_local["PAYTPVWSDL"]) is document,
+            [info.DS_CARD_BRAND for info in infos],
+            client.warmth.stats()["cold"],
+        )
+
+    new_pool, same_document, cached_document, brands, cold = _in_child(child)
+    assert new_pool
+    assert same_document and cached_document
+    assert brands == ["VISA"] * 3
+    assert cold == 1
+    # The connections of the parent still work
+    assert adapter.poolmanager is poolmanager
+    assert client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER).DS_CARD_BRAND == "VISA"
+    client.close()
+
+
+def test_locks_and_calls_in_flight(tmp_path):
+    flight = SingleFlight()
+    limiter = Limiter(limit=2, timeout=0)
+    journal = Journal(str(tmp_path / "journal"))
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait()
+        return "parent"
+
+    # A call in flight and a slot taken by a parent thread
+    thread = threading.Thread(target=flight.do, args=("key", slow))
+    thread.start()
+    started.wait()
+    limiter.acquire()
+    flight._lock.acquire()
+    journal._commit_lock.acquire()
+
+    def child():
+        with flight._lock:
+            pass
+        journal.write({"event": "child", "pid": os.getpid()})
+        return (
+            flight.do("key", lambda: "child"),
+            limiter.stats()["in_flight"],
+        )
+
+    try:
+        assert _in_child(child) == ("child", 0)
+    finally:
+        flight._lock.release()
+        journal._commit_lock.release()
+        release.set()
+        thread.join()
+    journal.close()
+    with open(str(tmp_path / "journal")) as f:
+        assert '"event":"child"' in f.read()
+
+
+def test_shared_limiter(tmp_path):
+    limiter = Limiter(limit=3, timeout=0, shared=str(tmp_path / "limits"))
+    limiter.acquire()
+
+    def child():
+        # The file is opened again, the lock of the parent excludes the child
+        try:
+            fcntl.flock(limiter.state._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            locked = True
+        else:
+            locked = False
+        fcntl.flock(limiter.state._fd, fcntl.LOCK_UN)
+        return locked
+
+    fcntl.flock(limiter.state._fd, fcntl.LOCK_EX)
+    try:
+        assert _in_child(child)
+    finally:
+        fcntl.flock(limiter.state._fd, fcntl.LOCK_UN)
+
+    assert _in_child(lambda: (limiter.acquire(), limiter.stats()["in_flight"])[1]) == 2
+    assert limiter.stats()["in_flight"] == 2
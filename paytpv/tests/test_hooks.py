@@ -0,0 +1,173 @@
+# encoding: utf-8
+import asyncio
+import sys
+import types
+
+import pytest
+
+from paytpv.cache import UserCache
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.hooks import CallEvent
+from paytpv.hooks import Hook
+
+
+class Recorder(Hook):
+    def __init__(self):
+        self.events = []
+
+    def on_call(self, event):
+        self.events.append(event)
+
+
+@pytest.mark.parametrize("engine", ["zeep", "fast"])
+def test_hooks(settings_local, engine):
+    recorder = Recorder()
+    client = PaytpvClient(
+        settings_local, "1.2.3.4", engine=engine, hooks=[recorder], user_cache=UserCache()
+    )
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    with pytest.raises(PaytpvException):
+        client.info_user("0", "token")
+
+    add, info, cached, error = recorder.events
+    assert add.operation == "add_user"
+    assert add.outcome == "ok"
+    assert set(info.phases) == {"build", "serialize", "send", "parse", "check"}
+    assert [span[0] for span in info.spans] == ["build", "serialize", "send", "parse", "check"]
+    assert info.duration >= sum(info.phases.values())
+    assert cached.outcome == "cached"
+    assert set(cached.phases) == {"build"}
+    assert error.outcome == "error"
+    assert error.error_id == 1001
+
+
+def test_hooks_async(settings_local):
+    recorder = Recorder()
+
+    async def run():
+        async with PaytpvAsyncClient(
+            settings_local, "1.2.3.4", hooks=[recorder]
+        ) as client:
+            with pytest.raises(PaytpvException):
+                await client.info_user("0", "token")
+
+    asyncio.run(run())
+    event, = recorder.events
+    assert event.outcome == "error"
+    assert "send" in event.phases
+
+
+def test_hook_errors_are_ignored(settings_local):
+    class Broken(Hook):
+        def on_call(self, event):
+            raise ValueError()
+
+    client = PaytpvClient(settings_local, "1.2.3.4", hooks=[Broken()])
+    with pytest.raises(PaytpvException):
+        client.info_user("0", "token")
+
+
+def test_prometheus_hook(settings_local):
+    prometheus_client = pytest.importorskip("prometheus_client")
+    from paytpv.hooks import PrometheusHook
+
+    registry = prometheus_client.CollectorRegistry()
+    client = PaytpvClient(
+        settings_local, "1.2.3.4", hooks=[PrometheusHook(registry=registry)]
+    )
+    with pytest.raises(PaytpvException):
+        client.info_user("0", "token")
+
+    labels = {"operation": "info_user", "outcome": "error"}
+    assert registry.get_sample_value("paytpv_call_seconds_count", labels) == 1
+    labels = {"operation": "info_user", "error_id": "1001"}
+    assert registry.get_sample_value("paytpv_errors_total", labels) == 1
+
+
+def test_opentelemetry_hook(settings_local):
+    pytest.importorskip("opentelemetry.sdk")
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    from paytpv.hooks import OpenTelemetryHook
+
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    hook = OpenTelemetryHook(tracer=provider.get_tracer("test"))
+    client = PaytpvClient(settings_local, "1.2.3.4", hooks=[hook])
+    with pytest.raises(PaytpvException):
+        client.info_user("0", "token")
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert set(spans) == {"paytpv.info_user", "build", "serialize", "send", "parse", "check"}
+    assert spans["send"].parent.span_id == spans["paytpv.info_user"].context.span_id
+
+
+class StubSpan:
+    def __init__(self, name, context, start_time):
+        self.name = name
+        self.parent = context
+        self.start_time = start_time
+        self.end_time = None
+        self.status = None
+
+    def set_status(self, status):
+        self.status = status
+
+    def end(self, end_time):
+        self.end_time = end_time
+
+
+class StubTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, context=None, start_time=None, attributes=None):
+        span = StubSpan(name, context, start_time)
+        self.spans.append(span)
+        return span
+
+
+def test_opentelemetry_hook_stub(monkeypatch):
+    # Runs without opentelemetry installed
+    trace = types.SimpleNamespace(
+        Status=lambda code: code,
+        StatusCode=types.SimpleNamespace(ERROR="error"),
+        set_span_in_context=lambda span: span,
+        get_tracer=lambda name: StubTracer(),
+    )
+    monkeypatch.setitem(sys.modules, "opentelemetry", types.SimpleNamespace(trace=trace))
+    monkeypatch.setitem(sys.modules, "opentelemetry.trace", trace)
+    from paytpv.hooks import OpenTelemetryHook
+
+    hook = OpenTelemetryHook()
+    spans = [
+        ("build", 0.0, 0.001),
+        ("queue", 0.001, 0.002),
+        ("serialize", 0.003, 0.001),
+        ("send", 0.004, 0.01),
+        ("retry", 0.014, 0.1),
+        ("queue", 0.114, 0.001),
+        ("send", 0.115, 0.01),
+    ]
+    phases = {}
+    for phase, _, seconds in spans:
+        phases[phase] = phases.get(phase, 0) + seconds
+    hook.on_call(CallEvent("info_user", phases, 0.2, "exception", None, 10 ** 9, spans=spans))
+
+    call, *children = hook.tracer.spans
+    assert call.name == "paytpv.info_user"
+    assert call.status == "error"
+    assert call.end_time == 10 ** 9 + 2 * 10 ** 8
+    assert [child.name for child in children] == [phase for phase, _, _ in spans]
+    assert all(child.parent is call for child in children)
+    assert children[-1].start_time == 10 ** 9 + 115 * 10 ** 6
+    assert children[-1].end_time == 10 ** 9 + 125 * 10 ** 6
@@ -0,0 +1,58 @@
+# encoding: utf-8
+import re
+import subprocess
+import sys
+
+import pytest
+
+
+HEAVY = {"zeep", "lxml", "requests", "httpx", "urllib3", "asyncio"}
+
+# Milliseconds, about 5 times the import time on a laptop
+BUDGET = 50
+
+
+def run(code):
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["paytpv", "paytpv.builder", "paytpv.client", "paytpv.links", "paytpv.notifications"],
+)
+def test_no_heavy_imports(module):
+    result = run(
+        "import sys, %s; print(' '.join(sorted({m.split('.')[0] for m in sys.modules})))"
+        % module
+    )
+    assert not HEAVY & set(result.stdout.split())
+
+
+def import_time(module):
+    """
+    Cumulative import time of 'module', in milliseconds
+    """
+    stderr = run("import " + module).stderr
+    match = re.search(r"import time:\s+\d+ \|\s+(\d+) \| %s$" % re.escape(module), stderr, re.M)
+    return int(match.group(1)) / 1000
+
+
+def test_import_time():
+    # best of three runs
+    assert min(import_time("paytpv.builder") for _ in range(3)) < BUDGET
+
+
+def test_lazy_exports():
+    import paytpv
+
+    from paytpv.client import PaytpvClient
+
+    assert paytpv.PaytpvClient is PaytpvClient
+    assert paytpv.get_client.__module__ == "paytpv.registry"
+    with pytest.raises(AttributeError):
+        paytpv.missing
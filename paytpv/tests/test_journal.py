@@ -0,0 +1,175 @@
+# encoding: utf-8
+import asyncio
+import threading
+
+import pytest
+import requests
+from zeep.exceptions import ValidationError
+
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvLimitExceeded
+from paytpv.journal import Journal
+from paytpv.journal import in_doubt
+from paytpv.journal import read
+
+
+DATA = {
+    "DS_MERCHANT_ORDER": "order",
+    "DS_MERCHANT_AMOUNT": "1000",
+    "DS_MERCHANT_CURRENCY": "EUR",
+    "DS_IDUSER": "1",
+    "DS_MERCHANT_TERMINAL": "1",
+}
+
+
+def test_in_doubt(tmp_path):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        for order in ["ok", "error", "unknown", "crash", "resolved"]:
+            journal.intent("execute_purchase", dict(DATA, DS_MERCHANT_ORDER=order))
+        journal.outcome("execute_purchase", dict(DATA, DS_MERCHANT_ORDER="ok"), error=None)
+        journal.outcome(
+            "execute_purchase", dict(DATA, DS_MERCHANT_ORDER="error"), error=PaytpvException(1001)
+        )
+        journal.outcome(
+            "execute_purchase", dict(DATA, DS_MERCHANT_ORDER="unknown"), error=requests.ReadTimeout()
+        )
+        journal.resolve("execute_purchase", "resolved", "ok", authcode="ABC")
+    # A refund of the same order is another call
+    with Journal(path) as journal:
+        journal.intent("execute_refund", dict(DATA, DS_MERCHANT_ORDER="ok"))
+    with open(path, "ab") as f:
+        f.write(b'{"event":"outc')
+
+    pending = in_doubt(path)
+    assert [(r["operation"], r["order"]) for r in pending] == [
+        ("execute_purchase", "unknown"),
+        ("execute_purchase", "crash"),
+        ("execute_refund", "ok"),
+    ]
+    assert pending[0]["amount"] == "1000"
+    assert len(list(read(path))) == 10
+
+
+def test_in_doubt_same_order(tmp_path):
+    path = str(tmp_path / "journal")
+    with Journal(path) as journal:
+        # Two partial refunds of an order, one answered
+        first = journal.intent("execute_refund", DATA)
+        second = journal.intent("execute_refund", DATA)
+        journal.outcome("execute_refund", DATA, error=requests.ReadTimeout(), intent=second)
+        journal.outcome("execute_refund", DATA, intent=first)
+        assert [r["id"] for r in journal.in_doubt()] == [second]
+
+        journal.resolve("execute_refund", "order", "ok", intent=second)
+        assert journal.in_doubt() == []
+
+
+def test_group_commit(tmp_path):
+    journal = Journal(str(tmp_path / "journal"))
+    barrier = threading.Barrier(20)
+
+    def write(i):
+        barrier.wait()
+        for _ in range(10):
+            journal.intent("execute_purchase", dict(DATA, DS_MERCHANT_ORDER=str(i)))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+    assert len(list(read(journal.path))) == 200
+    assert journal.commits < 200
+
+
+def test_client(tmp_path, settings_local):
+    journal = Journal(str(tmp_path / "journal"))
+    client = PaytpvClient(settings_local, "1.2.3.4", journal=journal)
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    charge = client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "journal-1")
+    with pytest.raises(PaytpvException):
+        client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "journal-1")
+
+    def timeout(method_name, data, timer=None):
+        raise requests.ReadTimeout()
+
+    client.send = timeout
+    with pytest.raises(requests.ReadTimeout):
+        client.execute_refund(
+            user.DS_IDUSER, user.DS_TOKEN_USER, 10, "journal-1", charge.DS_MERCHANT_AUTHCODE
+        )
+
+    records = list(read(journal.path))
+    assert [(r["event"], r["operation"]) for r in records] == [
+        ("intent", "execute_purchase"),
+        ("outcome", "execute_purchase"),
+        ("intent", "execute_purchase"),
+        ("outcome", "execute_purchase"),
+        ("intent", "execute_refund"),
+        ("outcome", "execute_refund"),
+    ]
+    assert records[1]["authcode"] == charge.DS_MERCHANT_AUTHCODE
+    assert records[3]["error_id"] == 1024
+    assert [r["operation"] for r in journal.in_doubt()] == ["execute_refund"]
+
+
+def test_async_client(tmp_path, settings_local):
+    journal = Journal(str(tmp_path / "journal"))
+
+    async def run():
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4", journal=journal) as client:
+            user = await client.add_user("4539232076648253", "0599", "123", "name")
+            await asyncio.gather(
+                *[
+                    client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "ajournal-%d" % i)
+                    for i in range(10)
+                ]
+            )
+
+    asyncio.run(run())
+    assert len(list(read(journal.path))) == 20
+    assert journal.in_doubt() == []
+
+
+def test_not_sent_and_cancelled(tmp_path, settings_local):
+    from paytpv.limits import Limiter
+
+    journal = Journal(str(tmp_path / "journal"))
+    limiter = Limiter(limit=1, timeout=0)
+    limiter.acquire()
+    client = PaytpvClient(settings_local, "1.2.3.4", journal=journal, limiter=limiter)
+    with pytest.raises(PaytpvLimitExceeded):
+        client.execute_purchase("1", "token", 10, "journal-limit")
+
+    async def run():
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4", journal=journal) as client:
+
+            async def send(method_name, data, timer=None):
+                await asyncio.sleep(10)
+
+            client.send = send
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    client.execute_purchase("1", "token", 10, "journal-cancel"), 0.05
+                )
+
+    asyncio.run(run())
+
+    # Requests zeep can't serialize are not sent, ie without DS_ORIGINAL_IP
+    for engine in ["zeep", "fast"]:
+        client = PaytpvClient(settings_local, journal=journal, engine=engine)
+        with pytest.raises(ValidationError):
+            client.execute_purchase("1", "token", 10, "journal-invalid-" + engine)
+
+    outcomes = {r["order"]: r["status"] for r in read(journal.path) if r["event"] == "outcome"}
+    assert outcomes == {
+        "journal-limit": "not_sent",
+        "journal-cancel": "unknown",
+        "journal-invalid-zeep": "not_sent",
+        "journal-invalid-fast": "not_sent",
+    }
+    assert [r["order"] for r in journal.in_doubt()] == ["journal-cancel"]
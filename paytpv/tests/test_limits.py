@@ -0,0 +1,155 @@
+# encoding: utf-8
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvLimitExceeded
+from paytpv.hooks import Hook
+from paytpv.limits import Limiter
+from paytpv.limits import shared_path
+
+
+def test_rate():
+    limiter = Limiter(rate=100, burst=2, timeout=0)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(PaytpvLimitExceeded) as e:
+        limiter.acquire()
+    assert e.value.reason == "rate"
+
+    limiter.timeout = 1
+    start = time.monotonic()
+    limiter.acquire()
+    assert 0.005 < time.monotonic() - start < 0.5
+
+
+def test_concurrency():
+    limiter = Limiter(limit=2, timeout=0)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(PaytpvLimitExceeded) as e:
+        limiter.acquire()
+    assert e.value.reason == "concurrency"
+    limiter.release(0.01)
+    limiter.acquire()
+
+
+def test_aimd():
+    limiter = Limiter(limit=10, min_limit=2, max_limit=11, latency_target=0.1)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(0.05)
+    assert limiter.stats()["limit"] == 11
+
+    limiter.acquire()
+    limiter.release(0.05, PaytpvException(1099))
+    assert limiter.stats()["limit"] == pytest.approx(9.9)
+    # A card error is not an overload
+    limiter.acquire()
+    limiter.release(0.05, PaytpvException(1001))
+    assert limiter.stats()["limit"] > 9.9
+
+    for _ in range(3):
+        limiter.state.values[5] = 0  # no decrease in the last round trip
+        limiter.acquire()
+        limiter.release(0.5)
+    assert limiter.stats()["limit"] < 8
+
+
+def test_gradient():
+    limiter = Limiter(limit=10, tolerance=2)
+    limiter.acquire()
+    limiter.release(0.01)
+    limiter.acquire()
+    limiter.release(0.05)
+    assert limiter.stats()["limit"] < 10
+    assert limiter.stats()["min_latency"] == pytest.approx(0.01, rel=0.02)
+
+
+def _take(path, queue):
+    limiter = Limiter(limit=3, timeout=0, shared=path)
+    taken = 0
+    try:
+        while True:
+            limiter.acquire()
+            taken += 1
+    except PaytpvLimitExceeded:
+        queue.put(taken)
+
+
+def test_shared(tmp_path, settings_local):
+    path = str(tmp_path / "limits")
+    limiter = Limiter(limit=3, timeout=0, shared=path)
+    limiter.acquire()
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_take, args=(path, queue))
+    process.start()
+    process.join()
+    assert queue.get() == 2
+    assert limiter.stats()["in_flight"] == 3
+    limiter.state.reset()
+    assert limiter.stats()["in_flight"] == 0
+
+    assert shared_path(settings_local) == shared_path(dict(settings_local))
+    assert shared_path(settings_local) != shared_path(settings_local, tmp_path)
+
+
+class Phases(Hook):
+    def on_call(self, event):
+        self.event = event
+
+
+def test_client(settings_local):
+    hook = Phases()
+    limiter = Limiter(rate=1000, limit=5, timeout=None)
+    client = PaytpvClient(settings_local, "1.2.3.4", limiter=limiter, hooks=[hook])
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    assert "queue" in hook.event.phases
+    futures = [
+        client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(20)
+    ]
+    assert all(f.result().DS_CARD_BRAND == "VISA" for f in futures)
+    assert limiter.stats()["in_flight"] == 0
+
+    limiter = Limiter(limit=1, timeout=0)
+    limiter.acquire()
+    client = PaytpvClient(settings_local, "1.2.3.4", limiter=limiter)
+    with pytest.raises(PaytpvLimitExceeded):
+        client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+
+
+def test_async_client(settings_local):
+    async def run():
+        limiter = Limiter(limit=2, timeout=None)
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4", limiter=limiter) as client:
+            user = await client.add_user("4539232076648253", "0599", "123", "name")
+            results = await asyncio.gather(
+                *[client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER) for _ in range(10)]
+            )
+            assert len(results) == 10
+            assert limiter.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_call_releases(settings_local):
+    async def run():
+        limiter = Limiter(limit=1, timeout=None)
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4", limiter=limiter) as client:
+
+            async def send(method_name, data, timer=None):
+                await asyncio.sleep(10)
+
+            client.send = send
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.info_user("1", "token"), 0.05)
+            assert limiter.stats()["in_flight"] == 0
+            assert limiter.stats()["min_latency"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+# encoding: utf-8
+import csv
+import io
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from paytpv.client import RequestBuilder
+from paytpv.links import generate_links
+from paytpv.links import write_links
+
+
+SETTINGS = {
+    "MERCHANTCODE": "code",
+    "MERCHANTPASSWORD": "password",
+    "MERCHANTTERMINAL": "1",
+    "PAYTPVURL": "http://localhost",
+    "PAYTPVWSDL": "http://localhost?wsdl",
+}
+
+DEFAULTS = {
+    "language": "ES",
+    "urlok": "https://shop/ok?order=1&lang=es",
+    "urlko": "https://shop/ko",
+}
+
+
+def records(n):
+    for i in range(n):
+        yield {"idpayuser": str(i), "tokenpayuser": "token", "amount": 10, "order": "o%d" % i}
+
+
+def test_get_iframe_url():
+    builder = RequestBuilder(SETTINGS)
+    url = builder.get_iframe_url(
+        "1", "to ken", 12.5, "order", "ES", DEFAULTS["urlok"], DEFAULTS["urlko"]
+    )
+    params = parse_qs(urlsplit(url).query)
+    assert params["URLOK"] == [DEFAULTS["urlok"]]
+    assert params["TOKEN_USER"] == ["to ken"]
+    assert params["MERCHANT_AMOUNT"] == ["1250"]
+    data = {
+        "MERCHANT_MERCHANTCODE": "code",
+        "IDUSER": "1",
+        "TOKEN_USER": "to ken",
+        "MERCHANT_TERMINAL": "1",
+        "OPERATION": "109",
+        "MERCHANT_ORDER": "order",
+        "MERCHANT_AMOUNT": "1250",
+        "MERCHANT_CURRENCY": "EUR",
+    }
+    assert params["MERCHANT_MERCHANTSIGNATURE"] == [
+        builder.iframe_signature(data, list(data))
+    ]
+    html = builder.get_secure_iframe(
+        "1", "token", 12.5, "order", "ES", DEFAULTS["urlok"], DEFAULTS["urlko"]
+    )
+    assert "&amp;MERCHANT_TERMINAL=1" in html
+
+
+def test_generate_links():
+    builder = RequestBuilder(SETTINGS)
+    links = list(generate_links(SETTINGS, records(3), **DEFAULTS))
+    assert links == [
+        ("o%d" % i, builder.get_iframe_url(str(i), "token", 10, "o%d" % i, **DEFAULTS))
+        for i in range(3)
+    ]
+
+    bad = {"idpayuser": "1", "tokenpayuser": "token", "amount": 0, "order": "bad"}
+    [(order, error)] = generate_links(SETTINGS, [bad], html=True, **DEFAULTS)
+    assert order == "bad"
+    assert isinstance(error, ValueError)
+
+
+def test_write_links_processes():
+    out = io.StringIO()
+    rows = list(records(25)) + [{"idpayuser": "1", "tokenpayuser": "t", "amount": 1, "order": "o" * 21}]
+    assert write_links(SETTINGS, rows, out, processes=2, chunksize=10, **DEFAULTS) == (25, 1)
+    out.seek(0)
+    result = list(csv.DictReader(out))
+    assert [row["order"] for row in result] == ["o%d" % i for i in range(25)] + ["o" * 21]
+    assert result[0]["link"] == dict(generate_links(SETTINGS, records(1), **DEFAULTS))["o0"]
+    assert result[-1]["error"]
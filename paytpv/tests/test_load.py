@@ -0,0 +1,83 @@
+# encoding: utf-8
+import json
+
+import pytest
+
+from paytpv import load
+from paytpv.cli import main
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert load.percentile(values, 50) == 50
+    assert load.percentile(values, 99) == 99
+    assert load.percentile([7], 95) == 7
+    assert load.percentile([], 50) is None
+
+
+def test_parse_mix():
+    assert load.parse_mix("info_user=3,add_user") == {"info_user": 3, "add_user": 1}
+    with pytest.raises(ValueError):
+        load.parse_mix("remove_user=1")
+
+
+def test_workload():
+    workload = load.Workload({"execute_refund": 1}, seed=1)
+    # Nothing to refund nor charge without users
+    method_name, args = workload.next()
+    assert method_name == "add_user"
+    workload.users.append(("1", "token"))
+    method_name, args = workload.next()
+    assert method_name == "execute_purchase"
+
+    class Res:
+        DS_MERCHANT_AUTHCODE = "auth"
+
+    workload.done(method_name, args, Res)
+    assert workload.next() == ("execute_refund", ("1", "token", 1, args[3], "auth"))
+
+
+@pytest.mark.parametrize("client", ["sync", "async"])
+def test_run(settings_local, client):
+    results = load.run(
+        settings_local, client, concurrency=[1, 4], duration=0.3, warmup=0.1, users=2
+    )
+    assert [step["concurrency"] for step in results["steps"]] == [1, 4]
+    for step in results["steps"]:
+        assert step["calls"] > 0
+        assert step["error_rate"] == 0
+        assert step["latency_ms"]["p50"] <= step["latency_ms"]["p99"]
+        assert step["peak_rss_mb"] > 0
+        assert set(step["operations"]) <= set(load.MIX)
+
+
+def test_command(tmp_path, settings_local, capsys):
+    settings = str(tmp_path / "settings.json")
+    with open(settings, "w") as f:
+        json.dump(settings_local, f)
+    output = str(tmp_path / "load.json")
+    argv = ["load", "--settings", settings, "--duration", "0.3", "--warmup", "0"]
+    argv += ["--rps", "50", "--mix", "info_user=1", "--output", output]
+    # Other gateways get real calls, only if asked to
+    with pytest.raises(SystemExit):
+        main(argv)
+    argv.append("--i-know-this-charges")
+    assert main(argv) == 0
+    assert "calls/s" in capsys.readouterr().out
+    with open(output) as f:
+        results = json.load(f)
+    step = results["steps"][0]
+    assert step["rps_target"] == 50
+    # Calls are due every 20ms
+    assert 10 <= step["calls"] <= 16
+
+
+def test_command_production(tmp_path):
+    from paytpv.cli import GATEWAY
+
+    settings = str(tmp_path / "settings.json")
+    with open(settings, "w") as f:
+        json.dump({"PAYTPVURL": GATEWAY, "PAYTPVWSDL": GATEWAY + "?wsdl"}, f)
+    with pytest.raises(SystemExit) as e:
+        main(["load", "--settings", settings, "--i-know-this-charges"])
+    assert "production" in str(e.value)
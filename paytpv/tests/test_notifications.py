@@ -0,0 +1,87 @@
+# encoding: utf-8
+import asyncio
+from hashlib import md5
+from urllib.parse import urlencode
+
+import pytest
+
+from paytpv.exc import PaytpvInvalidNotification
+from paytpv.notifications import NotificationVerifier
+
+
+SETTINGS = {
+    "MERCHANTCODE": "code",
+    "MERCHANTPASSWORD": "password",
+    "MERCHANTTERMINAL": "1",
+    "PAYTPVURL": "http://localhost",
+    "PAYTPVWSDL": "http://localhost?wsdl",
+}
+
+
+def notification(order="order", response="OK", **fields):
+    data = {
+        "TransactionType": "1",
+        "TransactionName": "Autorización",
+        "Order": order,
+        "Response": response,
+        "ErrorID": "0",
+        "AuthCode": "123456",
+        "Currency": "EUR",
+        "Amount": "1250",
+        "AccountCode": "code",
+        "TpvID": "1",
+        "BankDateTime": "20261018120000",
+        "IdUser": "1",
+        "TokenUser": "token",
+    }
+    data.update(fields)
+    password = md5(b"password").hexdigest()
+    data.setdefault(
+        "Signature",
+        md5(
+            (
+                "code1" + data["TransactionType"] + data["Order"] + data["Amount"]
+                + data["Currency"] + password + data["BankDateTime"] + data["Response"]
+            ).encode()
+        ).hexdigest(),
+    )
+    return data
+
+
+def test_verify():
+    verifier = NotificationVerifier(SETTINGS)
+    result = verifier.verify(urlencode(notification()).encode())
+    assert result.valid and result.ok
+    assert result.amount == 1250
+    assert result.transaction_type == 1
+    assert (result.order, result.auth_code, result.iduser) == ("order", "123456", "1")
+
+    ko = verifier.verify(notification(response="KO", ErrorID="1099"))
+    assert ko.valid and not ko.ok
+    assert ko.error_id == 1099
+
+
+def test_invalid():
+    verifier = NotificationVerifier(SETTINGS)
+    with pytest.raises(PaytpvInvalidNotification) as e:
+        verifier.verify(urlencode(notification(Signature="0" * 32)))
+    assert e.value.reason == "invalid signature"
+
+    tampered = notification()
+    tampered["Amount"] = "1"
+    assert verifier.check(tampered).reason == "invalid signature"
+    assert not verifier.check(tampered).ok
+
+    other = notification(TpvID="2")
+    assert verifier.check(other).reason == "unknown merchant terminal"
+    assert verifier.check({}).valid is False
+
+
+def test_check_many():
+    verifier = NotificationVerifier(SETTINGS)
+    payloads = [urlencode(notification("o%d" % i)) for i in range(100)]
+    payloads.append(urlencode(notification(Signature="x")))
+    results = verifier.check_many(payloads)
+    assert [r.valid for r in results] == [True] * 100 + [False]
+    results = asyncio.run(verifier.acheck_many(iter(payloads)))
+    assert [r.order for r in results[:2]] == ["o0", "o1"]
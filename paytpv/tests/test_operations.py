@@ -0,0 +1,104 @@
+# encoding: utf-8
+from hashlib import sha1
+
+import pytest
+
+from paytpv.client import RequestBuilder
+from paytpv.operations import SPECS
+from paytpv.operations import Const
+from paytpv.operations import OperationSpec
+
+
+SETTINGS = {
+    "MERCHANTCODE": "code",
+    "MERCHANTPASSWORD": "password",
+    "MERCHANTTERMINAL": "1",
+    "PAYTPVURL": "http://localhost",
+    "PAYTPVWSDL": "http://localhost?wsdl",
+}
+
+
+def signature(*values):
+    return sha1(("".join(values) + "password").encode()).hexdigest()
+
+
+def test_add_user():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    data = builder.add_user("4539232076648253", "0530", "123", "name")
+    assert data == {
+        "DS_MERCHANT_PAN": "4539232076648253",
+        "DS_MERCHANT_EXPIRYDATE": "0530",
+        "DS_MERCHANT_CVV2": "123",
+        "DS_MERCHANT_CARDHOLDERNAME": "name",
+        "DS_MERCHANT_MERCHANTCODE": "code",
+        "DS_MERCHANT_TERMINAL": "1",
+        "DS_ORIGINAL_IP": "1.2.3.4",
+        "DS_MERCHANT_MERCHANTSIGNATURE": signature(
+            "code", "4539232076648253", "123", "1"
+        ),
+    }
+    assert "Añade una tarjeta" in builder.add_user.__doc__
+
+
+def test_signatures():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    calls = {
+        "add_user": ("4539232076648253", "0530", "123", "name"),
+        "info_user": ("1", "token"),
+        "remove_user": ("1", "token"),
+        "execute_purchase": ("1", "token", 12.345, "order", "desc", 0, "d", "m"),
+        "execute_refund": ("1", "token", 12.345, "order", "authcode", "m"),
+    }
+    for name, args in calls.items():
+        data = getattr(builder, name)(*args, ip="5.6.7.8")
+        assert data["DS_ORIGINAL_IP"] == "5.6.7.8"
+        assert data["DS_MERCHANT_MERCHANTSIGNATURE"] == builder.signature(
+            data, SPECS[name].signature
+        )
+
+
+def test_execute_purchase():
+    builder = RequestBuilder(SETTINGS, "1.2.3.4")
+    data = builder.execute_purchase("1", "token", 12.345, "order")
+    assert data["DS_MERCHANT_AMOUNT"] == "1234"
+    assert data["DS_MERCHANT_CURRENCY"] == "EUR"
+    assert data["DS_MERCHANT_PRODUCTDESCRIPTION"] == ""
+    assert data["DS_MERCHANT_SCORING"] == 0
+    assert data["DS_MERCHANT_MERCHANTSIGNATURE"] == signature(
+        "code", "1", "token", "1", "1234", "order"
+    )
+
+    with pytest.raises(ValueError) as e:
+        builder.execute_purchase("1", "token", 0, "order")
+    assert str(e.value) == "paytpv.executeCharge(): el importe debe ser positivo: 0"
+    with pytest.raises(ValueError):
+        builder.execute_purchase("1", "token", 1, "o" * 21)
+    with pytest.raises(ValueError):
+        builder.execute_purchase("1", "token", 1, "order", "d" * 41)
+    with pytest.raises(ValueError):
+        builder.execute_refund("1", "token", -1, "order", "authcode")
+
+
+def test_builders_are_per_settings():
+    other = dict(SETTINGS, MERCHANTCODE="other", MERCHANTPASSWORD="secret")
+    data = RequestBuilder(other).info_user("1", "token")
+    assert data["DS_MERCHANT_MERCHANTCODE"] == "other"
+    assert data["DS_ORIGINAL_IP"] is None
+    assert data["DS_MERCHANT_MERCHANTSIGNATURE"] == sha1(
+        b"other1token1secret"
+    ).hexdigest()
+
+
+def test_custom_spec():
+    spec = OperationSpec(
+        "ping",
+        args=["value"],
+        fields=[("DS_KIND", Const("ping")), ("DS_VALUE", "value")],
+        signature=["DS_KIND", "DS_VALUE"],
+    )
+    ping = spec.compile(RequestBuilder(SETTINGS), SETTINGS)
+    assert ping("1") == {
+        "DS_KIND": "ping",
+        "DS_VALUE": "1",
+        "DS_MERCHANT_MERCHANTSIGNATURE": signature("ping", "1"),
+    }
@@ -10,6 +10,7 @@ from requests.exceptions import ConnectionError
 from paytpv.client import PaytpvClient
 from paytpv.client import PaytpvAsyncClient
 from paytpv.exc import PaytpvException
+from paytpv.wsdl import WsdlCache
 
 
 T1 = "4539232076648253"
@@ -51,11 +52,14 @@ def test_connection(paytpv, settings):
     # ok
     assert paytpv.client
 
-    # connection error
+    # unreachable wsdl: client is built from the bundled copy
+    settings["PAYTPVWSDL"] = "https://localhost"
+    paytpv = PaytpvClient(settings, ip="1.2.3.4")
+    assert paytpv.client.service._binding_options["address"] == settings["PAYTPVURL"]
+
+    # connection error on refresh
     with pytest.raises(ConnectionError):
-        settings["PAYTPVWSDL"] = "https://localhost"
-        paytpv = PaytpvClient(settings, ip="1.2.3.4")
-        paytpv.client
+        WsdlCache(ttl=0).refresh(settings["PAYTPVWSDL"])
 
 
 def test_add_user(paytpv):
@@ -89,7 +93,7 @@ def test_add_user(paytpv):
 
 
 @pytest.mark.asyncio
-async def test_add_user_async(paytpv_async, event_loop):
+async def test_add_user_async(paytpv_async):
     # error expdate
     with pytest.raises(PaytpvException) as e:
         res = await paytpv_async.add_user(pan="1", expdate="1", cvv="1", name="1")
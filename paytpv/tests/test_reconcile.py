@@ -0,0 +1,133 @@
+# encoding: utf-8
+import io
+
+import pytest
+
+from paytpv.journal import Journal
+from paytpv.reconcile import CENTS
+from paytpv.reconcile import CHARGE
+from paytpv.reconcile import EUROS
+from paytpv.reconcile import REFUND
+from paytpv.reconcile import Entry
+from paytpv.reconcile import Reconciler
+from paytpv.reconcile import cents
+from paytpv.reconcile import read_settlement
+from paytpv.reconcile import records_from_journal
+
+
+EXPORT = """Order;TransactionType;Amount;AuthCode
+o1;1;10,00;A1
+o2;1;20,00;A2
+o3-renamed;1;30,00;A3
+o4;1;41,00;A4
+o9;1;90,00;A9
+o1;2;5,00;A1
+o1;2;5,00;A1
+o1;2;5,00;A1
+"""
+
+
+def local():
+    return [
+        {"operation": "execute_purchase", "order": "o1", "amount": "1000", "authcode": "A1"},
+        {"operation": "execute_purchase", "order": "o2", "amount": "2000", "authcode": "A2"},
+        {"operation": "execute_purchase", "order": "o3", "amount": "3000", "authcode": "A3"},
+        {"operation": "execute_purchase", "order": "o4", "amount": "4000", "authcode": "A4"},
+        {"operation": "execute_purchase", "order": "o5", "amount": "5000", "authcode": "A5"},
+        {"operation": "execute_refund", "order": "o1", "amount": "500", "authcode": "A1"},
+        {"operation": "execute_refund", "order": "o1", "amount": "500", "authcode": "A1"},
+    ]
+
+
+def test_cents():
+    assert cents("3300") == 3300
+    assert cents(33) == 33
+    assert cents("10", EUROS) == 1000
+    assert cents(10, EUROS) == 1000
+    assert cents("33.10", EUROS) == 3310
+    assert cents("1.033,05", EUROS) == 103305
+    with pytest.raises(ValueError):
+        cents("33.10")
+    with pytest.raises(ValueError):
+        cents("10", "dollars")
+
+
+def test_settlement_unit():
+    export = "Order,TransactionType,Amount,AuthCode\no1,1,10,A1\n"
+    assert next(read_settlement(io.StringIO(export))).amount == 1000
+    assert next(read_settlement(io.StringIO(export), unit=CENTS)).amount == 10
+
+
+def test_run():
+    report = Reconciler().run(local(), read_settlement(io.StringIO(EXPORT), delimiter=";"))
+    assert report.summary() == {
+        "matched": 5,
+        "missing_local": 1,
+        "missing_settlement": 1,
+        "pending": 0,
+        "amount_mismatch": 1,
+        "refunded_twice": 1,
+    }
+    assert report.missing_local == [Entry(CHARGE, "o9", 9000, "A9")]
+    assert [e.order for e in report.missing_settlement] == ["o5"]
+    assert report.amount_mismatch[0][1].amount == 4100
+    assert report.refunded_twice == [Entry(REFUND, "o1", 500, "A1")]
+    assert not report.ok
+
+    out = io.StringIO()
+    report.write_csv(out)
+    assert out.getvalue().count("\n") == 5
+
+
+def test_incremental(tmp_path):
+    path = str(tmp_path / "state.json")
+    reconciler = Reconciler.load(path, grace_days=1)
+    settled = [Entry(CHARGE, "o1", 1000, "A1")]
+    report = reconciler.run(local()[:2], settled, day=100)
+    assert report.matched == 1
+    assert [e.order for e in report.pending] == ["o2"]
+    reconciler.save(path)
+
+    reconciler = Reconciler.load(path, grace_days=1)
+    settled = [Entry(CHARGE, "o2", 2000, "A2"), Entry(REFUND, "o1", 1500, "A1")]
+    report = reconciler.run([], settled, day=101)
+    assert report.matched == 1
+    assert report.refunded_twice == [Entry(REFUND, "o1", 1500, "A1")]
+    assert report.pending == [] and report.missing_settlement == []
+
+    report = reconciler.run([local()[4]], [], day=102)
+    assert report.pending and not report.missing_settlement
+    report = reconciler.run([], [], day=103)
+    assert [e.order for e in report.missing_settlement] == ["o5"]
+
+
+def test_journal(tmp_path):
+    path = str(tmp_path / "journal")
+    data = {
+        "DS_MERCHANT_ORDER": "o1",
+        "DS_MERCHANT_AMOUNT": "1000",
+        "DS_IDUSER": "1",
+        "DS_MERCHANT_TERMINAL": "1",
+    }
+
+    class Res:
+        DS_MERCHANT_AUTHCODE = "A1"
+
+    with Journal(path) as journal:
+        journal.intent("execute_purchase", data)
+        journal.outcome("execute_purchase", data, Res())
+        journal.intent("execute_purchase", dict(data, DS_MERCHANT_ORDER="o2"))
+    assert list(records_from_journal(path)) == [
+        {"operation": "execute_purchase", "order": "o1", "amount": "1000", "authcode": "A1"}
+    ]
+
+
+@pytest.mark.parametrize("n", [20000])
+def test_large(n):
+    records = (
+        {"operation": "execute_purchase", "order": str(i), "amount": 100, "authcode": "A%d" % i}
+        for i in range(n)
+    )
+    settled = (Entry(CHARGE, str(i), 100, "A%d" % i) for i in reversed(range(n)))
+    report = Reconciler().run(records, settled)
+    assert report.matched == n and report.ok
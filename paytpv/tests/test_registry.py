@@ -0,0 +1,49 @@
+# encoding: utf-8
+import threading
+
+import pytest
+
+from paytpv.client import PaytpvClient
+from paytpv.registry import ClientRegistry
+
+
+def test_registry_shared_client(settings_local):
+    registry = ClientRegistry()
+    clients = []
+    threads = [
+        threading.Thread(target=lambda: clients.append(registry.get(settings_local)))
+        for _ in range(10)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(map(id, clients))) == 1
+    assert isinstance(clients[0], PaytpvClient)
+
+    other = dict(settings_local, MERCHANTTERMINAL="2")
+    assert registry.get(other) is not clients[0]
+
+    registry.clear()
+    assert registry.get(settings_local) is not clients[0]
+
+
+def test_registry_kwargs(settings_local):
+    registry = ClientRegistry()
+    client = registry.get(settings_local, ip="1.2.3.4")
+    assert registry.get(settings_local, ip="1.2.3.4") is client
+    assert registry.get(settings_local) is client
+    with pytest.raises(ValueError):
+        registry.get(settings_local, ip="5.6.7.8")
+
+
+def test_original_ip_per_call(settings_local):
+    builder = PaytpvClient(settings_local).builder
+    data = builder.info_user("1", "token", ip="1.2.3.4")
+    assert data["DS_ORIGINAL_IP"] == "1.2.3.4"
+    assert builder.info_user("1", "token")["DS_ORIGINAL_IP"] is None
+
+    data = PaytpvClient(settings_local, "5.6.7.8").builder.execute_purchase(
+        "1", "token", 10, "order"
+    )
+    assert data["DS_ORIGINAL_IP"] == "5.6.7.8"
@@ -0,0 +1,165 @@
+# encoding: utf-8
+import asyncio
+
+import pytest
+import requests
+
+from paytpv.exc import PaytpvCircuitOpen
+from paytpv.exc import PaytpvException
+from paytpv.exc import PaytpvLimitExceeded
+from paytpv.retry import CircuitBreaker
+from paytpv.retry import RetryPolicy
+
+
+def failing(*errors):
+    errors = list(errors)
+    calls = []
+
+    def func(*args):
+        calls.append(args)
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    func.calls = calls
+    return func
+
+
+def test_retry_codes():
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    func = failing(PaytpvException(1099), PaytpvException(1099))
+    assert policy.call("info_user", func, "data") == "ok"
+    assert len(func.calls) == 3
+
+    # terminal errors are raised at once
+    func = failing(PaytpvException(1001))
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", func)
+    assert len(func.calls) == 1
+
+    # charges are only retried if asked to
+    func = failing(PaytpvException(1099))
+    with pytest.raises(PaytpvException):
+        policy.call("execute_purchase", func)
+    assert len(func.calls) == 1
+    policy = RetryPolicy(max_attempts=3, base_delay=0, retry_unsafe=True)
+    func = failing(PaytpvException(1099))
+    assert policy.call("execute_purchase", func) == "ok"
+
+    # attempts exhausted
+    func = failing(*[PaytpvException(1099)] * 3)
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", func)
+    assert len(func.calls) == 3
+
+
+def test_retry_transport_errors():
+    policy = RetryPolicy(base_delay=0)
+
+    # timeouts are only retried for idempotent operations
+    func = failing(requests.exceptions.ReadTimeout())
+    assert policy.call("info_user", func) == "ok"
+    func = failing(requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        policy.call("execute_purchase", func)
+
+    # not sent: safe for every operation
+    func = failing(requests.exceptions.ConnectTimeout())
+    assert policy.call("execute_purchase", func) == "ok"
+
+
+def test_retry_deadline():
+    policy = RetryPolicy(max_attempts=10, base_delay=1, deadline=0)
+    func = failing(PaytpvException(1099))
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", func)
+    assert len(func.calls) == 1
+
+
+def test_retry_async():
+    policy = RetryPolicy(base_delay=0)
+    func = failing(PaytpvException(1099))
+
+    async def coro(*args):
+        return func(*args)
+
+    assert asyncio.run(policy.acall("info_user", coro)) == "ok"
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    policy = RetryPolicy(max_attempts=1, breaker=breaker)
+    for _ in range(2):
+        with pytest.raises(PaytpvException):
+            policy.call("info_user", failing(PaytpvException(1099)))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    func = failing()
+    with pytest.raises(PaytpvCircuitOpen):
+        policy.call("info_user", func)
+    assert not func.calls
+
+    # trial call after reset_timeout closes it
+    breaker.opened_at -= 60
+    assert policy.call("info_user", func) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # terminal errors do not count as failures
+    policy.call("info_user", failing())
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", failing(PaytpvException(1001)))
+    assert breaker.failures == 0
+
+
+def test_circuit_breaker_cancelled_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    policy = RetryPolicy(max_attempts=1, breaker=breaker)
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", failing(PaytpvException(1099)))
+    breaker.opened_at -= 60
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(policy.acall("info_user", cancelled))
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(PaytpvCircuitOpen):
+        policy.call("info_user", failing())
+
+    # a trial never settled is replaced after reset_timeout
+    breaker.opened_at -= 60
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(PaytpvCircuitOpen):
+        breaker.allow()
+    breaker.trial_at -= 60
+    assert policy.call("info_user", failing()) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_local_errors():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    policy = RetryPolicy(max_attempts=1, breaker=breaker)
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", failing(PaytpvException(1099)))
+    # Errors raised before reaching the gateway don't reset the count
+    with pytest.raises(ValueError):
+        policy.call("info_user", failing(ValueError("order too long")))
+    assert breaker.failures == 1
+
+    with pytest.raises(PaytpvException):
+        policy.call("info_user", failing(PaytpvException(1099)))
+    breaker.opened_at -= 60
+    # nor close a half-open circuit
+    with pytest.raises(PaytpvLimitExceeded):
+        policy.call("info_user", failing(PaytpvLimitExceeded("concurrency")))
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # HTTP errors other than 5xx are answers of the gateway
+    breaker.opened_at -= 60
+    response = requests.Response()
+    response.status_code = 404
+    with pytest.raises(requests.HTTPError):
+        policy.call("info_user", failing(requests.HTTPError(response=response)))
+    assert breaker.state == CircuitBreaker.CLOSED
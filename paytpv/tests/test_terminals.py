@@ -0,0 +1,107 @@
+# encoding: utf-8
+import asyncio
+
+import pytest
+
+from paytpv.exc import PaytpvException
+from paytpv.terminals import AsyncTerminalPool
+from paytpv.terminals import TerminalPool
+
+
+@pytest.fixture
+def terminals(server):
+    return [server.settings("1"), server.settings("2")]
+
+
+def test_round_robin(server, terminals):
+    pool = TerminalPool(terminals, ip="1.2.3.4")
+    users = [pool.add_user("4539232076648253", "0599", "123", "name") for _ in range(4)]
+    assert [pool.terminal_for(user.DS_IDUSER) for user in users] == ["1", "2", "1", "2"]
+
+    # Charges, refunds and user calls go to the terminal owning the token
+    user = users[1]
+    charge = pool.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "tp-rr-x")
+    pool.execute_refund(
+        user.DS_IDUSER, user.DS_TOKEN_USER, 10, "tp-rr-x", charge.DS_MERCHANT_AUTHCODE
+    )
+    assert pool.info_user(user.DS_IDUSER, user.DS_TOKEN_USER).DS_CARD_BRAND == "VISA"
+    pool.remove_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    assert user.DS_IDUSER not in pool.owners
+
+    with pytest.raises(PaytpvException):
+        pool.info_user(users[3].DS_IDUSER, users[3].DS_TOKEN_USER, terminal="1")
+
+    load = pool.load()
+    assert load["1"]["calls"] + load["2"]["calls"] == 9
+    assert load["1"]["errors"] == 1
+    assert load["2"]["in_flight"] == 0
+
+
+def test_user_terminal(server, terminals):
+    pool = TerminalPool(terminals, ip="1.2.3.4")
+    user = pool.add_user("4539232076648253", "0599", "123", "name", terminal="2")
+    # Users can only be charged by the terminal that added them
+    with pytest.raises(PaytpvException) as e:
+        pool.execute_purchase(
+            user.DS_IDUSER, user.DS_TOKEN_USER, 10, "tp-terminal", terminal="1"
+        )
+    assert e.value.code == 1001
+    charge = pool.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "tp-terminal")
+    pool.execute_refund(
+        user.DS_IDUSER, user.DS_TOKEN_USER, 5, "tp-terminal", charge.DS_MERCHANT_AUTHCODE
+    )
+    assert server.bankstore.charges["tp-terminal"]["refunded"] == 500
+
+
+def test_limiter_per_terminal(terminals):
+    from paytpv.limits import Limiter
+
+    pool = TerminalPool(terminals, limiter=lambda settings: Limiter(limit=5))
+    limiters = [client.limiter for client in pool.clients.values()]
+    assert len(set(map(id, limiters))) == 2
+
+    with pytest.raises(ValueError):
+        TerminalPool(terminals, limiter=Limiter())
+
+
+def test_least_loaded(terminals):
+    pool = TerminalPool(terminals, strategy="least_loaded", ip="1.2.3.4")
+    pool.stats["1"].in_flight = 3
+    assert pool.choose() == "2"
+    pool.stats["1"].in_flight = 0
+    pool.stats["2"].calls = 1
+    assert pool.choose() == "1"
+
+    with pytest.raises(ValueError):
+        TerminalPool(terminals, strategy="random")
+
+
+def test_async_pool(terminals):
+    async def run():
+        async with AsyncTerminalPool(terminals, ip="1.2.3.4") as pool:
+            users = await asyncio.gather(
+                *[pool.add_user("4539232076648253", "0599", "123", "name") for _ in range(4)]
+            )
+            owners = [pool.terminal_for(user.DS_IDUSER) for user in users]
+            assert sorted(owners) == ["1", "1", "2", "2"]
+            for user in users:
+                await pool.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+            assert sum(stats["calls"] for stats in pool.load().values()) == 8
+
+    asyncio.run(run())
+
+
+def test_async_cancelled(terminals):
+    async def run():
+        async with AsyncTerminalPool(terminals, ip="1.2.3.4") as pool:
+            client = pool.clients["1"]
+
+            async def hang(*args):
+                await asyncio.sleep(10)
+
+            client.info_user = hang
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.info_user("1", "token"), 0.01)
+            assert pool.load()["1"]["in_flight"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,67 @@
+# encoding: utf-8
+import pytest
+import requests
+
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.testing import ERROR_DUPLICATE_ORDER
+from paytpv.testing import ERROR_OPERATION_NOT_FOUND
+from paytpv.testing import ERROR_REFUND_AMOUNT
+from paytpv.testing import ERROR_SIGNATURE
+from paytpv.testing import ERROR_UNEXPECTED
+from paytpv.testing import FakeBankstore
+from paytpv.testing import FakeBankstoreServer
+
+
+@pytest.fixture
+def client(settings_local):
+    return PaytpvClient(settings_local, "1.2.3.4", engine="fast")
+
+
+def test_wsdl(server):
+    res = requests.get(server.settings()["PAYTPVWSDL"])
+    assert res.status_code == 200
+    assert server.url in res.text
+
+
+def test_signature(settings_local):
+    client = PaytpvClient(dict(settings_local, MERCHANTPASSWORD="wrong"), "1.2.3.4")
+    with pytest.raises(PaytpvException) as e:
+        client.info_user("1", "token")
+    assert e.value.code == ERROR_SIGNATURE
+
+
+def test_charges_and_refunds(client):
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    charge = client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "fake-1")
+
+    with pytest.raises(PaytpvException) as e:
+        client.execute_purchase(user.DS_IDUSER, user.DS_TOKEN_USER, 10, "fake-1")
+    assert e.value.code == ERROR_DUPLICATE_ORDER
+
+    with pytest.raises(PaytpvException) as e:
+        client.execute_refund(user.DS_IDUSER, user.DS_TOKEN_USER, 5, "fake-1", "bad")
+    assert e.value.code == ERROR_OPERATION_NOT_FOUND
+
+    authcode = charge.DS_MERCHANT_AUTHCODE
+    client.execute_refund(user.DS_IDUSER, user.DS_TOKEN_USER, 6, "fake-1", authcode)
+    with pytest.raises(PaytpvException) as e:
+        client.execute_refund(user.DS_IDUSER, user.DS_TOKEN_USER, 6, "fake-1", authcode)
+    assert e.value.code == ERROR_REFUND_AMOUNT
+
+
+def test_failure_injection():
+    bankstore = FakeBankstore("MERCHANT", "PASSWORD", ["1"])
+    server = FakeBankstoreServer(bankstore, failure_rate=1).start()
+    try:
+        client = PaytpvClient(server.settings(), "1.2.3.4", engine="fast")
+        with pytest.raises(PaytpvException) as e:
+            client.info_user("1", "token")
+        assert e.value.code == ERROR_UNEXPECTED
+
+        server.failure_rate = 0
+        server.http_error_rate = 1
+        with pytest.raises(requests.exceptions.HTTPError):
+            client.info_user("1", "token")
+    finally:
+        server.stop()
@@ -0,0 +1,120 @@
+# encoding: utf-8
+import asyncio
+
+import pytest
+import requests
+
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.exc import PaytpvException
+from paytpv.testing import FakeBankstore
+from paytpv.testing import FakeBankstoreServer
+from paytpv.transport import PooledAsyncTransport
+from paytpv.transport import PooledTransport
+
+
+def test_operation_timeout():
+    transport = PooledAsyncTransport(timeout=10, operation_timeouts={"add_user": 2})
+    action = '"https://secure.paytpv.com/gateway/xml-bankstore#add_user"'
+    assert transport.operation_timeout({"SOAPAction": action}) == 2
+    assert transport.operation_timeout({}) == 10
+
+
+def test_pooled_connections(server, settings_local):
+    transport = PooledAsyncTransport(max_connections=2, concurrency=2)
+
+    async def run():
+        async with PaytpvAsyncClient(settings_local, transport=transport) as client:
+            user = await client.add_user(
+                "4539232076648253", "0599", "123", "name", ip="1.2.3.4"
+            )
+            results = await asyncio.gather(
+                *[
+                    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER, ip="1.2.3.4")
+                    for _ in range(20)
+                ]
+            )
+            assert all(res.DS_CARD_BRAND == "VISA" for res in results)
+
+            with pytest.raises(PaytpvException) as e:
+                await client.remove_user("0", "token", ip="1.2.3.4")
+            assert e.value.code == 1001
+
+    asyncio.run(run())
+    assert len(server.connections) <= 2
+
+    # a new loop gets its own pool
+    asyncio.run(run())
+
+
+def test_async_transport_load(server):
+    transport = PooledAsyncTransport()
+    assert not hasattr(transport, "wsdl_client")
+    assert transport.load(server.url + "?wsdl") == server.wsdl.encode()
+
+
+def test_timeouts():
+    transport = PooledTransport(
+        connect_timeout=1, timeout=10, operation_timeouts={"execute_purchase": 60}
+    )
+    assert transport.timeouts("execute_purchase") == (1, 60)
+    assert transport.timeouts("info_user") == (1, 10)
+
+
+@pytest.mark.parametrize("engine", ["zeep", "fast"])
+def test_submit(server, settings_local, engine):
+    transport = PooledTransport(max_connections=2)
+    with PaytpvClient(
+        settings_local, "1.2.3.4", transport=transport, engine=engine, max_workers=8
+    ) as client:
+        user = client.add_user("4539232076648253", "0599", "123", "name")
+        futures = [
+            client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER)
+            for _ in range(20)
+        ]
+        futures.append(client.submit("remove_user", "0", "token"))
+        assert all(f.result().DS_CARD_BRAND == "VISA" for f in futures[:-1])
+        with pytest.raises(PaytpvException):
+            futures[-1].result()
+        with pytest.raises(AttributeError):
+            client.submit("get_iframe_url")
+    assert len(server.connections) <= 2
+
+
+@pytest.mark.parametrize("engine", ["zeep", "fast"])
+def test_read_timeout(engine):
+    bankstore = FakeBankstore("MERCHANT", "PASSWORD", ["1"])
+    server = FakeBankstoreServer(bankstore, latency=0.5).start()
+    try:
+        transport = PooledTransport(timeout=5, operation_timeouts={"info_user": 0.1})
+        client = PaytpvClient(
+            server.settings(), "1.2.3.4", transport=transport, engine=engine
+        )
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.info_user("1", "token")
+        client.close()
+    finally:
+        server.stop()
+
+
+def test_async_submit(server, settings_local):
+    async def run():
+        async with PaytpvAsyncClient(settings_local, "1.2.3.4") as client:
+            user = await client.add_user("4539232076648253", "0599", "123", "name")
+            task = client.submit("info_user", user.DS_IDUSER, user.DS_TOKEN_USER)
+            assert (await task).DS_CARD_BRAND == "VISA"
+
+    asyncio.run(run())
+
+
+def test_async_close(server, settings_local):
+    async def run():
+        client = PaytpvAsyncClient(settings_local, "1.2.3.4")
+        task = client.keep_alive(interval=10)
+        # Sync close only cancels the keep-alive, aclose() closes the pool
+        client.close()
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        await client.aclose()
+
+    asyncio.run(run())
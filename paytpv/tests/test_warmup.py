@@ -0,0 +1,101 @@
+# encoding: utf-8
+import asyncio
+import time
+
+from paytpv.client import PaytpvAsyncClient
+from paytpv.client import PaytpvClient
+from paytpv.hooks import Hook
+from paytpv.transport import PooledAsyncTransport
+from paytpv.transport import PooledTransport
+from paytpv.warmup import Warmth
+
+
+class Events(Hook):
+    def __init__(self):
+        self.events = []
+
+    def on_call(self, event):
+        self.events.append(event)
+
+
+def test_warmth():
+    warmth = Warmth(idle_timeout=0.05)
+    assert warmth.idle() is None
+    started = warmth.start()
+    assert started[1]
+    warmth.done(started)
+    warmth.done(warmth.start())
+    time.sleep(0.06)
+    warmth.done(warmth.start())
+    stats = warmth.stats()
+    assert stats["cold"] == 2
+    assert stats["warm"] == 1
+    assert stats["warm_mean"] is not None
+    warmth.touch()
+    assert warmth.idle() < 0.05
+
+
+def test_warm_up(server, settings_local):
+    hook = Events()
+    client = PaytpvClient(
+        settings_local, "1.2.3.4", transport=PooledTransport(max_connections=3), hooks=[hook]
+    )
+    assert client.warm_up() == 3
+    assert len(server.connections) == 3
+    # Open connections are reused
+    assert client.warm_up() == 3
+    assert len(server.connections) == 3
+
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    # Calls use the connections opened by the warm-up
+    assert len(server.connections) == 3
+    assert client.warmth.stats()["cold"] == 0
+    assert client.warmth.stats()["warm"] == 2
+    assert not any(event.cold for event in hook.events)
+
+    client.close()
+
+
+def test_cold(settings_local):
+    hook = Events()
+    client = PaytpvClient(settings_local, "1.2.3.4", hooks=[hook], idle_timeout=0.05)
+    user = client.add_user("4539232076648253", "0599", "123", "name")
+    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    time.sleep(0.06)
+    client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+    assert [event.cold for event in hook.events] == [True, False, True]
+    assert client.warmth.stats()["cold"] == 2
+
+
+def test_keep_alive(server, settings_local):
+    client = PaytpvClient(settings_local, "1.2.3.4", idle_timeout=0.1, engine="fast")
+    pings = server.pings
+    keep_alive = client.keep_alive(interval=0.03, connections=2)
+    time.sleep(0.2)
+    assert server.pings - pings >= 4
+    client.close()
+    assert not keep_alive.is_alive()
+    # Pings keep the client warm
+    assert client.warmth.idle() < 0.1
+
+
+def test_async(server, settings_local):
+    async def run():
+        transport = PooledAsyncTransport(max_keepalive_connections=2)
+        async with PaytpvAsyncClient(
+            settings_local, "1.2.3.4", transport=transport, idle_timeout=0.1
+        ) as client:
+            assert await client.warm_up() == 2
+            assert len(server.connections) == 2
+            user = await client.add_user("4539232076648253", "0599", "123", "name")
+            await client.info_user(user.DS_IDUSER, user.DS_TOKEN_USER)
+            assert client.warmth.stats()["cold"] == 0
+
+            pings = server.pings
+            task = client.keep_alive(interval=0.03, connections=1)
+            await asyncio.sleep(0.2)
+            assert server.pings - pings >= 3
+        assert task.cancelled()
+
+    asyncio.run(run())
@@ -0,0 +1,122 @@
+# encoding: utf-8
+import json
+import os
+
+import pytest
+import zeep
+from zeep.wsdl import Document
+
+from paytpv.wsdl import BINDING
+from paytpv.wsdl import BUNDLED_WSDL
+from paytpv.wsdl import WsdlCache
+from paytpv.wsdl import load_document
+
+
+URL = "https://secure.paytpv.com/gateway/xml-bankstore?wsdl"
+
+
+def test_bundled_wsdl(tmpdir):
+    cache = WsdlCache(path=str(tmpdir), ttl=None)
+    filename, checksum = cache.resolve(URL)
+    assert filename == BUNDLED_WSDL
+
+    document = load_document(URL, cache)
+    assert load_document(URL, cache) is document
+    operations = document.bindings[
+        "{https://secure.paytpv.com/gateway/xml-bankstore}PaytpvBankStoreBinding"
+    ]._operations
+    assert {
+        "add_user",
+        "info_user",
+        "remove_user",
+        "execute_purchase",
+        "execute_refund",
+    } <= set(operations)
+
+
+def test_cache_entry(tmpdir):
+    cache = WsdlCache(path=str(tmpdir), ttl=None)
+    with open(BUNDLED_WSDL, "rb") as f:
+        content = f.read()
+
+    filename, meta = cache.add(URL, content)
+    assert cache.resolve(URL) == (filename, meta["sha256"])
+    assert not cache.is_expired(meta)
+
+    # corrupted entry is discarded
+    with open(filename, "ab") as f:
+        f.write(b" ")
+    assert cache.get(URL) is None
+    assert cache.resolve(URL)[0] == BUNDLED_WSDL
+
+
+def test_cache_expired(tmpdir):
+    url = "http://localhost:1/?wsdl"
+    cache = WsdlCache(path=str(tmpdir), ttl=60, timeout=0.1)
+    with open(BUNDLED_WSDL, "rb") as f:
+        filename, meta = cache.add(url, f.read())
+
+    meta["fetched"] -= 120
+    with open(filename[: -len(".wsdl")] + ".json", "w") as f:
+        json.dump(meta, f)
+    assert cache.is_expired(cache.get(url)[1])
+
+    # refresh fails: stale copy is served, or the bundled one if none
+    assert cache.resolve(url)[0] == filename
+    assert cache.resolve("http://localhost:2/?wsdl")[0] == BUNDLED_WSDL
+
+
+def test_cache_failing(tmpdir, monkeypatch):
+    url = "http://localhost:3/?wsdl"
+    cache = WsdlCache(path=str(tmpdir), timeout=0.1)
+    refresh = cache.refresh
+    calls = []
+
+    def counted(url):
+        calls.append(url)
+        return refresh(url)
+
+    monkeypatch.setattr(cache, "refresh", counted)
+    assert cache.resolve(url)[0] == BUNDLED_WSDL
+    # Failed downloads are not tried again for a while, by any cache
+    assert cache.resolve(url)[0] == BUNDLED_WSDL
+    assert WsdlCache(path=str(tmpdir)).is_failing(url)
+    assert len(calls) == 1
+
+    cache.retry_after = 0
+    assert cache.resolve(url)[0] == BUNDLED_WSDL
+    assert len(calls) == 2
+
+
+def test_live_wsdl(tmpdir, server):
+    url = server.settings()["PAYTPVWSDL"]
+    cache = WsdlCache(path=str(tmpdir))
+    filename, checksum = cache.resolve(url)
+    assert filename.startswith(str(tmpdir))
+    with open(filename) as f:
+        assert f.read() == server.wsdl
+    # Fresh entries are not downloaded again
+    assert cache.resolve(url) == (filename, checksum)
+
+
+def parts(document):
+    """
+    Names and types of the request and response parts of each operation
+    """
+    return {
+        name: [
+            [(part, element.type.qname.text) for part, element in message.body.type.elements]
+            for message in (operation.input, operation.output)
+        ]
+        for name, operation in document.bindings[BINDING]._operations.items()
+    }
+
+
+@pytest.mark.skipif("MERCHANTCODE" not in os.environ, reason="needs the live gateway")
+def test_bundled_is_live(tmpdir):
+    # The bundled copy must describe the operations as the gateway does
+    filename, meta = WsdlCache(path=str(tmpdir)).refresh(URL)
+    live = parts(Document(filename, zeep.Transport()))
+    bundled = parts(Document(BUNDLED_WSDL, zeep.Transport()))
+    for name in bundled:
+        assert bundled[name] == live[name], name
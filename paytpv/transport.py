@@ -0,0 +1,204 @@
+# encoding: utf-8
+import asyncio
+import logging
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from zeep.transports import AsyncTransport
+from zeep.transports import Transport
+from zeep.utils import get_version
+
+from paytpv import forks
+
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+def soap_operation(headers):
+    # zeep sends the operation in the SOAPAction header: "<ns>#<operation>"
+    action = headers.get("SOAPAction", "").strip('"')
+    return action.rpartition("#")[2]
+
+
+class PooledTransport(Transport):
+    """
+    zeep transport on a requests session with a sized keep-alive pool.
+
+    The session is thread-safe, one transport can be shared by all the
+    threads of a process. With ``block=True`` threads wait for a free
+    connection instead of opening extra ones that are not kept alive.
+
+    :param max_connections: connections kept alive per host
+    :param block: wait for a free connection when all are in use
+    :param connect_timeout: seconds to establish a connection
+    :param timeout: default read timeout of an operation, in seconds
+    :param operation_timeouts: read timeout by operation name, ie
+        ``{"execute_purchase": 60}``
+    """
+
+    def __init__(
+        self,
+        max_connections=10,
+        block=True,
+        connect_timeout=5,
+        timeout=30,
+        operation_timeouts=None,
+        verify_ssl=True,
+    ):
+        session = requests.Session()
+        session.verify = verify_ssl
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=max_connections,
+            pool_block=block,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        super().__init__(timeout=timeout, session=session)
+        self._close_session = True
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.operation_timeouts = operation_timeouts or {}
+        forks.register(self)
+
+    def after_fork(self):
+        forks.reset_session(self.session)
+
+    def timeouts(self, operation):
+        """
+        requests (connect, read) timeout of 'operation'
+        """
+        return (
+            self.connect_timeout,
+            self.operation_timeouts.get(operation, self.timeout),
+        )
+
+    def close(self):
+        self.session.close()
+
+    def post(self, address, message, headers):
+        self.logger.debug("HTTP Post to %s:\n%s", address, message)
+        response = self.session.post(
+            address,
+            data=message,
+            headers=headers,
+            timeout=self.timeouts(soap_operation(headers)),
+        )
+        self.logger.debug(
+            "HTTP Response from %s (status: %d):\n%s",
+            address,
+            response.status_code,
+            response.content,
+        )
+        return response
+
+
+class PooledAsyncTransport(AsyncTransport):
+    """
+    zeep async transport on pooled keep-alive httpx connections.
+
+    Each event loop gets its own connection pool and concurrency semaphore,
+    so one transport can be shared by all the tasks of a worker.
+
+    :param max_connections: open connections per pool
+    :param max_keepalive_connections: idle connections kept alive
+    :param keepalive_expiry: seconds an idle connection is kept
+    :param timeout: default timeout of an operation, in seconds
+    :param operation_timeouts: timeout by operation name, ie
+        ``{"execute_purchase": 60}``
+    :param concurrency: max operations in flight per loop, None for no limit
+    """
+
+    def __init__(
+        self,
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=30,
+        timeout=30,
+        operation_timeouts=None,
+        concurrency=None,
+        verify_ssl=True,
+    ):
+        self._close_session = False
+        self.cache = None
+        self.logger = logging.getLogger(__name__)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_keepalive_connections = max_keepalive_connections
+        self.timeout = timeout
+        self.operation_timeouts = operation_timeouts or {}
+        self.concurrency = concurrency
+        self.verify_ssl = verify_ssl
+        self.headers = {"User-Agent": "Zeep/%s (www.python-zeep.org)" % get_version()}
+        self._pools = weakref.WeakKeyDictionary()
+        forks.register(self)
+
+    def after_fork(self):
+        # The loops of the parent don't run in the child
+        self._pools = weakref.WeakKeyDictionary()
+
+    def _pool(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                verify=self.verify_ssl,
+                headers=self.headers,
+            )
+            semaphore = asyncio.Semaphore(self.concurrency) if self.concurrency else None
+            pool = self._pools[loop] = (client, semaphore)
+        return pool
+
+    @property
+    def client(self):
+        return self._pool()[0]
+
+    def _load_remote_data(self, url):
+        # WSDLs are loaded by paytpv.wsdl, this is only used if zeep itself
+        # has to download a document: no client is kept open for it
+        with httpx.Client(
+            verify=self.verify_ssl, timeout=self.timeout, headers=self.headers
+        ) as client:
+            response = client.get(url)
+        response.raise_for_status()
+        return response.content
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pools.pop(loop, None)
+        if pool is not None:
+            await pool[0].aclose()
+
+    def operation_timeout(self, headers):
+        return self.operation_timeouts.get(soap_operation(headers), self.timeout)
+
+    async def post(self, address, message, headers):
+        client, semaphore = self._pool()
+        timeout = self.operation_timeout(headers)
+        self.logger.debug("HTTP Post to %s:\n%s", address, message)
+        if semaphore is None:
+            response = await client.post(
+                address, content=message, headers=headers, timeout=timeout
+            )
+        else:
+            async with semaphore:
+                response = await client.post(
+                    address, content=message, headers=headers, timeout=timeout
+                )
+        self.logger.debug(
+            "HTTP Response from %s (status: %d):\n%s",
+            address,
+            response.status_code,
+            response.content,
+        )
+        return response
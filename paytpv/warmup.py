@@ -0,0 +1,181 @@
+# encoding: utf-8
+"""
+Warm-up and keep-alive of client connections.
+
+After a quiet period the pooled connections to the gateway are closed,
+and the next call pays for DNS, TCP and TLS again. ``client.warm_up()``
+opens connections before the first call, ``client.keep_alive()`` pings
+the gateway while the client is idle so they stay open:
+
+    client = PaytpvClient(settings)
+    client.warm_up(connections=4)
+    client.keep_alive(interval=20, connections=4)
+
+Pings are HEAD requests to the endpoint, sent at the same time. Each one
+keeps its connection until all of them are answered, so they use (or
+open) as many connections, up to the size of the pool.
+
+``client.warmth`` counts cold and warm requests. A request is cold when
+the client sent nothing, calls nor pings, for 'idle_timeout' seconds, as
+its connections are likely closed by then; set it below the keep-alive
+timeout of the gateway.
+"""
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 30
+
+
+class Warmth:
+    """
+    Cold and warm requests of a client, and seconds spent in each
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.last = None
+        self.cold = 0
+        self.warm = 0
+        self.cold_seconds = 0.0
+        self.warm_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def idle(self):
+        """
+        Seconds since the last request or ping, None before any
+        """
+        if self.last is None:
+            return None
+        return time.monotonic() - self.last
+
+    def touch(self):
+        self.last = time.monotonic()
+
+    def start(self):
+        """
+        Returns (start, cold) of a request
+        """
+        now = time.monotonic()
+        cold = self.last is None or now - self.last > self.idle_timeout
+        self.last = now
+        return now, cold
+
+    def done(self, started):
+        start, cold = started
+        self.last = now = time.monotonic()
+        with self._lock:
+            if cold:
+                self.cold += 1
+                self.cold_seconds += now - start
+            else:
+                self.warm += 1
+                self.warm_seconds += now - start
+
+    def stats(self):
+        return {
+            "cold": self.cold,
+            "warm": self.warm,
+            "cold_mean": self.cold_seconds / self.cold if self.cold else None,
+            "warm_mean": self.warm_seconds / self.warm if self.warm else None,
+        }
+
+
+def ping(session, url, connections=1, timeout=5):
+    """
+    Sends 'connections' HEAD requests to 'url' at the same time with a
+    requests session, each one holding its connection until all are
+    answered. Returns how many distinct connections answered.
+    """
+    barrier = threading.Barrier(connections)
+    opened = set()
+
+    def head():
+        try:
+            res = session.head(url, timeout=timeout, stream=True)
+        except Exception as e:
+            logger.warning("Ping to %s failed: %s", url, e)
+            # Nobody waits for it
+            barrier.abort()
+            return
+        try:
+            opened.add(id(res.raw.connection))
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass
+        finally:
+            # Read to the end, the connection goes back to the pool
+            res.content
+
+    threads = [threading.Thread(target=head) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(opened)
+
+
+async def aping(client, url, connections=1, timeout=5):
+    """
+    Async version of ping, 'client' an httpx.AsyncClient
+    """
+    import asyncio
+
+    opened = set()
+    all_open = asyncio.Event()
+
+    async def head():
+        try:
+            async with client.stream("HEAD", url, timeout=timeout) as res:
+                opened.add(id(res.extensions.get("network_stream")))
+                if len(opened) == connections:
+                    all_open.set()
+                await asyncio.wait_for(all_open.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except Exception as e:
+            logger.warning("Ping to %s failed: %s", url, e)
+            # Nobody waits for it
+            all_open.set()
+
+    await asyncio.gather(*[head() for _ in range(connections)])
+    return len(opened)
+
+
+class KeepAlive(threading.Thread):
+    """
+    Pings the gateway every 'interval' seconds while the client is idle
+    """
+
+    def __init__(self, client, interval, connections=1):
+        super().__init__(name="paytpv-keepalive", daemon=True)
+        self.client = client
+        self.interval = interval
+        self.connections = connections
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            idle = self.client.warmth.idle()
+            if idle is None or idle >= self.interval:
+                self.client.ping(self.connections)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+async def keep_alive(client, interval, connections=1):
+    """
+    Async version of KeepAlive, run as a task of the client loop
+    """
+    import asyncio
+
+    while True:
+        await asyncio.sleep(interval)
+        idle = client.warmth.idle()
+        if idle is None or idle >= interval:
+            await client.ping(connections)
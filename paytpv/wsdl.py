@@ -0,0 +1,184 @@
+# encoding: utf-8
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+import zeep
+from zeep.proxy import AsyncServiceProxy
+from zeep.proxy import ServiceProxy
+from zeep.transports import AsyncTransport
+from zeep.wsdl import Document
+
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_WSDL = os.path.join(os.path.dirname(__file__), "data", "xml-bankstore.wsdl")
+NAMESPACE = "https://secure.paytpv.com/gateway/xml-bankstore"
+BINDING = "{%s}PaytpvBankStoreBinding" % NAMESPACE
+
+# Bump when the on-disk layout changes, so stale entries are ignored
+CACHE_VERSION = 1
+
+# Seconds a downloaded WSDL is used before checking the gateway again
+CACHE_TTL = 86400
+
+# Seconds without downloading a WSDL again after a failed download
+RETRY_AFTER = 300
+
+# url: monotonic time of the last failed download, for all caches
+_failures = {}
+
+
+def default_cache_path():
+    return os.environ.get("PAYTPV_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "paytpv"
+    )
+
+
+class WsdlCache:
+    """
+    On-disk copy of the bankstore WSDL.
+
+    Missing entries, and entries older than ``ttl`` seconds, are downloaded
+    again, falling back to the stale copy or, if there is none, the WSDL
+    bundled with the package. After a failed download the fallback is used
+    for ``retry_after`` seconds without trying again. With ``ttl=None`` the
+    network is never used.
+    """
+
+    def __init__(self, path=None, ttl=CACHE_TTL, timeout=5, retry_after=RETRY_AFTER):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry_after = retry_after
+
+    def _files(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        base = os.path.join(self.path, key)
+        return base + ".wsdl", base + ".json"
+
+    def get(self, url):
+        """
+        Returns (filename, meta) for a valid entry of 'url', or None
+        """
+        filename, metafile = self._files(url)
+        try:
+            with open(metafile) as f:
+                meta = json.load(f)
+            with open(filename, "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        if (
+            meta.get("version") != CACHE_VERSION
+            or meta.get("url") != url
+            or meta.get("sha256") != hashlib.sha256(content).hexdigest()
+        ):
+            logger.info("Discarding invalid WSDL cache entry for %s", url)
+            return None
+        return filename, meta
+
+    def add(self, url, content):
+        os.makedirs(self.path, exist_ok=True)
+        filename, metafile = self._files(url)
+        meta = {
+            "version": CACHE_VERSION,
+            "url": url,
+            "fetched": time.time(),
+            "sha256": hashlib.sha256(content).hexdigest(),
+        }
+        # Write to temp files and rename, so readers never see a partial entry
+        for path, data in ((filename, content), (metafile, json.dumps(meta).encode())):
+            tmp = "%s.%d.tmp" % (path, os.getpid())
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return filename, meta
+
+    def is_expired(self, meta):
+        return self.ttl is not None and time.time() - meta["fetched"] > self.ttl
+
+    def is_failing(self, url):
+        """
+        True while a failed download of 'url' is recent
+        """
+        failed = _failures.get(url)
+        return failed is not None and time.monotonic() - failed < self.retry_after
+
+    def refresh(self, url):
+        res = requests.get(url, timeout=self.timeout)
+        res.raise_for_status()
+        return self.add(url, res.content)
+
+    def resolve(self, url):
+        """
+        Returns (filename, sha256) of the WSDL to parse for 'url'
+        """
+        entry = self.get(url)
+        if (
+            self.ttl is not None
+            and (entry is None or self.is_expired(entry[1]))
+            and not self.is_failing(url)
+        ):
+            try:
+                entry = self.refresh(url)
+            except (requests.RequestException, OSError) as e:
+                logger.warning("Could not refresh WSDL %s: %s", url, e)
+                _failures[url] = time.monotonic()
+            else:
+                _failures.pop(url, None)
+        if entry is not None:
+            return entry[0], entry[1]["sha256"]
+        with open(BUNDLED_WSDL, "rb") as f:
+            return BUNDLED_WSDL, hashlib.sha256(f.read()).hexdigest()
+
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+def _after_fork():
+    # Parsed documents are kept, shared copy-on-write with the parent
+    global _documents_lock
+    _documents_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def load_document(url, cache=None):
+    """
+    Returns the parsed zeep Document for 'url', parsed once per process
+    and checksum.
+    """
+    filename, checksum = (cache or WsdlCache()).resolve(url)
+    key = (checksum, zeep.__version__)
+    with _documents_lock:
+        document = _documents.get(key)
+        if document is None:
+            document = _documents[key] = Document(filename, zeep.Transport())
+    return document
+
+
+def create_client(settings, transport=None, cache=None):
+    """
+    Returns a zeep client for 'settings', an async one for async transports
+    """
+    if isinstance(transport, AsyncTransport):
+        client_class, proxy_class = zeep.AsyncClient, AsyncServiceProxy
+    else:
+        client_class, proxy_class = zeep.Client, ServiceProxy
+    client = client_class(
+        load_document(settings["PAYTPVWSDL"], cache), transport=transport
+    )
+    if BINDING in client.wsdl.bindings:
+        # Send to the configured endpoint, not the address in the WSDL
+        client._default_service = proxy_class(
+            client, client.wsdl.bindings[BINDING], address=settings["PAYTPVURL"]
+        )
+    return client
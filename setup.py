@@ -9,13 +9,21 @@ setup(name='paytpv',
       author_email='jordic@vinissimus.com',
       url='https://github.com/vinissimus/paytpv',
       packages=['paytpv'],
+      package_data={'paytpv': ['data/*.wsdl']},
       install_requires=[
         'zeep',
+        'requests',
       ],
       extras_require={
         'async': [
           'zeep[async]',
-          'aiohttp',
+          'httpx',
+        ],
+        'prometheus': [
+          'prometheus_client',
+        ],
+        'opentelemetry': [
+          'opentelemetry-api',
         ],
         'test': [
             'pytest',